@@ -0,0 +1,263 @@
+"""Аватары-котики: детерминированные по user_id, с кэшем PNG и локальной отрисовкой"""
+
+import os
+import zlib
+import struct
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Создаем логгер для этого модуля
+logger = logging.getLogger(__name__)
+
+
+def avatar_key(user_id: int, variant: int = 0) -> str:
+    """Ключ аватара: один и тот же для пользователя, пока он не попросит другой"""
+    return hashlib.sha256(f'{user_id}:{variant}'.encode()).hexdigest()[:16]
+
+
+def _encode_png(width: int, height: int, rows: list) -> bytes:
+    """PNG (RGB, 8 бит) из списка строк пикселей без сторонних библиотек"""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    raw = b''.join(b'\x00' + bytes(row) for row in rows)
+    return (
+        b'\x89PNG\r\n\x1a\n'
+        + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+        + chunk(b'IDAT', zlib.compress(raw, 6))
+        + chunk(b'IEND', b'')
+    )
+
+
+def _in_triangle(x: float, y: float, a: tuple, b: tuple, c: tuple) -> bool:
+    def side(p, q):
+        return (x - q[0]) * (p[1] - q[1]) - (p[0] - q[0]) * (y - q[1])
+
+    d1, d2, d3 = side(a, b), side(b, c), side(c, a)
+    return not ((d1 < 0 or d2 < 0 or d3 < 0) and (d1 > 0 or d2 > 0 or d3 > 0))
+
+
+def render_avatar(key: str, size: int = 256) -> bytes:
+    """Процедурная мордочка котика, однозначно определяемая ключом.
+
+    Выполняется в пуле процессов: отрисовка попиксельная и занимает
+    заметное время, цикл событий бота при этом не блокируется.
+    """
+    seed = hashlib.sha256(key.encode()).digest()
+
+    def pastel(offset):
+        return tuple(150 + seed[offset + i] % 100 for i in range(3))
+
+    background = pastel(0)
+    fur = tuple(60 + seed[3 + i] % 170 for i in range(3))
+    stripes_color = tuple(max(0, c - 60) for c in fur)
+    eye = (seed[6] % 120, 120 + seed[7] % 120, seed[8] % 100)
+    nose = (230, 120 + seed[9] % 60, 150)
+    has_stripes = seed[10] % 2 == 0
+    ear_height = 0.45 + (seed[11] % 20) / 100
+    pupil_width = 0.02 + (seed[12] % 4) / 100
+
+    rows = []
+    for py in range(size):
+        y = py / size * 2 - 1
+        row = bytearray()
+        for px in range(size):
+            x = px / size * 2 - 1
+            color = background
+            ax = abs(x)
+            # Уши - треугольники над головой, левое зеркально правому
+            if _in_triangle(ax, y, (0.2, -0.35), (0.72, -0.1), (0.62, -0.35 - ear_height)):
+                color = fur
+            # Голова - эллипс
+            if (x / 0.75) ** 2 + ((y - 0.1) / 0.65) ** 2 <= 1:
+                color = fur
+                if has_stripes and y < -0.2 and ax < 0.25 and int((y + 1) * 20) % 3 == 0:
+                    color = stripes_color
+            # Глаза со зрачками
+            for cx in (-0.3, 0.3):
+                if ((x - cx) / 0.14) ** 2 + ((y - 0.0) / 0.11) ** 2 <= 1:
+                    color = (20, 20, 20) if abs(x - cx) < pupil_width else eye
+            # Нос - перевернутый треугольник
+            if 0.2 < y < 0.3 and ax < (0.3 - y) * 0.9:
+                color = nose
+            row.extend(color)
+        rows.append(row)
+    return _encode_png(size, size, rows)
+
+
+class AvatarCache:
+    """Готовые PNG по ключу: LRU в памяти и LRU-каталог на диске.
+
+    Порядок вытеснения на диске задается временем изменения файлов,
+    которое обновляется при каждом чтении, поэтому он сохраняется
+    между перезапусками.
+    """
+
+    def __init__(self, memory_size: int = 256, path: str = None, disk_size: int = 10000):
+        self.memory_size = memory_size
+        self.path = path
+        self.disk_size = disk_size
+        self._memory = OrderedDict()
+        self._disk = None
+        # Один поток для диска: порядок вытеснения меняется без блокировок
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix='avatar-cache')
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, f'{key}.png')
+
+    def _scan(self):
+        """Список файлов каталога от давно не использованных к недавним"""
+        os.makedirs(self.path, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith('.png'):
+                entries.append((os.path.getmtime(os.path.join(self.path, name)), name[:-4]))
+        self._disk = OrderedDict((key, None) for _, key in sorted(entries))
+
+    def _remember(self, key: str, png: bytes):
+        self._memory[key] = png
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key: str):
+        if self._disk is None:
+            self._scan()
+        if key not in self._disk:
+            return None
+        try:
+            with open(self._file(key), 'rb') as f:
+                png = f.read()
+            os.utime(self._file(key))
+        except OSError:
+            self._disk.pop(key, None)
+            return None
+        self._disk.move_to_end(key)
+        return png
+
+    def _write_disk(self, key: str, png: bytes):
+        if self._disk is None:
+            self._scan()
+        tmp_path = f'{self._file(key)}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(png)
+        os.replace(tmp_path, self._file(key))
+        self._disk[key] = None
+        self._disk.move_to_end(key)
+        while len(self._disk) > self.disk_size:
+            old_key, _ = self._disk.popitem(last=False)
+            try:
+                os.remove(self._file(old_key))
+            except OSError:
+                pass
+
+    async def get(self, key: str):
+        png = self._memory.get(key)
+        if png is not None:
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return png
+        if self.path:
+            loop = asyncio.get_running_loop()
+            png = await loop.run_in_executor(self._io, self._read_disk, key)
+            if png is not None:
+                self.disk_hits += 1
+                self._remember(key, png)
+                return png
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, png: bytes):
+        self._remember(key, png)
+        if self.path:
+            try:
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(self._io, self._write_disk, key, png)
+            except OSError as e:
+                logger.warning(f"Не удалось сохранить аватар {key} на диск: {e}")
+
+    def stats(self) -> dict:
+        requests = self.memory_hits + self.disk_hits + self.misses
+        return {
+            'memory': len(self._memory),
+            'disk': len(self._disk) if self._disk is not None else 0,
+            'hits': self.memory_hits + self.disk_hits,
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_ratio': (self.memory_hits + self.disk_hits) / requests if requests else 0.0,
+        }
+
+
+class AvatarEngine:
+    """Выдача PNG аватара по ключу: кэш, затем удаленный генератор, затем локальная отрисовка.
+
+    fetch_remote - корутина key -> PNG или None; если она не ответила за
+    remote_timeout секунд или завершилась ошибкой, аватар рисуется
+    локально в пуле процессов. fetch_remote=None - всегда локально.
+    Одновременные запросы одного ключа объединяются.
+    """
+
+    def __init__(self, cache: AvatarCache, fetch_remote=None,
+                 remote_timeout: float = 2.0, workers: int = 1, size: int = 256):
+        self.cache = cache
+        self._fetch_remote = fetch_remote
+        self.remote_timeout = remote_timeout
+        self.workers = workers
+        self.size = size
+        self._executor = None
+        self._inflight = {}
+        self.remote = 0
+        self.local = 0
+
+    async def get(self, key: str) -> bytes:
+        png = await self.cache.get(key)
+        if png is not None:
+            return png
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._create(key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _, key=key: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _create(self, key: str) -> bytes:
+        png = None
+        if self._fetch_remote is not None:
+            try:
+                png = await asyncio.wait_for(self._fetch_remote(key), timeout=self.remote_timeout)
+            except asyncio.TimeoutError:
+                logger.info(f"Удаленный генератор аватаров не ответил за {self.remote_timeout} с, рисую локально")
+            except Exception as e:
+                logger.info(f"Удаленный генератор аватаров недоступен ({e}), рисую локально")
+        if png is not None:
+            self.remote += 1
+        else:
+            png = await self.render(key)
+            self.local += 1
+        await self.cache.put(key, png)
+        return png
+
+    async def render(self, key: str) -> bytes:
+        if self._executor is None:
+            # spawn, а не fork: в процессе бота уже работают потоки кэша и исполнителей
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+            )
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, render_avatar, key, self.size)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {**self.cache.stats(), 'remote': self.remote, 'local': self.local}
@@ -0,0 +1,215 @@
+"""Бенчмарк: пропускная способность рассылок против имитации Bot API.
+
+Рассылки из utils (Broadcaster с базой подписок SQLite) отправляют цитату
+дня и утренний прогноз погоды всем подписчикам через имитацию Telegram и
+внешних API из benchmarks/fake_services.py. Для сравнения тот же объем
+отправляется наивным циклом "запросить содержимое, отправить" на выборке
+подписчиков. Затем рассылка прерывается на середине и продолжается с
+сохраненного места: считается, сколько чатов получили сообщение дважды.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_broadcast [--subscribers 20000] [--weather-share 0.5]
+        [--rate 0] [--rate-limit 0] [--batch-size 100] [--naive 300]
+"""
+
+import os
+import time
+import random
+import asyncio
+import argparse
+import logging
+import tempfile
+import multiprocessing
+
+from benchmarks.fake_services import UpstreamProfile, UPSTREAMS, run_fake_services
+from benchmarks.load_test import HOST, CITIES, free_port, configure_environment, fetch_json
+
+
+def make_subscribers(count: int, weather_share: float, bucket, seed: int) -> list:
+    """Строки (topic, chat_id, lat, lon): все подписаны на цитату, часть - на погоду"""
+    random.seed(seed)
+    rows = []
+    for chat_id in range(100001, 100001 + count):
+        rows.append(('quote', chat_id, None, None))
+        if random.random() < weather_share:
+            lat, lon = random.choice(CITIES)
+            area = bucket(lat + random.uniform(-0.3, 0.3), lon + random.uniform(-0.3, 0.3))
+            rows.append(('weather', chat_id, *area))
+    return rows
+
+
+async def bot_api_calls(port: int, method: str) -> int:
+    return (await fetch_json(f'http://{HOST}:{port}/stats')).get('calls', {}).get(method, 0)
+
+
+async def run_broadcast(utils, bot, topic: str, run_id: str, telegram_port: int, upstream_port: int):
+    subscribers = await utils.get_subscriptions().count(topic)
+    # Ячейки считаются до рассылки: заблокировавшие бота по ее ходу отписываются
+    areas = len(await utils.get_subscriptions().areas(topic))
+    calls_before = await bot_api_calls(telegram_port, 'sendMessage')
+    fetches_before = (await fetch_json(f'http://{HOST}:{upstream_port}/stats')).get('openweathermap', 0)
+    started = time.perf_counter()
+    counts = await utils.get_broadcaster().run(bot, topic, run_id)
+    elapsed = time.perf_counter() - started
+    fetches = (await fetch_json(f'http://{HOST}:{upstream_port}/stats')).get('openweathermap', 0) - fetches_before
+    calls = await bot_api_calls(telegram_port, 'sendMessage') - calls_before
+    extra = ""
+    if topic == 'weather':
+        extra = f", ячеек {areas}, запросов погоды {fetches}"
+    print(
+        f"  {topic:8s}: {subscribers} подписчиков за {elapsed:6.2f} с, {calls / elapsed:7.1f} сообщений/с; "
+        f"отправлено {counts['sent']}, заблокировали {counts['blocked']}, ошибок {counts['failed']}{extra}"
+    )
+
+
+async def run_naive(utils, bot, sample: int):
+    """Прежний подход: каждому подписчику - свой запрос содержимого и своя отправка"""
+    from broadcasts import START_CURSOR
+
+    quote_page = await utils.get_subscriptions().page('quote', START_CURSOR, sample)
+    weather_page = await utils.get_subscriptions().page('weather', START_CURSOR, sample)
+    started = time.perf_counter()
+    sent = 0
+    for chat_id, _, _ in quote_page:
+        quote = await utils.fetch_quote()
+        try:
+            await bot.send_message(chat_id=chat_id, text=utils.format_quote(quote))
+            sent += 1
+        except Exception:
+            pass
+    for chat_id, lat, lon in weather_page:
+        data = await utils.fetch_weather_data(lat, lon)
+        try:
+            await bot.send_message(chat_id=chat_id, text=utils.format_weather(data))
+            sent += 1
+        except Exception:
+            pass
+    elapsed = time.perf_counter() - started
+    total = len(quote_page) + len(weather_page)
+    print(f"  наивный цикл: {total} сообщений за {elapsed:6.2f} с, {total / elapsed:7.1f} сообщений/с")
+
+
+async def run_with_crash(utils, bot, crash_at: float, telegram_port: int):
+    """Рассылка прерывается после доли crash_at подписчиков и продолжается заново созданным Broadcaster"""
+    from broadcasts import Broadcaster, SubscriptionStore
+
+    run_id = 'quote:crash-test'
+    subscribers = await utils.get_subscriptions().count('quote')
+    calls_before = await bot_api_calls(telegram_port, 'sendMessage')
+
+    crashed = Broadcaster(
+        SubscriptionStore(utils.settings.broadcast_db_path),
+        rate=utils.settings.broadcast_rate,
+        batch_size=utils.settings.broadcast_batch_size,
+    )
+    crashed.register('quote', utils.render_quote_broadcast)
+    task = asyncio.ensure_future(crashed.run(bot, 'quote', run_id))
+    while not task.done():
+        run = await utils.get_subscriptions().get_run(run_id)
+        if run is not None and run['sent'] + run['blocked'] >= subscribers * crash_at:
+            break
+        await asyncio.sleep(0.005)
+    # Остановка посреди пачки: ее отправленная часть не успевает попасть в сохраненный ход
+    await crashed.close()
+    await asyncio.gather(task, return_exceptions=True)
+    cursor = (await utils.get_subscriptions().get_run(run_id))['cursor']
+
+    await utils.get_broadcaster().run(bot, 'quote', run_id)
+    calls = await bot_api_calls(telegram_port, 'sendMessage') - calls_before
+    print(
+        f"  прервана после chat_id {cursor}, продолжена: {calls} отправок на {subscribers} подписчиков, "
+        f"повторно получили {calls - subscribers} (не больше размера пачки {utils.settings.broadcast_batch_size})"
+    )
+
+
+async def drive(args, telegram_port: int, upstream_port: int):
+    # Импорт после configure_environment
+    from telegram.ext import ExtBot
+    from telegram.request import HTTPXRequest
+    from rate_limiter import SendScheduler
+    import utils
+
+    await utils.http.start()
+    await utils.get_subscriptions().subscribe_many(
+        make_subscribers(args.subscribers, args.weather_share, utils.weather_cache.bucket, args.seed)
+    )
+    rate_limiter = SendScheduler(overall_rate=args.rate_limit, chat_rate=1) if args.rate_limit > 0 else None
+    bot = ExtBot(
+        utils.settings.token,
+        base_url=f'{utils.settings.telegram_api_url}/bot',
+        request=HTTPXRequest(connection_pool_size=max(args.batch_size, 8)),
+        rate_limiter=rate_limiter,
+    )
+    try:
+        async with bot:
+            print("Наивный цикл (выборка):")
+            await run_naive(utils, bot, args.naive)
+            print("Broadcaster:")
+            await run_broadcast(utils, bot, 'quote', 'quote:bench', telegram_port, upstream_port)
+            await run_broadcast(utils, bot, 'weather', 'weather:bench', telegram_port, upstream_port)
+            print("Сбой посреди рассылки:")
+            await run_with_crash(utils, bot, args.crash_at, telegram_port)
+    finally:
+        await utils.get_broadcaster().close()
+        await utils.http.close()
+
+
+def main(args):
+    telegram_port, upstream_port = free_port(), free_port()
+    workdir = tempfile.mkdtemp(prefix='bot-bench-')
+    configure_environment(args, telegram_port, upstream_port, workdir)
+    os.environ.update({
+        'BROADCAST_RATE': str(args.rate),
+        'BROADCAST_BATCH_SIZE': str(args.batch_size),
+        'WEATHER_CACHE_TTL': '3600',
+    })
+
+    profiles = {name: UpstreamProfile(args.latency, args.latency / 2, 0.0) for name in UPSTREAMS}
+    profiles['telegram'].latency = args.telegram_latency
+    random.seed(args.seed)
+    blocked = {
+        chat_id for chat_id in range(100001, 100001 + args.subscribers)
+        if random.random() < args.blocked_share
+    }
+
+    context = multiprocessing.get_context('spawn')
+    ready = context.Event()
+    fake = context.Process(
+        target=run_fake_services,
+        args=(HOST, telegram_port, upstream_port, [], profiles, 0, 1000, ready, blocked),
+        name='bench-fake-services', daemon=True,
+    )
+    fake.start()
+    try:
+        if not ready.wait(30):
+            raise RuntimeError("Имитация Telegram и внешних API не запустилась")
+        print(
+            f"{args.subscribers} подписчиков, {args.weather_share:.0%} с погодой, "
+            f"задержка Bot API {args.telegram_latency * 1000:.0f} мс, внешних API {args.latency * 1000:.0f} мс"
+        )
+        asyncio.run(drive(args, telegram_port, upstream_port))
+    finally:
+        fake.terminate()
+        fake.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--subscribers', type=int, default=20000)
+    parser.add_argument('--weather-share', type=float, default=0.5, help='доля подписчиков с погодой')
+    parser.add_argument('--blocked-share', type=float, default=0.01, help='доля заблокировавших бота')
+    parser.add_argument('--rate', type=float, default=0, help='BROADCAST_RATE, сообщений в секунду (0 - без паузы)')
+    parser.add_argument('--rate-limit', type=float, default=0, help='RATE_LIMIT_OVERALL (0 - без планировщика)')
+    parser.add_argument('--batch-size', type=int, default=100, help='BROADCAST_BATCH_SIZE')
+    parser.add_argument('--naive', type=int, default=300, help='подписчиков в выборке для наивного цикла')
+    parser.add_argument('--crash-at', type=float, default=0.5, help='доля рассылки до сбоя')
+    parser.add_argument('--latency', type=float, default=0.05, help='задержка внешних API, с')
+    parser.add_argument('--telegram-latency', type=float, default=0.02, help='задержка Bot API, с')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+    # configure_environment ожидает параметры нагрузочного теста
+    args.concurrency = 1
+
+    logging.basicConfig(level=args.log_level, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main(args)
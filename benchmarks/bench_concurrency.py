@@ -0,0 +1,61 @@
+"""Бенчмарк: пропускная способность KeyedUpdateProcessor в зависимости от параллельности.
+
+Обработчик имитирует обращение к медленному внешнему API (asyncio.sleep).
+Заодно проверяется, что обновления одного чата обработаны по порядку.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_concurrency [--updates 2000] [--chats 200] [--latency 0.02]
+"""
+
+import argparse
+import asyncio
+import time
+from types import SimpleNamespace
+
+from update_processor import KeyedUpdateProcessor
+
+
+def make_updates(count: int, chats: int):
+    return [
+        SimpleNamespace(update_id=i, effective_chat=SimpleNamespace(id=i % chats), effective_user=None)
+        for i in range(count)
+    ]
+
+
+async def run(concurrency: int, updates, latency: float) -> float:
+    processor = KeyedUpdateProcessor(concurrency, max_pending_updates=len(updates))
+    seen = {}
+
+    async def handler(update):
+        await asyncio.sleep(latency)
+        seen.setdefault(update.effective_chat.id, []).append(update.update_id)
+
+    async with processor:
+        started = time.perf_counter()
+        # Как и Application, создаем задачи в порядке поступления обновлений
+        await asyncio.gather(*(
+            asyncio.ensure_future(processor.process_update(update, handler(update)))
+            for update in updates
+        ))
+        elapsed = time.perf_counter() - started
+
+    for ids in seen.values():
+        assert ids == sorted(ids), "нарушен порядок обработки внутри чата"
+    return elapsed
+
+
+async def main(count: int, chats: int, latency: float):
+    updates = make_updates(count, chats)
+    print(f"{count} обновлений, {chats} чатов, задержка бэкенда {latency * 1000:.0f} мс")
+    for concurrency in (1, 4, 16, 64, 256):
+        elapsed = await run(concurrency, updates, latency)
+        print(f"  параллельность {concurrency:4d}: {count / elapsed:8.0f} обн/с")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--chats', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.02)
+    args = parser.parse_args()
+    asyncio.run(main(args.updates, args.chats, args.latency))
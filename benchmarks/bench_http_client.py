@@ -0,0 +1,75 @@
+"""Бенчмарк: новая aiohttp-сессия на каждый запрос против общего пула.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_http_client [--requests 500] [--concurrency 20]
+"""
+
+import argparse
+import asyncio
+import time
+
+import aiohttp
+from aiohttp import web
+
+from http_client import HttpClient
+
+
+async def _handle(request):
+    return web.json_response({'quoteText': 'ok', 'quoteAuthor': 'bench'})
+
+
+async def _start_server():
+    app = web.Application()
+    app.router.add_get('/', _handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://127.0.0.1:{port}/'
+
+
+async def _run(fetch, requests: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await fetch()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return time.perf_counter() - started
+
+
+async def main(requests: int, concurrency: int):
+    runner, url = await _start_server()
+    try:
+        async def per_request_session():
+            async with aiohttp.ClientSession() as session:
+                async with session.get(url) as response:
+                    await response.json()
+
+        client = HttpClient()
+        await client.start()
+
+        async def shared_session():
+            async with client.get(url) as response:
+                await response.json()
+
+        cold = await _run(per_request_session, requests, concurrency)
+        pooled = await _run(shared_session, requests, concurrency)
+        await client.close()
+    finally:
+        await runner.cleanup()
+
+    print(f"Сессия на запрос: {requests / cold:8.0f} запр/с ({cold * 1000 / requests:.2f} мс/запр)")
+    print(f"Общий пул:        {requests / pooled:8.0f} запр/с ({pooled * 1000 / requests:.2f} мс/запр)")
+    print(f"Ускорение: x{cold / pooled:.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency))
@@ -0,0 +1,119 @@
+"""Бенчмарк: пиковая память при одновременной загрузке больших картинок.
+
+Сравниваются response.read() без ограничений (как было раньше) и
+ImagePipeline: чтение частями, семафор на число загрузок и лимит размера.
+Каждый вариант запускается в отдельном процессе, чтобы пиковый RSS
+одного не влиял на другой.
+
+Запуск из корня проекта (только Linux/macOS, нужен модуль resource):
+    python -m benchmarks.bench_images [--requests 64] [--size 4000000] [--concurrency 8]
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import resource
+import multiprocessing
+
+import aiohttp
+from aiohttp import web
+
+from image_pipeline import ImagePipeline, ImageTooLarge
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдает килобайты, macOS - байты
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+async def _start_server(size: int):
+    image = os.urandom(size)
+
+    async def handle(request):
+        # Без Content-Length: лимит проверяется по мере чтения
+        response = web.StreamResponse()
+        await response.prepare(request)
+        for start in range(0, len(image), 256 * 1024):
+            await response.write(image[start:start + 256 * 1024])
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_get('/image.jpg', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://127.0.0.1:{port}/image.jpg'
+
+
+async def _run(mode: str, requests: int, size: int, concurrency: int, max_bytes: int):
+    runner, url = await _start_server(size)
+    pipeline = ImagePipeline(max_bytes=max_bytes, concurrency=concurrency)
+    connector = aiohttp.TCPConnector(limit=requests)
+    too_large = 0
+    try:
+        async with aiohttp.ClientSession(connector=connector) as session:
+            async def one():
+                nonlocal too_large
+                if mode == 'read':
+                    async with session.get(url) as response:
+                        data = await response.read()
+                else:
+                    async with pipeline.slot(), session.get(url) as response:
+                        try:
+                            data = await pipeline.read(response)
+                        except ImageTooLarge:
+                            too_large += 1
+                            return 0
+                # Как и бот, держим байты до "отправки"
+                await asyncio.sleep(0.05)
+                return len(data)
+
+            baseline = peak_rss_mb()
+            started = time.perf_counter()
+            await asyncio.gather(*(one() for _ in range(requests)))
+            elapsed = time.perf_counter() - started
+    finally:
+        await runner.cleanup()
+    return elapsed, peak_rss_mb() - baseline, too_large
+
+
+def _child(mode, requests, size, concurrency, max_bytes, results):
+    results.put(asyncio.run(_run(mode, requests, size, concurrency, max_bytes)))
+
+
+def run_isolated(*args):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_child, args=(*args, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main(requests: int, size: int, concurrency: int):
+    print(f"{requests} одновременных загрузок картинки {size / 2 ** 20:.1f} МБ")
+    variants = (
+        ('read() без ограничений', 'read', 2 * size),
+        (f'ImagePipeline, {concurrency} загрузок', 'pipeline', 2 * size),
+        ('ImagePipeline, лимит size/2', 'pipeline', size // 2),
+    )
+    for title, mode, max_bytes in variants:
+        elapsed, peak, too_large = run_isolated(mode, requests, size, concurrency, max_bytes)
+        extra = f", отклонено {too_large}" if too_large else ""
+        print(f"  {title:34s}: {elapsed:6.2f} с, прирост пикового RSS {peak:7.1f} МБ{extra}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=64)
+    parser.add_argument('--size', type=int, default=4000000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+    main(args.requests, args.size, args.concurrency)
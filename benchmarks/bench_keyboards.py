@@ -0,0 +1,43 @@
+"""Бенчмарк: стоимость подготовки клавиатуры для одного ответа.
+
+Сравнивает прежний подход (новая ReplyKeyboardMarkup на каждый ответ)
+с клавиатурой из реестра, сериализованной один раз. Замеряется та же
+работа, что выполняет PTB при формировании запроса к Bot API.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_keyboards [--number 20000]
+"""
+
+import argparse
+import json
+import timeit
+
+from telegram import ReplyKeyboardMarkup
+
+from routes import build_breed_menu_rows
+from utils import CAT_BREEDS, get_breed_keyboard
+
+
+def per_reply():
+    markup = ReplyKeyboardMarkup(build_breed_menu_rows(CAT_BREEDS), resize_keyboard=True)
+    return json.dumps(markup.to_dict())
+
+
+def prebuilt():
+    return json.dumps(get_breed_keyboard().to_dict())
+
+
+def main(number: int):
+    assert per_reply() == prebuilt()
+    legacy = timeit.timeit(per_reply, number=number) / number
+    cached = timeit.timeit(prebuilt, number=number) / number
+    print(f"Клавиатура пород, сборка на каждый ответ: {legacy * 1e6:6.1f} мкс")
+    print(f"Клавиатура пород из реестра:              {cached * 1e6:6.1f} мкс")
+    print(f"Экономия на ответ: {(legacy - cached) * 1e6:.1f} мкс (x{legacy / cached:.1f})")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=20000)
+    args = parser.parse_args()
+    main(args.number)
@@ -0,0 +1,89 @@
+"""Бенчмарк: SQLitePersistence против PicklePersistence из PTB.
+
+Для каждого хранилища N пользователей получают location в user_data,
+изменения передаются так же, как это делает Application (update_user_data
+за интервал, затем flush), а затем данные читаются после "перезапуска".
+Память - пик по tracemalloc за время замера.
+
+Запуск из корня проекта (для 1М пользователей нужно несколько минут):
+    python -m benchmarks.bench_persistence [--users 100000]
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import tracemalloc
+
+from telegram.ext import PicklePersistence, PersistenceInput
+
+from sqlite_persistence import SQLitePersistence
+
+
+async def run_pickle(path: str, users: int):
+    # on_flush=True: иначе PicklePersistence переписывает файл на каждое обновление
+    persistence = PicklePersistence(
+        path,
+        store_data=PersistenceInput(bot_data=False, chat_data=False, callback_data=False),
+        on_flush=True,
+    )
+    await persistence.get_user_data()
+    started = time.perf_counter()
+    for user_id in range(users):
+        await persistence.update_user_data(user_id, {'location': (55.75, 37.61)})
+    await persistence.flush()
+    write = time.perf_counter() - started
+
+    reloaded = PicklePersistence(path)
+    started = time.perf_counter()
+    data = await reloaded.get_user_data()
+    read = time.perf_counter() - started
+    assert data[users - 1]['location'] == (55.75, 37.61)
+    return write, read
+
+
+async def run_sqlite(path: str, users: int):
+    persistence = SQLitePersistence(path)
+    await persistence.get_user_data()
+    started = time.perf_counter()
+    for user_id in range(users):
+        await persistence.update_user_data(user_id, {'location': (55.75, 37.61)})
+    await persistence.flush()
+    write = time.perf_counter() - started
+
+    # После перезапуска читается только пользователь, приславший обновление
+    reloaded = SQLitePersistence(path)
+    started = time.perf_counter()
+    await reloaded.get_user_data()
+    user_data = {}
+    await reloaded.refresh_user_data(users - 1, user_data)
+    read = time.perf_counter() - started
+    await reloaded.flush()
+    assert user_data['location'] == (55.75, 37.61)
+    return write, read
+
+
+async def measure(name: str, runner, path: str, users: int):
+    tracemalloc.start()
+    write, read = await runner(path, users)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    size = sum(os.path.getsize(p) for p in (path, f'{path}-wal') if os.path.exists(p))
+    print(f"{name:18s} запись: {users / write:10.0f} обн/с  "
+          f"первое чтение: {read * 1000:8.1f} мс  "
+          f"пик памяти: {peak / 2**20:7.1f} МБ  файл: {size / 2**20:6.1f} МБ")
+
+
+async def main(users: int):
+    print(f"{users} пользователей")
+    with tempfile.TemporaryDirectory() as directory:
+        await measure('PicklePersistence', run_pickle, os.path.join(directory, 'data.pickle'), users)
+        await measure('SQLitePersistence', run_sqlite, os.path.join(directory, 'data.sqlite3'), users)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=100000)
+    args = parser.parse_args()
+    asyncio.run(main(args.users))
@@ -0,0 +1,64 @@
+"""Микробенчмарк: стоимость маршрутизации одного текстового сообщения.
+
+Сравнивает прежнюю цепочку if/elif с поиском по CAT_BREEDS.values()
+и табличный маршрутизатор TEXT_ROUTES + BREED_BY_NAME.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_router [--number 200000]
+"""
+
+import argparse
+import timeit
+
+from utils import CAT_BREEDS, BREED_BY_NAME
+from routes import TEXT_ROUTES, BUTTON_BACK, BUTTON_CAT_PHOTO
+# Обработчики регистрируют маршруты декоратором route при импорте
+import handlers  # noqa: F401
+
+
+def legacy_route(text):
+    if text == 'Назад':
+        return 'back'
+    elif text == 'Сгенерировать аватар-котика':
+        return 'avatar'
+    elif text == 'Мой ID':
+        return 'my_id'
+    elif text == 'Прогноз погоды':
+        return 'weather'
+    elif text == 'Цитата дня':
+        return 'quote'
+    elif text == 'Фото котика':
+        return 'breeds'
+    elif text in CAT_BREEDS.values():
+        for breed_key, breed_name in CAT_BREEDS.items():
+            if breed_name == text:
+                return breed_key
+    return None
+
+
+def table_route(text):
+    handler = TEXT_ROUTES.get(text)
+    if handler is not None:
+        return handler
+    return BREED_BY_NAME.get(text)
+
+
+def main(number: int):
+    print(f"Маршрутов в таблице: {len(TEXT_ROUTES)}, пород в индексе: {len(BREED_BY_NAME)}")
+    samples = {
+        'первая ветка if/elif': BUTTON_BACK,
+        'последняя ветка if/elif': BUTTON_CAT_PHOTO,
+        'порода в конце списка': list(CAT_BREEDS.values())[-1],
+        'произвольный текст': 'Привет, бот!',
+    }
+    for name, text in samples.items():
+        legacy = timeit.timeit(lambda: legacy_route(text), number=number) / number
+        table = timeit.timeit(lambda: table_route(text), number=number) / number
+        print(f"{name:24s} if/elif: {legacy * 1e9:7.0f} нс  таблица: {table * 1e9:7.0f} нс")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=200000)
+    args = parser.parse_args()
+    main(args.number)
@@ -0,0 +1,128 @@
+"""Бенчмарк: холодный старт процесса бота.
+
+1. Время импорта модулей (config, bot, utils, handlers): каждый
+   импортируется в новом процессе интерпретатора, берется медиана.
+2. Время до первого обновления: `python main.py` запускается против
+   имитации Bot API (benchmarks/fake_services.py) с единственным
+   обновлением /start. Замеряется время от запуска процесса до первого
+   getUpdates (бот готов принимать обновления) и до первого send*
+   (бот ответил пользователю).
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_startup [--repeat 5]
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import tempfile
+import statistics
+import subprocess
+import multiprocessing
+import urllib.request
+
+from benchmarks.fake_services import UpstreamProfile, UPSTREAMS, run_fake_services
+from benchmarks.load_test import HOST, free_port, make_message, configure_environment
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ('config', 'bot', 'utils', 'handlers')
+
+IMPORT_SNIPPET = (
+    'import time; started = time.perf_counter(); import {module}; '
+    'print(time.perf_counter() - started)'
+)
+
+
+def import_time(module: str, repeat: int, env: dict) -> float:
+    """Медиана времени импорта модуля в новом процессе, секунды"""
+    samples = []
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, '-c', IMPORT_SNIPPET.format(module=module)], cwd=PROJECT_ROOT, env=env
+        )
+        samples.append(float(output.decode().strip().splitlines()[-1]))
+    return statistics.median(samples)
+
+
+def fetch_stats(port: int) -> dict:
+    try:
+        with urllib.request.urlopen(f'http://{HOST}:{port}/stats', timeout=1) as response:
+            return json.load(response)
+    except OSError:
+        return {}
+
+
+def time_to_first_update(args) -> tuple:
+    """Секунды от запуска main.py до первого getUpdates и до первого ответа"""
+    telegram_port, upstream_port = free_port(), free_port()
+    workdir = tempfile.mkdtemp(prefix='bot-bench-')
+    configure_environment(args, telegram_port, upstream_port, workdir)
+
+    profiles = {name: UpstreamProfile(0.0, 0.0, 0.0) for name in UPSTREAMS}
+    updates = [make_message(1, 100001, 'wake_up', [])]
+    context = multiprocessing.get_context('spawn')
+    ready = context.Event()
+    fake = context.Process(
+        target=run_fake_services,
+        args=(HOST, telegram_port, upstream_port, updates, profiles, 0, 1000, ready),
+        name='bench-fake-services', daemon=True,
+    )
+    fake.start()
+    bot = None
+    try:
+        if not ready.wait(30):
+            raise RuntimeError("Имитация Telegram и внешних API не запустилась")
+        started = time.time()
+        bot = subprocess.Popen(
+            [sys.executable, 'main.py'], cwd=PROJECT_ROOT,
+            stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + args.timeout
+        stats = {}
+        while time.monotonic() < deadline and bot.poll() is None:
+            stats = fetch_stats(telegram_port)
+            if stats.get('first_send_at'):
+                break
+            time.sleep(0.005)
+        if not stats.get('first_send_at'):
+            raise RuntimeError(f"Бот не ответил за {args.timeout} с (код выхода {bot.poll()})")
+        return stats['first_poll_at'] - started, stats['first_send_at'] - started
+    finally:
+        if bot is not None and bot.poll() is None:
+            bot.send_signal(signal.SIGINT)
+            try:
+                bot.wait(10)
+            except subprocess.TimeoutExpired:
+                bot.kill()
+        fake.terminate()
+        fake.join()
+
+
+def main(args):
+    env = {**os.environ, 'TOKEN': os.environ.get('TOKEN', '123456:bench')}
+    print(f"Время импорта (медиана из {args.repeat} запусков):")
+    for module in MODULES:
+        print(f"  {module:10s}: {import_time(module, args.repeat, env) * 1000:7.1f} мс")
+
+    polls, sends = [], []
+    for _ in range(args.runs):
+        poll, send = time_to_first_update(args)
+        polls.append(poll)
+        sends.append(send)
+    print(f"Запуск main.py (медиана из {args.runs} запусков):")
+    print(f"  до первого getUpdates  : {statistics.median(polls) * 1000:7.1f} мс")
+    print(f"  до первого ответа      : {statistics.median(sends) * 1000:7.1f} мс")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='запусков на замер импорта')
+    parser.add_argument('--runs', type=int, default=3, help='запусков main.py')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--concurrency', type=int, default=1, help='MAX_CONCURRENT_UPDATES бота')
+    parser.add_argument('--rate-limit', type=float, default=30, help='RATE_LIMIT_OVERALL')
+    parser.add_argument('--verbose', action='store_true', help='показывать журнал бота')
+    main(parser.parse_args())
@@ -0,0 +1,356 @@
+"""Локальные заменители Telegram Bot API и внешних API для нагрузочного стенда.
+
+FakeBotApi отдает через getUpdates заранее подготовленный поток обновлений
+и принимает исходящие вызовы бота (sendMessage, sendPhoto и т.д.).
+В каждое обновление добавляются поля bench_sent_at (время выдачи боту)
+и bench_handler (ожидаемый обработчик); PTB кладет неизвестные поля
+в update.api_kwargs, откуда их читает драйвер.
+
+build_upstream_app имитирует TheCatAPI, Forismatic, OpenWeatherMap и
+Robohash с настраиваемой задержкой и долей отказов (ответ 503).
+
+Модуль не импортирует код бота. Нагрузочный стенд запускает имитацию в
+отдельном процессе, чтобы она не делила с ботом цикл событий и память;
+тесты - в своем цикле событий через serving().
+"""
+
+import os
+import time
+import uuid
+import random
+import asyncio
+import hashlib
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+
+import aiohttp
+from aiohttp import web
+
+# Создаем логгер для этого модуля
+logger = logging.getLogger(__name__)
+
+UPSTREAMS = ('thecatapi', 'forismatic', 'openweathermap', 'robohash', 'telegram')
+
+
+class UpstreamProfile:
+    """Задержка (latency + случайная добавка до jitter) и доля отказов"""
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, failure_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+
+    async def delay(self) -> bool:
+        """Ждет задержку ответа; True, если этот запрос должен завершиться отказом"""
+        await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        return random.random() < self.failure_rate
+
+
+def build_upstream_app(base_url: str, profiles: dict, image_size: int = 60000) -> web.Application:
+    """Имитация внешних API; base_url - внешний адрес этого же сервера"""
+    image = os.urandom(image_size)
+    calls = {name: 0 for name in profiles if name != 'telegram'}
+    quote_counter = 0
+
+    def unavailable():
+        return web.Response(status=503, text='upstream unavailable')
+
+    async def cat_search(request):
+        calls['thecatapi'] += 1
+        if await profiles['thecatapi'].delay():
+            return unavailable()
+        breed_id = request.query.get('breed_ids', 'any')
+        return web.json_response([{
+            'id': uuid.uuid4().hex[:9],
+            'url': f'{base_url}/cat/img/{breed_id}-{uuid.uuid4().hex}.jpg',
+        }])
+
+    async def cat_image(request):
+        calls['thecatapi'] += 1
+        if await profiles['thecatapi'].delay():
+            return unavailable()
+        return web.Response(body=image, content_type='image/jpeg')
+
+    async def quote(request):
+        nonlocal quote_counter
+        calls['forismatic'] += 1
+        if await profiles['forismatic'].delay():
+            return unavailable()
+        quote_counter += 1
+        # Forismatic отвечает с Content-Type text/html, бот это учитывает
+        return web.json_response(
+            {'quoteText': f'Цитата номер {quote_counter} ', 'quoteAuthor': 'Нагрузочный стенд '},
+            content_type='text/html',
+        )
+
+    async def weather(request):
+        calls['openweathermap'] += 1
+        if await profiles['openweathermap'].delay():
+            return unavailable()
+        lat = float(request.query.get('lat', 0))
+        return web.json_response({
+            'name': f'Город {lat:.1f}',
+            'weather': [{'description': 'облачно'}],
+            'main': {'temp': 10 + lat % 15, 'feels_like': 8 + lat % 15},
+            'wind': {'speed': round(random.uniform(0, 12), 1)},
+        })
+
+    async def robohash(request):
+        calls['robohash'] += 1
+        if await profiles['robohash'].delay():
+            return unavailable()
+        return web.Response(body=image, content_type='image/png')
+
+    async def stats(request):
+        return web.json_response(calls)
+
+    app = web.Application()
+    app.router.add_get('/cat/v1/images/search', cat_search)
+    app.router.add_get('/cat/img/{name}', cat_image)
+    app.router.add_get('/quote/', quote)
+    app.router.add_get('/weather', weather)
+    app.router.add_get('/robohash/{name}', robohash)
+    app.router.add_get('/stats', stats)
+    return app
+
+
+class FakeBotApi:
+    """Имитация Bot API: выдача обновлений и ответы на исходящие вызовы.
+
+    rate - сколько обновлений в секунду становится доступно (0 - все сразу,
+    замкнутый цикл: бот забирает их так быстро, как успевает обработать).
+    С hold=True обновления не выдаются до запроса POST /release: так стенд
+    дожидается запуска всех процессов бота.
+    Отправка в чаты из blocked отклоняется, как будто пользователь
+    заблокировал бота.
+
+    Лимиты Telegram: при overall_limit (сообщений за любую секунду, 0 -
+    без лимита) или chat_limit (то же для одного чата) лишние отправки
+    получают ответ 429 с retry_after, как от настоящего Bot API;
+    reject_next отклоняет так же ближайшие отправки независимо от лимитов.
+    """
+
+    def __init__(self, updates: list, profile: UpstreamProfile, rate: float = 0, blocked=(),
+                 overall_limit: int = 0, chat_limit: int = 0, retry_after: int = 1, hold: bool = False):
+        self.updates = updates
+        self.hold = hold
+        self.profile = profile
+        self.rate = rate
+        self.blocked = frozenset(blocked)
+        self.overall_limit = overall_limit
+        self.chat_limit = chat_limit
+        self.retry_after = retry_after
+        self.reject_next = 0
+        self.flood_rejected = 0
+        self._overall_window = deque()
+        self._chat_windows = {}
+        self.calls = {}
+        self._delivered = 0
+        self._started_at = None
+        # Время (time.time()) первого запроса обновлений и первого ответа бота
+        self._first_poll_at = None
+        self._first_send_at = None
+        self._last_send_at = None
+        self._released_at = None
+        self._message_id = 0
+        self._session = None
+
+    def build_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route('*', '/bot{token}/{method}', self._handle)
+        app.router.add_get('/stats', self._stats)
+        app.router.add_post('/release', self._release)
+        app.on_cleanup.append(self._close)
+        return app
+
+    async def _close(self, app):
+        if self._session is not None:
+            await self._session.close()
+
+    async def _stats(self, request):
+        return web.json_response({
+            'delivered': self._delivered,
+            'calls': self.calls,
+            'first_poll_at': self._first_poll_at,
+            'first_send_at': self._first_send_at,
+            'last_send_at': self._last_send_at,
+            'released_at': self._released_at,
+            'flood_rejected': self.flood_rejected,
+        })
+
+    async def _release(self, request):
+        self.hold = False
+        self._released_at = time.time()
+        return web.json_response({'ok': True})
+
+    def _flood_wait(self, chat_id: int) -> int:
+        """0, если отправка укладывается в лимиты, иначе retry_after для ответа 429"""
+        if self.reject_next > 0:
+            self.reject_next -= 1
+            self.flood_rejected += 1
+            return self.retry_after
+        now = time.monotonic()
+        windows = []
+        if self.overall_limit:
+            windows.append((self._overall_window, self.overall_limit))
+        if self.chat_limit:
+            windows.append((self._chat_windows.setdefault(chat_id, deque()), self.chat_limit))
+        for window, limit in windows:
+            while window and window[0] <= now - 1:
+                window.popleft()
+            if len(window) >= limit:
+                self.flood_rejected += 1
+                return self.retry_after
+        for window, _ in windows:
+            window.append(now)
+        return 0
+
+    def _available(self) -> int:
+        if not self.rate:
+            return len(self.updates)
+        return min(len(self.updates), int((time.monotonic() - self._started_at) * self.rate))
+
+    async def _get_updates(self, params: dict):
+        if self.hold:
+            await asyncio.sleep(min(float(params.get('timeout', 0)), 1.0))
+            return []
+        if self._started_at is None:
+            self._started_at = time.monotonic()
+        # Подтвержденные ботом обновления (offset) больше не выдаются
+        first = max(int(params.get('offset', 0)) - 1, self._delivered, 0)
+        limit = int(params.get('limit', 100))
+        deadline = time.monotonic() + min(float(params.get('timeout', 0)), 1.0)
+        while self._available() <= first and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        batch = self.updates[first:min(first + limit, self._available())]
+        now = time.time()
+        for update in batch:
+            update.setdefault('bench_sent_at', now)
+        self._delivered = max(self._delivered, first + len(batch))
+        return batch
+
+    def _message(self, params: dict, **extra) -> dict:
+        self._message_id += 1
+        chat_id = int(params.get('chat_id', 0))
+        return {
+            'message_id': self._message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': 1, 'is_bot': True, 'first_name': 'bench_bot'},
+            **extra,
+        }
+
+    async def _send_photo(self, params: dict):
+        photo = params.get('photo')
+        if isinstance(photo, str) and photo.startswith('http'):
+            # Фото по URL Telegram загружает сам, как с Robohash в боевом режиме
+            if self._session is None:
+                self._session = aiohttp.ClientSession()
+            try:
+                async with self._session.get(photo) as response:
+                    if response.status != 200:
+                        return None
+                    await response.read()
+            except aiohttp.ClientError:
+                return None
+            file_id = 'url-' + hashlib.md5(photo.encode()).hexdigest()
+        elif isinstance(photo, str):
+            file_id = photo
+        else:
+            file_id = 'upload-' + uuid.uuid4().hex
+        sizes = [{'file_id': file_id, 'file_unique_id': file_id[-16:], 'width': 400, 'height': 400}]
+        return self._message(params, photo=sizes, caption=params.get('caption', ''))
+
+    async def _handle(self, request):
+        method = request.match_info['method']
+        params = dict(request.query)
+        if request.method == 'POST':
+            if request.content_type == 'application/json':
+                params.update(await request.json())
+            else:
+                form = await request.post()
+                params.update({
+                    key: value if isinstance(value, str) else value.file.read()
+                    for key, value in form.items()
+                })
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+        if method == 'getUpdates':
+            if self._first_poll_at is None:
+                self._first_poll_at = time.time()
+            return web.json_response({'ok': True, 'result': await self._get_updates(params)})
+        if method == 'getMe':
+            return web.json_response({'ok': True, 'result': {
+                'id': 1, 'is_bot': True, 'first_name': 'bench_bot', 'username': 'bench_bot',
+            }})
+
+        if method.startswith('send'):
+            self._last_send_at = time.time()
+            if self._first_send_at is None:
+                self._first_send_at = self._last_send_at
+        if method.startswith('send') and method != 'sendChatAction':
+            retry_after = self._flood_wait(int(params.get('chat_id', 0)))
+            if retry_after:
+                return web.json_response({
+                    'ok': False, 'error_code': 429, 'description': f'Too Many Requests: retry after {retry_after}',
+                    'parameters': {'retry_after': retry_after},
+                }, status=429)
+        await self.profile.delay()
+        if method.startswith('send') and int(params.get('chat_id', 0)) in self.blocked:
+            return web.json_response({
+                'ok': False, 'error_code': 403, 'description': 'Forbidden: bot was blocked by the user',
+            }, status=403)
+        if method == 'sendPhoto':
+            result = await self._send_photo(params)
+            if result is None:
+                return web.json_response({
+                    'ok': False, 'error_code': 400,
+                    'description': 'Bad Request: wrong file identifier/HTTP URL specified',
+                }, status=400)
+        elif method.startswith('send') and method != 'sendChatAction':
+            result = self._message(params, text=params.get('text', ''))
+        elif method == 'editMessageText':
+            result = self._message(params, text=params.get('text', ''))
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+
+@asynccontextmanager
+async def serving(app: web.Application, host: str, port: int = 0):
+    """Сервер имитации на время блока; возвращает его адрес.
+
+    Тесты запускают имитацию так в своем цикле событий (port=0 - любой
+    свободный порт), нагрузочный стенд - в отдельном процессе.
+    """
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    try:
+        port = runner.addresses[0][1]
+        yield f'http://{host}:{port}'
+    finally:
+        await runner.cleanup()
+
+
+async def _serve(host: str, telegram_port: int, upstream_port: int,
+                 updates: list, profiles: dict, rate: float, image_size: int, ready, blocked, hold):
+    upstream_app = build_upstream_app(f'http://{host}:{upstream_port}', profiles, image_size)
+    bot_api = FakeBotApi(updates, profiles['telegram'], rate, blocked, hold=hold)
+    async with serving(upstream_app, host, upstream_port), serving(bot_api.build_app(), host, telegram_port):
+        ready.set()
+        await asyncio.Event().wait()
+
+
+def run_fake_services(host: str, telegram_port: int, upstream_port: int,
+                      updates: list, profiles: dict, rate: float, image_size: int, ready, blocked=(),
+                      hold: bool = False):
+    """Точка входа процесса с имитацией; profiles - {имя: UpstreamProfile}"""
+    try:
+        asyncio.run(_serve(
+            host, telegram_port, upstream_port, updates, profiles, rate, image_size, ready, blocked, hold
+        ))
+    except KeyboardInterrupt:
+        pass
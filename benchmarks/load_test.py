@@ -0,0 +1,438 @@
+"""Нагрузочный тест: настоящее приложение из bot.py против имитации Telegram и внешних API.
+
+Имитация (benchmarks/fake_services.py) работает в отдельном процессе.
+Драйвер направляет бота на нее через TELEGRAM_API_URL, CAT_API_URL и
+другие переменные окружения, запускает приложение как run_polling и
+ждет, пока будут обработаны все обновления. Задержка считается от
+выдачи обновления в getUpdates до завершения обработчика.
+
+Результат - JSON: обновлений в секунду, p50/p95/p99 по обработчикам,
+пиковая память процесса бота, вызовы Bot API и доля попаданий в кэши.
+
+С --workers 1,2,4 бот для каждого числа процессов запускается как
+main.py с WORKERS=N (пулы и кэши - в общем кэше SQLite), и результат -
+пропускная способность в зависимости от числа процессов. Обработчики
+работают в других процессах, поэтому обработка считается законченной,
+когда все обновления выданы и бот перестал отправлять сообщения.
+
+Запуск из корня проекта:
+    python -m benchmarks.load_test [--updates 2000] [--users 200] [--concurrency 16]
+        [--latency 0.05] [--failure-rate 0.0] [--workers 1,2,4] [--output result.json]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import signal
+import socket
+import asyncio
+import argparse
+import logging
+import tempfile
+import subprocess
+import multiprocessing
+
+import aiohttp
+
+from benchmarks.fake_services import UpstreamProfile, UPSTREAMS, run_fake_services
+from routes import (
+    BUTTON_CAT_PHOTO, BUTTON_AVATAR, BUTTON_AVATAR_REROLL, BUTTON_QUOTE, BUTTON_MY_ID,
+    BUTTON_WEATHER, BUTTON_LAST_LOCATION_WEATHER
+)
+from weather_cache import percentile
+
+try:
+    import resource
+except ImportError:
+    # Windows: пиковую память получить не удастся
+    resource = None
+
+HOST = '127.0.0.1'
+
+# Корень проекта: отсюда запускается main.py в режиме --workers
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Обработчик -> вес в смеси обновлений по умолчанию
+DEFAULT_MIX = {
+    'wake_up': 1,
+    'quote_command': 1,
+    'send_quote_of_the_day': 2,
+    'show_breed_selection': 1,
+    'send_cat_photo': 3,
+    'send_avatar': 1,
+    'reroll_avatar': 1,
+    'send_user_id': 1,
+    'request_location': 1,
+    'handle_location': 2,
+    'send_last_location_weather': 1,
+}
+
+# Города, вокруг которых разбрасываются координаты (проверка кэша погоды по сетке)
+CITIES = ((55.75, 37.62), (59.94, 30.31), (56.84, 60.60), (55.03, 82.92), (43.12, 131.89))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def make_message(update_id: int, user_id: int, handler: str, breed_names: list) -> dict:
+    """Синтетическое обновление, которое бот направит в обработчик handler"""
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private', 'first_name': f'User{user_id}'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'},
+    }
+    texts = {
+        'send_quote_of_the_day': BUTTON_QUOTE,
+        'show_breed_selection': BUTTON_CAT_PHOTO,
+        'send_avatar': BUTTON_AVATAR,
+        'reroll_avatar': BUTTON_AVATAR_REROLL,
+        'send_user_id': BUTTON_MY_ID,
+        'request_location': BUTTON_WEATHER,
+        'send_last_location_weather': BUTTON_LAST_LOCATION_WEATHER,
+    }
+    if handler in ('wake_up', 'quote_command'):
+        command = '/start' if handler == 'wake_up' else '/quote'
+        message['text'] = command
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+    elif handler == 'send_cat_photo':
+        message['text'] = random.choice(breed_names)
+    elif handler == 'handle_location':
+        lat, lon = random.choice(CITIES)
+        message['location'] = {
+            'latitude': lat + random.uniform(-0.2, 0.2),
+            'longitude': lon + random.uniform(-0.2, 0.2),
+        }
+    else:
+        message['text'] = texts[handler]
+    return {'update_id': update_id, 'message': message, 'bench_handler': handler}
+
+
+def make_updates(count: int, users: int, mix: dict, breed_names: list, seed: int) -> list:
+    random.seed(seed)
+    handlers = list(mix)
+    weights = [mix[name] for name in handlers]
+    return [
+        make_message(i + 1, 100000 + random.randrange(users), random.choices(handlers, weights)[0], breed_names)
+        for i in range(count)
+    ]
+
+
+def parse_workers(value: str) -> list:
+    try:
+        counts = [int(part) for part in value.split(',') if part.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"ожидается список чисел процессов, например 1,2,4: {value}")
+    if not counts or min(counts) < 1:
+        raise argparse.ArgumentTypeError("число процессов должно быть положительным")
+    return counts
+
+
+def parse_mix(value: str) -> dict:
+    """'send_cat_photo=3,wake_up=1' -> {'send_cat_photo': 3, 'wake_up': 1}"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"неизвестный обработчик: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def configure_environment(args, telegram_port: int, upstream_port: int, workdir: str):
+    """Настройки бота задаются до первого обращения к config.get_settings, который читает их один раз"""
+    upstream = f'http://{HOST}:{upstream_port}'
+    os.environ.update({
+        'TOKEN': '123456:bench',
+        'TOKEN_WEATHER': 'bench',
+        'PROXY_URL': '',
+        'BOT_MODE': 'polling',
+        'WORKERS': '0',
+        'TELEGRAM_API_URL': f'http://{HOST}:{telegram_port}',
+        'CAT_API_URL': f'{upstream}/cat/v1',
+        'QUOTE_API_URL': f'{upstream}/quote/',
+        'WEATHER_API_URL': f'{upstream}/weather',
+        'ROBOHASH_URL': f'{upstream}/robohash',
+        'MAX_CONCURRENT_UPDATES': str(args.concurrency),
+        'RATE_LIMIT_OVERALL': str(args.rate_limit),
+        'PERSISTENCE_PATH': os.path.join(workdir, 'bot_data.sqlite3'),
+        'FILE_ID_CACHE_PATH': '',
+        'AVATAR_CACHE_DIR': os.path.join(workdir, 'avatars'),
+        'QUOTE_CORPUS_PATH': '',
+        'BROADCAST_DB_PATH': os.path.join(workdir, 'broadcasts.sqlite3'),
+        'METRICS_PORT': '0',
+    })
+
+
+def memory_usage() -> dict:
+    usage = {}
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux отдает килобайты, macOS - байты
+        usage['peak_rss_mb'] = round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+    try:
+        with open('/proc/self/statm') as f:
+            usage['rss_mb'] = round(int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20, 1)
+    except (OSError, ValueError, AttributeError):
+        pass
+    return usage
+
+
+def summarize(latencies: list) -> dict:
+    values = [value * 1000 for value in latencies]
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 50), 2),
+        'p95_ms': round(percentile(values, 95), 2),
+        'p99_ms': round(percentile(values, 99), 2),
+        'max_ms': round(max(values), 2) if values else 0.0,
+    }
+
+
+async def fetch_json(url: str) -> dict:
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url) as response:
+                return await response.json()
+    except aiohttp.ClientError:
+        return {}
+
+
+async def drive(args, total: int, telegram_port: int, upstream_port: int) -> dict:
+    # Импорт после configure_environment
+    from telegram import Update
+    from telegram.ext import TypeHandler
+    import bot
+
+    latencies = {}
+    finished = []
+    done = asyncio.Event()
+
+    async def record_done(update: Update, context):
+        # Группа 1 выполняется после обработчика из группы 0 для того же обновления
+        sent_at = update.api_kwargs.get('bench_sent_at')
+        if sent_at is None:
+            return
+        finished_at = time.time()
+        latencies.setdefault(update.api_kwargs.get('bench_handler'), []).append(finished_at - sent_at)
+        finished.append((sent_at, finished_at))
+        if len(finished) >= total:
+            done.set()
+
+    application = bot.build_application()
+    application.add_handler(TypeHandler(Update, record_done), group=1)
+
+    # Та же последовательность, что и в Application.run_polling
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    # Фоновые задачи успевают наполнить пулы фото и цитат
+    await asyncio.sleep(args.warmup)
+    await application.updater.start_polling(poll_interval=0, timeout=1)
+    try:
+        await asyncio.wait_for(done.wait(), timeout=args.timeout)
+    except asyncio.TimeoutError:
+        logging.warning(f"Обработано {len(finished)} из {total} обновлений за {args.timeout} с")
+    finally:
+        # Остановка в порядке run_polling: stop -> post_stop -> shutdown -> post_shutdown
+        await application.updater.stop()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+    cache_hit_ratio = {
+        labels['cache']: round(value, 3)
+        for name, labels, value in bot.collect_cache_metrics()
+        if name == 'bot_cache_hit_ratio'
+    }
+    bot_api = await fetch_json(f'http://{HOST}:{telegram_port}/stats')
+    upstream_calls = await fetch_json(f'http://{HOST}:{upstream_port}/stats')
+
+    elapsed = (max(end for _, end in finished) - min(start for start, _ in finished)) if finished else 0.0
+    return {
+        'updates': total,
+        'completed': len(finished),
+        'elapsed_s': round(elapsed, 3),
+        'updates_per_sec': round(len(finished) / elapsed, 1) if elapsed else 0.0,
+        'latency': summarize([end - start for start, end in finished]),
+        'handlers': {name: summarize(values) for name, values in sorted(latencies.items())},
+        'memory': memory_usage(),
+        'bot_api_calls': bot_api.get('calls', {}),
+        'upstream_calls': upstream_calls,
+        'cache_hit_ratio': cache_hit_ratio,
+    }
+
+
+async def measure_workers(args, total: int, workers: int, telegram_port: int) -> dict:
+    """Пропускная способность main.py с WORKERS=workers по статистике имитации Bot API"""
+    stats_url = f'http://{HOST}:{telegram_port}/stats'
+    # Каждый процесс бота вызывает getMe при запуске: принимающий и обработчики
+    processes = workers + 1 if workers > 1 else 1
+    deadline = time.monotonic() + 60
+    while (await fetch_json(stats_url)).get('calls', {}).get('getMe', 0) < processes:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Бот с WORKERS={workers} не запустился за 60 с")
+        await asyncio.sleep(0.1)
+    # Фоновые задачи успевают наполнить пулы фото и цитат
+    await asyncio.sleep(args.warmup)
+    async with aiohttp.ClientSession() as session:
+        await session.post(f'http://{HOST}:{telegram_port}/release')
+
+    deadline = time.monotonic() + args.timeout
+    while True:
+        await asyncio.sleep(0.2)
+        stats = await fetch_json(stats_url)
+        last_send_at = stats.get('last_send_at') or 0
+        if stats.get('delivered', 0) >= total and time.time() - last_send_at >= args.quiet:
+            break
+        if time.monotonic() > deadline:
+            logging.warning(f"WORKERS={workers}: выдано {stats.get('delivered', 0)} из {total} обновлений "
+                            f"за {args.timeout} с")
+            break
+
+    released_at = stats.get('released_at') or 0
+    elapsed = last_send_at - released_at if released_at and last_send_at > released_at else 0.0
+    return {
+        'workers': workers,
+        'updates': total,
+        'delivered': stats.get('delivered', 0),
+        'elapsed_s': round(elapsed, 3),
+        'updates_per_sec': round(stats.get('delivered', 0) / elapsed, 1) if elapsed else 0.0,
+        'bot_api_calls': stats.get('calls', {}),
+    }
+
+
+def start_fake_services(args, updates: list, telegram_port: int, upstream_port: int, hold: bool = False):
+    profiles = {
+        name: UpstreamProfile(args.latency, args.jitter, args.failure_rate if name != 'telegram' else 0.0)
+        for name in UPSTREAMS
+    }
+    profiles['telegram'].latency = args.telegram_latency
+
+    context = multiprocessing.get_context('spawn')
+    ready = context.Event()
+    fake = context.Process(
+        target=run_fake_services,
+        args=(HOST, telegram_port, upstream_port, updates, profiles, args.rate, args.image_size, ready, (), hold),
+        name='bench-fake-services', daemon=True,
+    )
+    fake.start()
+    if not ready.wait(30):
+        fake.terminate()
+        raise RuntimeError("Имитация Telegram и внешних API не запустилась")
+    return fake
+
+
+def run_workers_scaling(args) -> list:
+    """Прогон main.py для каждого числа процессов из args.workers"""
+    results = []
+    for workers in args.workers:
+        telegram_port, upstream_port = free_port(), free_port()
+        workdir = tempfile.mkdtemp(prefix='bot-bench-')
+        configure_environment(args, telegram_port, upstream_port, workdir)
+        os.environ.update({
+            'WORKERS': str(workers),
+            'SHARED_CACHE_URL': 'sqlite:///' + os.path.join(workdir, 'shared_cache.sqlite3'),
+        })
+
+        from utils import CAT_BREEDS
+        updates = make_updates(args.updates, args.users, args.mix, list(CAT_BREEDS.values()), args.seed)
+        fake = start_fake_services(args, updates, telegram_port, upstream_port, hold=True)
+        log_path = os.path.join(workdir, 'bot.log')
+        try:
+            with open(log_path, 'w', encoding='utf-8') as log:
+                bot_process = subprocess.Popen(
+                    [sys.executable, 'main.py'], cwd=ROOT, stdout=log, stderr=subprocess.STDOUT
+                )
+                try:
+                    result = asyncio.run(measure_workers(args, len(updates), workers, telegram_port))
+                finally:
+                    # Ctrl+C: принимающий процесс останавливает обработчики штатно
+                    bot_process.send_signal(signal.SIGINT)
+                    try:
+                        bot_process.wait(timeout=60)
+                    except subprocess.TimeoutExpired:
+                        bot_process.kill()
+                        bot_process.wait()
+        finally:
+            fake.terminate()
+            fake.join()
+        result['log'] = log_path
+        results.append(result)
+        print(f"WORKERS={workers}: {result['updates_per_sec']} обновлений/с", file=sys.stderr)
+    return results
+
+
+def main(args) -> dict:
+    if args.workers:
+        result = {'scaling': run_workers_scaling(args)}
+    else:
+        telegram_port, upstream_port = free_port(), free_port()
+        workdir = tempfile.mkdtemp(prefix='bot-bench-')
+        configure_environment(args, telegram_port, upstream_port, workdir)
+
+        from utils import CAT_BREEDS
+        updates = make_updates(args.updates, args.users, args.mix, list(CAT_BREEDS.values()), args.seed)
+        fake = start_fake_services(args, updates, telegram_port, upstream_port)
+        try:
+            result = asyncio.run(drive(args, len(updates), telegram_port, upstream_port))
+        finally:
+            fake.terminate()
+            fake.join()
+
+    result['config'] = {
+        'users': args.users,
+        'concurrency': args.concurrency,
+        'rate': args.rate,
+        'rate_limit': args.rate_limit,
+        'upstream_latency_s': args.latency,
+        'upstream_jitter_s': args.jitter,
+        'telegram_latency_s': args.telegram_latency,
+        'failure_rate': args.failure_rate,
+        'mix': args.mix,
+        'seed': args.seed,
+    }
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16, help='MAX_CONCURRENT_UPDATES бота')
+    parser.add_argument('--rate', type=float, default=0, help='обновлений в секунду (0 - все сразу)')
+    parser.add_argument('--rate-limit', type=float, default=0, help='RATE_LIMIT_OVERALL (0 - без ограничения)')
+    parser.add_argument('--latency', type=float, default=0.05, help='задержка внешних API, с')
+    parser.add_argument('--jitter', type=float, default=0.02, help='случайная добавка к задержке, с')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='доля ответов 503 от внешних API')
+    parser.add_argument('--telegram-latency', type=float, default=0.01, help='задержка Bot API, с')
+    parser.add_argument('--image-size', type=int, default=60000, help='размер картинок, байт')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help='веса обработчиков, например send_cat_photo=3,wake_up=1')
+    parser.add_argument('--warmup', type=float, default=1.0, help='пауза перед приемом обновлений, с')
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--workers', type=parse_workers,
+                        help='числа процессов бота через запятую, например 1,2,4 (по умолчанию - один процесс в драйвере)')
+    parser.add_argument('--quiet', type=float, default=1.0,
+                        help='с --workers: сколько секунд без отправок считать окончанием обработки')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='файл для JSON-результата (по умолчанию stdout)')
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    report = json.dumps(main(args), ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
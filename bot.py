@@ -1,19 +1,284 @@
 """Запуск и настройка Telegram бота"""
 
 import os
+import sys
 import asyncio
 import logging
-from telegram.ext import Application, MessageHandler, CommandHandler, filters
+import secrets
+from telegram.ext import Application
 
-from utils import TOKEN
-from handlers import (
-    wake_up, say_hi, handle_location, 
-    quote_command, request_location
-)
+from config import get_settings
 
 # Создаем логгер для этого модуля
 logger = logging.getLogger(__name__)
 
+def collect_cache_metrics():
+    """Показатели кэшей и пулов для /metrics"""
+    import utils
+    from utils import cat_pool, file_id_cache, weather_cache, quote_buffer
+
+    # Аватары и загрузка картинок создаются при первом использовании;
+    # сбор метрик не должен создавать их пулы потоков и процессов
+    avatar_stats = utils._avatars.stats() if utils._avatars is not None else {'hits': 0, 'misses': 0}
+    image_stats = utils._images.stats() if utils._images is not None else {
+        'bytes_in_flight': 0, 'too_large': 0, 'downscaled': 0,
+    }
+    samples = []
+    for name, stats in (
+        ('cat_pool', cat_pool.stats()),
+        ('file_id', file_id_cache.stats()),
+        ('weather', weather_cache.stats()),
+        ('quote', quote_buffer.stats()),
+        ('avatar', avatar_stats),
+    ):
+        hits, misses = stats['hits'], stats['misses']
+        hit_ratio = stats.get('hit_ratio', hits / (hits + misses) if hits + misses else 0.0)
+        samples.append(('bot_cache_hits', {'cache': name}, hits))
+        samples.append(('bot_cache_misses', {'cache': name}, misses))
+        samples.append(('bot_cache_hit_ratio', {'cache': name}, hit_ratio))
+    for breed_id, size in cat_pool.stats()['sizes'].items():
+        samples.append(('bot_cat_pool_size', {'breed': breed_id}, size))
+    samples.append(('bot_file_id_cache_size', {}, len(file_id_cache)))
+    weather_stats = weather_cache.stats()
+    samples.append(('bot_weather_api_calls', {}, weather_stats['api_calls']))
+    samples.append(('bot_weather_api_calls_saved', {}, weather_stats['api_calls_saved']))
+    samples.append(('bot_weather_coalesced', {}, weather_stats['coalesced']))
+    for stage in ('lookup', 'upstream'):
+        for q, value in weather_stats[f'{stage}_ms'].items():
+            samples.append(('bot_weather_latency_ms', {'stage': stage, 'quantile': str(q / 100)}, value))
+    quote_stats = quote_buffer.stats()
+    samples.append(('bot_quote_buffer_depth', {}, quote_stats['depth']))
+    samples.append(('bot_quote_corpus_size', {}, quote_stats['corpus']))
+    samples.append(('bot_quote_refill_ms', {'stat': 'last'}, quote_stats['refill_ms_last']))
+    samples.append(('bot_quote_refill_ms', {'stat': 'avg'}, quote_stats['refill_ms_avg']))
+    samples.append(('bot_image_bytes_in_flight', {}, image_stats['bytes_in_flight']))
+    samples.append(('bot_image_too_large', {}, image_stats['too_large']))
+    samples.append(('bot_image_downscaled', {}, image_stats['downscaled']))
+    return samples
+
+def collect_upstream_metrics():
+    """Состояние предохранителей и текущие таймауты внешних API для /metrics"""
+    from utils import get_upstreams
+
+    samples = []
+    for name, upstream in get_upstreams().items():
+        stats = upstream.stats()
+        samples.append(('bot_upstream_circuit_open', {'upstream': name}, int(stats['state'] != 'closed')))
+        samples.append(('bot_upstream_timeout_seconds', {'upstream': name}, stats['timeout']))
+    return samples
+
+def collect_update_metrics(application: Application):
+    """Обновления, принятые из очереди: в обработке и всего не завершенных"""
+    processor = application.update_processor
+    if not hasattr(processor, 'pending'):
+        return []
+    return [
+        ('bot_update_tasks_running', {}, processor.in_flight),
+        ('bot_update_tasks_pending', {}, processor.pending),
+    ]
+
+async def start_metrics(application: Application):
+    """Запуск /metrics и профилирования медленных обновлений, если они включены"""
+    from metrics import registry, MetricsServer, set_slow_update_hook
+
+    settings = get_settings()
+    set_slow_update_hook(settings.slow_update_threshold)
+    if not settings.metrics_port:
+        return
+    registry.register_collector(collect_cache_metrics)
+    registry.register_collector(collect_upstream_metrics)
+    registry.register_collector(lambda: [
+        ('bot_update_queue_depth', {}, get_queue_depth(application)),
+    ])
+    registry.register_collector(lambda: collect_update_metrics(application))
+    # Каждый процесс-обработчик слушает свой порт: metrics_port + номер процесса
+    port = settings.metrics_port + application.bot_data.get('worker_index', 0)
+    server = MetricsServer(settings.metrics_host, port)
+    try:
+        await server.start()
+    except OSError as e:
+        logger.warning(f"Не удалось запустить сервер метрик на порту {port}: {e}")
+        return
+    application.bot_data['metrics_server'] = server
+
+async def on_startup(application: Application):
+    """Инициализация общих ресурсов после запуска приложения"""
+    from utils import http, keyboards, file_id_cache, quote_buffer, cat_pool, shared_cache
+
+    settings = get_settings()
+    await http.start()
+    keyboards.warm_up()
+    file_id_cache.load()
+    quote_buffer.load()
+    await start_metrics(application)
+
+    # В режиме нескольких процессов пулы общие, и фоново их пополняет только первый
+    prefetch = application.bot_data.get('worker_index', 0) == 0
+
+    if application.job_queue is None:
+        logger.warning("JobQueue недоступна, пулы фото и цитат будут пополняться только по запросам, рассылки не запланированы")
+    else:
+        if prefetch:
+            application.job_queue.run_repeating(
+                cat_pool.refill_job, interval=settings.cat_pool_refill_interval, first=0, name='cat_pool_refill'
+            )
+            application.job_queue.run_repeating(
+                quote_buffer.refill_job, interval=settings.quote_refill_interval, first=0, name='quote_refill'
+            )
+            if settings.broadcast_db_path:
+                application.job_queue.run_once(schedule_broadcasts, when=0, name='broadcast_schedule')
+        application.job_queue.run_repeating(
+            report_queue_depth, interval=settings.queue_depth_report_interval, name='queue_depth'
+        )
+        if shared_cache is not None and 'metrics_server' in application.bot_data:
+            application.job_queue.run_repeating(
+                refresh_pool_sizes, interval=settings.queue_depth_report_interval, first=0, name='pool_sizes'
+            )
+
+async def on_shutdown(application: Application):
+    """Освобождение общих ресурсов при остановке приложения"""
+    from utils import http, close_components, file_id_cache, quote_buffer, shared_cache
+
+    await close_components()
+    await http.close()
+    metrics_server = application.bot_data.pop('metrics_server', None)
+    if metrics_server is not None:
+        await metrics_server.stop()
+    # Процессы-обработчики пишут в одни и те же файлы: сохраняет только первый,
+    # остальным file_id и цитаты доступны через общий кэш
+    if application.bot_data.get('worker_index', 0) == 0:
+        file_id_cache.save()
+        quote_buffer.save()
+    if shared_cache is not None:
+        await shared_cache.close()
+
+async def schedule_broadcasts(context):
+    """Планирование ежедневных рассылок первой задачей JobQueue, а не в post_init:
+    модуль рассылок и база подписок загружаются уже после начала приема обновлений
+    """
+    from utils import get_broadcaster
+
+    settings = get_settings()
+    get_broadcaster().schedule(context.job_queue, {
+        'quote': settings.quote_broadcast_time,
+        'weather': settings.weather_broadcast_time,
+    })
+
+def get_queue_depth(application: Application) -> int:
+    """Количество полученных, но еще не обработанных обновлений"""
+    return application.update_queue.qsize()
+
+async def report_queue_depth(context):
+    """Периодический отчет о глубине очереди входящих обновлений"""
+    limit = get_settings().update_queue_size
+    depth = get_queue_depth(context.application)
+    if limit and depth >= limit * 0.8:
+        logger.warning(f"Очередь обновлений почти заполнена: {depth}/{limit}")
+    else:
+        logger.debug(f"Глубина очереди обновлений: {depth}")
+
+async def refresh_pool_sizes(context):
+    """Глубина общих пулов фото и цитат для /metrics: stats() читает ее без обращения к общему кэшу"""
+    from utils import cat_pool, quote_buffer
+
+    try:
+        await cat_pool.refresh_sizes()
+        await quote_buffer.size()
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать размеры общих пулов: {e}")
+
+def register_handlers(application: Application):
+    """Регистрация обработчиков команд.
+
+    Модуль handlers (а с ним utils, aiohttp и внешние клиенты) импортируется
+    только здесь, поэтому процесс, который лишь принимает обновления,
+    их не загружает.
+    """
+    from telegram.ext import MessageHandler, CommandHandler, filters
+    from handlers import (
+        wake_up, say_hi, handle_location, quote_command, subscribe_command, unsubscribe_command
+    )
+
+    application.add_handler(CommandHandler('start', wake_up))
+    application.add_handler(CommandHandler('quote', quote_command))
+    application.add_handler(CommandHandler('subscribe', subscribe_command))
+    application.add_handler(CommandHandler('unsubscribe', unsubscribe_command))
+    application.add_handler(MessageHandler(filters.TEXT, say_hi)) 
+    application.add_handler(MessageHandler(filters.LOCATION, handle_location)) 
+
+def create_builder(settings):
+    """Общая часть настройки приложения для всех режимов запуска"""
+    # Ограниченная очередь: при заполнении прием обновлений ждет,
+    # и Telegram повторяет доставку позже (обратное давление)
+    builder = (
+        Application.builder()
+        .token(settings.token)
+        .update_queue(asyncio.Queue(maxsize=settings.update_queue_size))
+    )
+    if settings.telegram_api_url:
+        # Собственный сервер Bot API (или его имитация в нагрузочном стенде)
+        api_url = settings.telegram_api_url.rstrip('/')
+        builder = builder.base_url(f"{api_url}/bot").base_file_url(f"{api_url}/file/bot")
+    return builder
+
+def build_application(with_updater: bool = True) -> Application:
+    """Создание приложения бота и регистрация обработчиков.
+
+    Без updater приложение только обрабатывает обновления, которые ему
+    передают извне (процессы-обработчики в режиме нескольких процессов).
+    Необязательные компоненты импортируются, только если они включены.
+    """
+    settings = get_settings()
+    builder = create_builder(settings).post_init(on_startup).post_shutdown(on_shutdown)
+    if not with_updater:
+        builder = builder.updater(None)
+    if settings.max_concurrent_updates > 1:
+        from update_processor import KeyedUpdateProcessor
+        processor = KeyedUpdateProcessor(settings.max_concurrent_updates, settings.max_pending_updates or None)
+        # Очередь отдает обновления, только пока processor может их принять,
+        # иначе обновления уходят в задачи и обратное давление теряется
+        builder = (
+            builder.concurrent_updates(processor)
+            .update_queue(processor.create_queue(settings.update_queue_size))
+        )
+    if settings.persistence_path:
+        from sqlite_persistence import SQLitePersistence
+        builder = builder.persistence(
+            SQLitePersistence(settings.persistence_path, update_interval=settings.persistence_update_interval)
+        )
+    if settings.rate_limit_overall > 0:
+        from rate_limiter import SendScheduler
+        builder = builder.rate_limiter(SendScheduler(
+            overall_rate=settings.rate_limit_overall,
+            chat_rate=settings.rate_limit_per_chat,
+            chat_burst=settings.rate_limit_chat_burst,
+            group_rate=settings.rate_limit_per_group_minute / 60,
+            max_retries=settings.rate_limit_max_retries,
+        ))
+    application = builder.build()
+    register_handlers(application)
+    return application
+
+def webhook_options(settings) -> dict:
+    """Параметры вебхука с секретным токеном; подходят и для run_webhook, и для Updater.start_webhook"""
+    if not settings.webhook_url:
+        raise ValueError("Для режима webhook необходимо указать WEBHOOK_URL")
+
+    # Без явно заданного секрета генерируем случайный на время работы процесса
+    secret_token = settings.webhook_secret or secrets.token_urlsafe(32)
+    return {
+        'listen': settings.webhook_listen,
+        'port': settings.webhook_port,
+        'url_path': settings.webhook_path,
+        'webhook_url': f"{settings.webhook_url.rstrip('/')}/{settings.webhook_path}",
+        'secret_token': secret_token,
+        'max_connections': settings.webhook_max_connections,
+    }
+
+def run_webhook(application: Application):
+    """Запуск в режиме вебхука с проверкой секретного токена"""
+    application.run_webhook(**webhook_options(get_settings()))
+
 def run_bot():
     """Главная функция запуска бота с обработкой критических ошибок"""
     try:
@@ -21,23 +286,30 @@ def run_bot():
         if os.name == 'nt':
             asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
         
+        settings = get_settings()
+        settings.validate()
         logger.info("Запуск бота...")
         
-        # Создание приложения бота
-        application = Application.builder().token(TOKEN).build()
+        if settings.workers > 1:
+            # Импорт здесь: модуль workers сам использует build_application
+            from workers import run_workers
+            print(f"🤖 Бот запущен в {settings.workers} процессах! Нажмите Ctrl+C для остановки.")
+            run_workers(settings.workers)
+            return
         
-        # Регистрация обработчиков команд
-        application.add_handler(CommandHandler('start', wake_up))
-        application.add_handler(CommandHandler('quote', quote_command))
-        application.add_handler(MessageHandler(filters.TEXT, say_hi)) 
-        application.add_handler(MessageHandler(filters.LOCATION, handle_location)) 
+        # Создание приложения бота
+        application = build_application()
         
         # Запуск бота
         logger.info("Бот успешно запущен и готов к работе!")
         print("🤖 Бот запущен! Нажмите Ctrl+C для остановки.")
         
-        application.run_polling()
+        if settings.bot_mode == 'webhook':
+            run_webhook(application)
+        else:
+            application.run_polling()
         
     except Exception as e:
         logger.critical(f"Критическая ошибка при запуске бота: {e}")
-        print(f"❌ Критическая ошибка при запуске бота: {e}")
\ No newline at end of file
+        print(f"❌ Критическая ошибка при запуске бота: {e}")
+        sys.exit(1)
\ No newline at end of file
@@ -0,0 +1,406 @@
+"""Подписки и ежедневные рассылки: цитата дня и утренний прогноз погоды"""
+
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+import datetime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from telegram.error import Forbidden, BadRequest, RetryAfter, TelegramError
+
+from metrics import BROADCAST_MESSAGES
+from rate_limiter import TokenBucket, BULK
+from serial_executor import SerialExecutor
+
+# Создаем логгер для этого модуля
+logger = logging.getLogger(__name__)
+
+# Ключ содержимого для тем без привязки к местоположению
+NO_AREA = ''
+
+# Курсор новой рассылки: меньше любого chat_id, включая отрицательные id групп
+START_CURSOR = -2 ** 63
+
+
+def area_key(lat, lon) -> str:
+    """Ключ ячейки сетки в сохраненном содержимом рассылки"""
+    if lat is None:
+        return NO_AREA
+    return f'{lat}:{lon}'
+
+
+class SubscriptionStore:
+    """Подписки и ход рассылок в SQLite (WAL).
+
+    Для подписок с местоположением хранится не точка, а ячейка сетки кэша
+    погоды, поэтому прогноз для рассылки запрашивается один раз на ячейку.
+    Рассылка проходит подписчиков по возрастанию chat_id и после каждой
+    пачки сохраняет последний обработанный chat_id: после сбоя она
+    продолжается с него. Все обращения к базе выполняются в отдельном
+    потоке, чтобы не блокировать цикл событий.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._executor = SerialExecutor('subscriptions')
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            # База общая для процессов-обработчиков, поэтому ждем чужие записи
+            self._connection = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS subscriptions '
+                '(topic TEXT NOT NULL, chat_id INTEGER NOT NULL, lat REAL, lon REAL, '
+                'PRIMARY KEY (topic, chat_id)) WITHOUT ROWID'
+            )
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS subscriptions_chat ON subscriptions (chat_id)'
+            )
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS broadcast_runs '
+                '(run_id TEXT PRIMARY KEY, topic TEXT NOT NULL, payload TEXT NOT NULL, '
+                'cursor INTEGER NOT NULL DEFAULT 0, sent INTEGER NOT NULL DEFAULT 0, '
+                'failed INTEGER NOT NULL DEFAULT 0, blocked INTEGER NOT NULL DEFAULT 0, '
+                'skipped INTEGER NOT NULL DEFAULT 0, started_at REAL NOT NULL, finished_at REAL)'
+            )
+            self._connection.commit()
+        return self._connection
+
+    def _subscribe(self, rows: list):
+        with self._connect() as connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO subscriptions (topic, chat_id, lat, lon) VALUES (?, ?, ?, ?)', rows
+            )
+
+    def _move(self, chat_id: int, topic: str, lat: float, lon: float):
+        with self._connect() as connection:
+            connection.execute(
+                'UPDATE subscriptions SET lat = ?, lon = ? WHERE topic = ? AND chat_id = ?',
+                (lat, lon, topic, chat_id),
+            )
+
+    def _unsubscribe(self, chat_ids: list, topic: str):
+        with self._connect() as connection:
+            if topic is None:
+                connection.executemany(
+                    'DELETE FROM subscriptions WHERE chat_id = ?', ((chat_id,) for chat_id in chat_ids)
+                )
+            else:
+                connection.executemany(
+                    'DELETE FROM subscriptions WHERE topic = ? AND chat_id = ?',
+                    ((topic, chat_id) for chat_id in chat_ids),
+                )
+
+    def _topics(self, chat_id: int) -> list:
+        rows = self._connect().execute(
+            'SELECT topic FROM subscriptions WHERE chat_id = ? ORDER BY topic', (chat_id,)
+        ).fetchall()
+        return [topic for topic, in rows]
+
+    def _count(self, topic: str) -> int:
+        return self._connect().execute(
+            'SELECT COUNT(*) FROM subscriptions WHERE topic = ?', (topic,)
+        ).fetchone()[0]
+
+    def _areas(self, topic: str) -> list:
+        return self._connect().execute(
+            'SELECT DISTINCT lat, lon FROM subscriptions WHERE topic = ?', (topic,)
+        ).fetchall()
+
+    def _page(self, topic: str, after: int, limit: int) -> list:
+        return self._connect().execute(
+            'SELECT chat_id, lat, lon FROM subscriptions WHERE topic = ? AND chat_id > ? '
+            'ORDER BY chat_id LIMIT ?',
+            (topic, after, limit),
+        ).fetchall()
+
+    def _get_run(self, run_id: str):
+        row = self._connect().execute(
+            'SELECT run_id, topic, payload, cursor, sent, failed, blocked, skipped, started_at, finished_at '
+            'FROM broadcast_runs WHERE run_id = ?', (run_id,)
+        ).fetchone()
+        return self._run_from_row(row) if row else None
+
+    @staticmethod
+    def _run_from_row(row) -> dict:
+        keys = ('run_id', 'topic', 'payload', 'cursor', 'sent', 'failed', 'blocked', 'skipped',
+                'started_at', 'finished_at')
+        run = dict(zip(keys, row))
+        run['payload'] = json.loads(run['payload'])
+        return run
+
+    def _start_run(self, run_id: str, topic: str, payload: dict):
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT INTO broadcast_runs (run_id, topic, payload, cursor, started_at) VALUES (?, ?, ?, ?, ?)',
+                (run_id, topic, json.dumps(payload, ensure_ascii=False), START_CURSOR, time.time()),
+            )
+
+    def _checkpoint(self, run_id: str, cursor: int, counts: dict, blocked_chats: list, topic: str):
+        # Отписка заблокировавших бота и сдвиг курсора - одна транзакция
+        with self._connect() as connection:
+            connection.execute(
+                'UPDATE broadcast_runs SET cursor = ?, sent = ?, failed = ?, blocked = ?, skipped = ? '
+                'WHERE run_id = ?',
+                (cursor, counts['sent'], counts['failed'], counts['blocked'], counts['skipped'], run_id),
+            )
+            if blocked_chats:
+                connection.executemany(
+                    'DELETE FROM subscriptions WHERE topic = ? AND chat_id = ?',
+                    ((topic, chat_id) for chat_id in blocked_chats),
+                )
+
+    def _finish_run(self, run_id: str):
+        with self._connect() as connection:
+            connection.execute(
+                'UPDATE broadcast_runs SET finished_at = ? WHERE run_id = ?', (time.time(), run_id)
+            )
+
+    def _unfinished_runs(self) -> list:
+        rows = self._connect().execute(
+            'SELECT run_id, topic, payload, cursor, sent, failed, blocked, skipped, started_at, finished_at '
+            'FROM broadcast_runs WHERE finished_at IS NULL ORDER BY started_at'
+        ).fetchall()
+        return [self._run_from_row(row) for row in rows]
+
+    async def subscribe(self, chat_id: int, topic: str, area: tuple = None):
+        lat, lon = area if area is not None else (None, None)
+        await self._executor.run(self._subscribe, [(topic, chat_id, lat, lon)])
+
+    async def subscribe_many(self, rows: list):
+        """rows - список (topic, chat_id, lat, lon); для заполнения базы в бенчмарках"""
+        await self._executor.run(self._subscribe, rows)
+
+    async def move(self, chat_id: int, topic: str, area: tuple):
+        """Новая ячейка для существующей подписки; без подписки ничего не делает"""
+        await self._executor.run(self._move, chat_id, topic, *area)
+
+    async def unsubscribe(self, chat_id: int, topic: str = None):
+        await self._executor.run(self._unsubscribe, [chat_id], topic)
+
+    async def topics(self, chat_id: int) -> list:
+        return await self._executor.run(self._topics, chat_id)
+
+    async def count(self, topic: str) -> int:
+        return await self._executor.run(self._count, topic)
+
+    async def areas(self, topic: str) -> list:
+        return await self._executor.run(self._areas, topic)
+
+    async def page(self, topic: str, after: int, limit: int) -> list:
+        return await self._executor.run(self._page, topic, after, limit)
+
+    async def get_run(self, run_id: str):
+        return await self._executor.run(self._get_run, run_id)
+
+    async def start_run(self, run_id: str, topic: str, payload: dict):
+        await self._executor.run(self._start_run, run_id, topic, payload)
+
+    async def checkpoint(self, run_id: str, cursor: int, counts: dict, blocked_chats: list, topic: str):
+        await self._executor.run(self._checkpoint, run_id, cursor, counts, blocked_chats, topic)
+
+    async def finish_run(self, run_id: str):
+        await self._executor.run(self._finish_run, run_id)
+
+    async def unfinished_runs(self) -> list:
+        return await self._executor.run(self._unfinished_runs)
+
+    async def close(self):
+        if self._connection is not None:
+            await self._executor.run(self._connection.close)
+            self._connection = None
+        self._executor.shutdown()
+
+
+class Broadcaster:
+    """Рассылка по подписчикам темы пачками с общим темпом отправки.
+
+    Содержимое готовится один раз на рассылку: render() для тем без
+    местоположения и render(lat, lon) на каждую ячейку сетки для тем с
+    ним (не больше fetch_concurrency запросов одновременно). Готовые
+    тексты сохраняются вместе с ходом рассылки, поэтому продолженная
+    после сбоя рассылка отправляет то же самое.
+
+    Сообщения отправляются пачками по batch_size не быстрее rate в
+    секунду; если у бота есть SendScheduler, они идут в нем после ответов
+    пользователям. Ход сохраняется после каждой пачки, так что после
+    сбоя повторно могут получить сообщение не больше batch_size чатов.
+    """
+
+    def __init__(self, store: SubscriptionStore, rate: float = 25, batch_size: int = 100,
+                 fetch_concurrency: int = 8, timezone: str = 'UTC', max_retries: int = 3):
+        self.store = store
+        self.rate = rate
+        self.batch_size = batch_size
+        self.fetch_concurrency = fetch_concurrency
+        self.max_retries = max_retries
+        try:
+            self.timezone = ZoneInfo(timezone)
+        except (ZoneInfoNotFoundError, ValueError):
+            logger.warning(f"Неизвестный часовой пояс {timezone!r}, рассылки планируются по UTC")
+            self.timezone = datetime.timezone.utc
+        self._bucket = TokenBucket(rate, rate) if rate > 0 else None
+        self._topics = {}
+        self._running = {}
+
+    def register(self, topic: str, render, per_area: bool = False):
+        """Тема рассылки: render - корутина, возвращающая текст или None"""
+        self._topics[topic] = (render, per_area)
+
+    def run_id(self, topic: str, day: datetime.date = None) -> str:
+        """Одна рассылка темы в день: повторный запуск задачи ее не дублирует"""
+        day = day or datetime.datetime.now(self.timezone).date()
+        return f'{topic}:{day.isoformat()}'
+
+    async def prepare(self, topic: str) -> dict:
+        """Тексты рассылки: ключ ячейки -> текст (NO_AREA для тем без местоположения)"""
+        render, per_area = self._topics[topic]
+        if not per_area:
+            return {NO_AREA: await render()}
+
+        semaphore = asyncio.Semaphore(self.fetch_concurrency)
+
+        async def render_area(lat, lon):
+            async with semaphore:
+                try:
+                    return area_key(lat, lon), await render(lat, lon)
+                except Exception as e:
+                    logger.warning(f"Не удалось подготовить рассылку {topic} для {lat}, {lon}: {e}")
+                    return area_key(lat, lon), None
+
+        areas = await self.store.areas(topic)
+        payload = dict(await asyncio.gather(*(render_area(lat, lon) for lat, lon in areas)))
+        logger.info(f"Рассылка {topic}: подготовлено {len(payload)} ячеек")
+        return payload
+
+    async def _send(self, bot, topic: str, chat_id: int, text: str) -> str:
+        if text is None:
+            return 'skipped'
+        # rate_limit_args допустимы, только если у бота есть планировщик отправки
+        kwargs = {'rate_limit_args': BULK} if getattr(bot, 'rate_limiter', None) else {}
+        for attempt in range(self.max_retries + 1):
+            if self._bucket is not None:
+                await self._bucket.acquire()
+            try:
+                await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                return 'sent'
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    break
+                await asyncio.sleep(e.retry_after)
+            except Forbidden:
+                return 'blocked'
+            except BadRequest as e:
+                if 'chat not found' in str(e).lower():
+                    return 'blocked'
+                logger.warning(f"Рассылка {topic}: Telegram отклонил сообщение для {chat_id}: {e}")
+                break
+            except TelegramError as e:
+                logger.warning(f"Рассылка {topic}: ошибка отправки для {chat_id}: {e}")
+                break
+        return 'failed'
+
+    async def run(self, bot, topic: str, run_id: str = None) -> dict:
+        """Рассылка темы с начала или с сохраненного места; возвращает счетчики"""
+        run_id = run_id or self.run_id(topic)
+        task = self._running.get(run_id)
+        if task is not None:
+            # Эта рассылка уже идет (например, задача по расписанию и продолжение после сбоя)
+            return await asyncio.shield(task)
+        task = asyncio.ensure_future(self._broadcast(bot, topic, run_id))
+        self._running[run_id] = task
+        task.add_done_callback(lambda _, run_id=run_id: self._running.pop(run_id, None))
+        return await asyncio.shield(task)
+
+    async def _broadcast(self, bot, topic: str, run_id: str) -> dict:
+        run = await self.store.get_run(run_id)
+        if run is None:
+            payload = await self.prepare(topic)
+            if not any(payload.values()):
+                # Рассылать нечего; задача по расписанию попробует в следующий раз
+                logger.warning(f"Рассылка {run_id} отменена: не удалось подготовить содержимое")
+                return {'sent': 0, 'failed': 0, 'blocked': 0, 'skipped': 0}
+            await self.store.start_run(run_id, topic, payload)
+            cursor = START_CURSOR
+            counts = {'sent': 0, 'failed': 0, 'blocked': 0, 'skipped': 0}
+        elif run['finished_at'] is not None:
+            logger.info(f"Рассылка {run_id} уже завершена")
+            return {key: run[key] for key in ('sent', 'failed', 'blocked', 'skipped')}
+        else:
+            payload = run['payload']
+            cursor = run['cursor']
+            counts = {key: run[key] for key in ('sent', 'failed', 'blocked', 'skipped')}
+            logger.info(f"Продолжаю рассылку {run_id} после chat_id {cursor}, уже отправлено {counts['sent']}")
+
+        started = time.monotonic()
+        while True:
+            page = await self.store.page(topic, cursor, self.batch_size)
+            if not page:
+                break
+            results = await asyncio.gather(*(
+                self._send(bot, topic, chat_id, payload.get(area_key(lat, lon)))
+                for chat_id, lat, lon in page
+            ))
+            blocked_chats = []
+            for (chat_id, _, _), result in zip(page, results):
+                counts[result] += 1
+                BROADCAST_MESSAGES.inc(topic, result)
+                if result == 'blocked':
+                    blocked_chats.append(chat_id)
+            cursor = page[-1][0]
+            await self.store.checkpoint(run_id, cursor, counts, blocked_chats, topic)
+
+        await self.store.finish_run(run_id)
+        logger.info(
+            f"Рассылка {run_id} завершена за {time.monotonic() - started:.1f} с: "
+            f"отправлено {counts['sent']}, ошибок {counts['failed']}, "
+            f"заблокировали бота {counts['blocked']}, без содержимого {counts['skipped']}"
+        )
+        return counts
+
+    async def broadcast_job(self, context):
+        """Задача JobQueue: рассылка темы из job.data"""
+        try:
+            await self.run(context.bot, context.job.data)
+        except Exception as e:
+            logger.error(f"Ошибка рассылки {context.job.data}: {e}")
+
+    async def resume_job(self, context):
+        """Задача JobQueue при запуске: продолжение сегодняшних прерванных рассылок"""
+        try:
+            for run in await self.store.unfinished_runs():
+                if run['topic'] in self._topics and run['run_id'] == self.run_id(run['topic']):
+                    context.application.create_task(self.run(context.bot, run['topic'], run['run_id']))
+                else:
+                    # Вчерашние новости не досылаем
+                    logger.info(f"Прерванная рассылка {run['run_id']} устарела и не будет продолжена")
+                    await self.store.finish_run(run['run_id'])
+        except Exception as e:
+            logger.error(f"Ошибка при продолжении прерванных рассылок: {e}")
+
+    def schedule(self, job_queue, times: dict):
+        """Ежедневные рассылки: times - {тема: 'ЧЧ:ММ'}, пустое время - не планировать"""
+        for topic, value in times.items():
+            if not value:
+                continue
+            try:
+                hour, minute = (int(part) for part in value.split(':'))
+                at = datetime.time(hour, minute, tzinfo=self.timezone)
+            except ValueError:
+                logger.error(f"Неверное время рассылки {topic}: {value!r}, ожидается ЧЧ:ММ")
+                continue
+            job_queue.run_daily(self.broadcast_job, time=at, data=topic, name=f'broadcast_{topic}')
+            logger.info(f"Рассылка {topic} запланирована на {value} ({self.timezone})")
+        job_queue.run_once(self.resume_job, when=0, name='broadcast_resume')
+
+    async def close(self):
+        # Прерванная рассылка продолжится при следующем запуске с сохраненного места
+        for task in list(self._running.values()):
+            task.cancel()
+        await asyncio.gather(*self._running.values(), return_exceptions=True)
+        await self.store.close()
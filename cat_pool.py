@@ -0,0 +1,139 @@
+"""Пул заранее загруженных фото котиков для каждой породы"""
+
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+
+# Создаем логгер для этого модуля
+logger = logging.getLogger(__name__)
+
+
+class CatPhotoPool:
+    """Ограниченная очередь готовых к отправке фото для каждой породы.
+
+    Запрос пользователя обслуживается из пула без обращения к сети,
+    а пул пополняется в фоне задачами JobQueue и после каждой выдачи.
+    Если передан shared, очереди хранятся в общем кэше и доступны всем
+    процессам бота.
+    """
+
+    def __init__(self, fetch, breeds, depth: int = 3, max_age: float = 3600, shared=None):
+        # fetch - корутина breed_id -> {'image', 'breed', 'url'} или None
+        self._fetch = fetch
+        self.depth = depth
+        self.max_age = max_age
+        self.shared = shared
+        self._pools = {breed_id: deque(maxlen=depth) for breed_id in breeds}
+        # Последняя прочитанная из общего кэша длина очереди каждой породы
+        self._shared_sizes = {}
+        self._refilling = set()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.fallbacks = 0
+
+    def _is_stale(self, photo: dict) -> bool:
+        return photo['fetched_at'] < time.time() - self.max_age
+
+    async def _pop(self, breed_id: str):
+        if self.shared is not None:
+            return await self.shared.pop(f'cat_pool:{breed_id}')
+        pool = self._pools[breed_id]
+        return pool.popleft() if pool else None
+
+    async def _push(self, breed_id: str, photo: dict):
+        if self.shared is not None:
+            await self.shared.push(f'cat_pool:{breed_id}', photo, maxlen=self.depth)
+        else:
+            self._pools[breed_id].append(photo)
+
+    async def size(self, breed_id: str) -> int:
+        if breed_id not in self._pools:
+            return 0
+        if self.shared is not None:
+            self._shared_sizes[breed_id] = await self.shared.length(f'cat_pool:{breed_id}')
+            return self._shared_sizes[breed_id]
+        return len(self._pools[breed_id])
+
+    async def refresh_sizes(self):
+        """Перечитывает длины общих очередей для stats()"""
+        for breed_id in self._pools:
+            await self.size(breed_id)
+
+    async def _take_fresh(self, breed_id: str):
+        """Первое не устаревшее фото из пула породы; устаревшие выбрасываются"""
+        while True:
+            photo = await self._pop(breed_id)
+            if photo is None or not self._is_stale(photo):
+                return photo
+            self.evicted += 1
+
+    async def take(self, breed_id: str):
+        """Возвращает готовое фото породы или None, если пул пуст"""
+        if breed_id in self._pools:
+            photo = await self._take_fresh(breed_id)
+            if photo is not None:
+                self.hits += 1
+                return photo
+        self.misses += 1
+        return None
+
+    async def take_any(self):
+        """Готовое фото любой породы - запасной вариант, когда API недоступно"""
+        breeds = list(self._pools)
+        random.shuffle(breeds)
+        for breed_id in breeds:
+            photo = await self._take_fresh(breed_id)
+            if photo is not None:
+                self.fallbacks += 1
+                return photo
+        return None
+
+    async def refill(self, breed_id: str):
+        """Догружает фото породы до заданной глубины пула"""
+        if breed_id not in self._pools or breed_id in self._refilling:
+            return
+        self._refilling.add(breed_id)
+        try:
+            if self.shared is None:
+                pool = self._pools[breed_id]
+                while pool and self._is_stale(pool[0]):
+                    pool.popleft()
+                    self.evicted += 1
+            while await self.size(breed_id) < self.depth:
+                photo = await self._fetch(breed_id)
+                if not photo:
+                    logger.warning(f"Не удалось пополнить пул фото породы {breed_id}")
+                    break
+                photo['fetched_at'] = time.time()
+                await self._push(breed_id, photo)
+        except Exception as e:
+            logger.warning(f"Ошибка при пополнении пула фото породы {breed_id}: {e}")
+        finally:
+            self._refilling.discard(breed_id)
+
+    async def refill_all(self):
+        """Пополняет пулы всех пород параллельно"""
+        await asyncio.gather(*(self.refill(breed_id) for breed_id in self._pools))
+
+    async def refill_job(self, context):
+        """Колбэк для JobQueue.run_repeating"""
+        await self.refill_all()
+
+    def stats(self) -> dict:
+        """Счетчики пула; с общим кэшем размеры - последние прочитанные size() значения"""
+        if self.shared is not None:
+            sizes = {breed_id: self._shared_sizes.get(breed_id, 0) for breed_id in self._pools}
+        else:
+            sizes = {breed_id: len(pool) for breed_id, pool in self._pools.items()}
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evicted': self.evicted,
+            'fallbacks': self.fallbacks,
+            'hit_ratio': self.hits / requests if requests else 0.0,
+            'sizes': sizes,
+        }
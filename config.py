@@ -0,0 +1,170 @@
+"""Настройки бота: читаются из окружения и .env один раз за процесс"""
+
+import os
+import logging
+from dataclasses import dataclass, fields
+
+# Создаем логгер для этого модуля
+logger = logging.getLogger(__name__)
+
+
+class ConfigError(ValueError):
+    """Обязательная настройка не задана или задана неверно"""
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Все настройки бота; имя переменной окружения - имя поля в верхнем регистре"""
+
+    token: str = ''
+    token_weather: str = ''
+    # Пустой адрес - без прокси
+    proxy_url: str = 'http://proxy.server:3128'
+
+    # Адреса внешних API (переопределяются, например, для нагрузочного стенда)
+    telegram_api_url: str = ''
+    cat_api_url: str = 'https://api.thecatapi.com/v1'
+    quote_api_url: str = 'https://api.forismatic.com/api/1.0/'
+    weather_api_url: str = 'https://api.openweathermap.org/data/2.5/weather'
+    robohash_url: str = 'https://robohash.org'
+
+    # Режим работы: 'polling' или 'webhook'
+    bot_mode: str = 'polling'
+    webhook_url: str = ''
+    webhook_listen: str = '0.0.0.0'
+    webhook_port: int = 8443
+    webhook_path: str = 'telegram'
+    webhook_secret: str = ''
+    webhook_max_connections: int = 100
+    update_queue_size: int = 10000
+    queue_depth_report_interval: float = 30
+
+    # Параллельная обработка обновлений (1 - строго по одному, как раньше)
+    max_concurrent_updates: int = 1
+    max_pending_updates: int = 0
+
+    # Хранение user_data между перезапусками (пустой путь - без сохранения)
+    persistence_path: str = ''
+    persistence_update_interval: float = 30
+
+    # Лимиты исходящих сообщений (0 в rate_limit_overall отключает планировщик)
+    rate_limit_overall: float = 30
+    rate_limit_per_chat: float = 1
+    rate_limit_chat_burst: float = 3
+    rate_limit_per_group_minute: float = 20
+    rate_limit_max_retries: int = 2
+    # Если ответ готов быстрее, временное сообщение "Ищу..." не отправляется
+    status_message_delay: float = 0.3
+
+    # Несколько процессов-обработчиков (0 или 1 - один процесс, как раньше)
+    workers: int = 0
+    # Общий для процессов кэш: '', 'memory://' или 'sqlite:///путь'
+    shared_cache_url: str = ''
+    # Значений в общем кэше не больше shared_cache_max_entries, истекшие удаляются
+    # не реже раза в shared_cache_prune_interval секунд
+    shared_cache_max_entries: int = 100000
+    shared_cache_prune_interval: float = 60
+
+    # Метрики: порт /metrics (0 - выключено) и порог медленного обновления в секундах
+    metrics_host: str = '127.0.0.1'
+    metrics_port: int = 0
+    slow_update_threshold: float = 0
+
+    # Настройки общего HTTP-клиента
+    http_pool_limit: int = 100
+    http_pool_limit_per_host: int = 20
+    http_keepalive_timeout: float = 30
+    http_dns_cache_ttl: int = 300
+    api_timeout: float = 5
+    image_timeout: float = 10
+    weather_timeout: float = 10
+
+    # Защита от деградации внешних API: таймауты выше задают верхнюю границу,
+    # фактический таймаут подстраивается под наблюдаемую задержку
+    upstream_min_timeout: float = 1
+    upstream_timeout_multiplier: float = 3
+    circuit_failure_threshold: int = 5
+    circuit_reset_timeout: float = 30
+    # Задержка перед дублирующим запросом картинки (0 - по p95 задержки загрузок)
+    image_hedge_delay: float = 0
+
+    # Загрузка картинок: лимит размера (у Telegram он 10 МБ на фото) и число одновременных загрузок
+    image_max_bytes: int = 10 * 1024 * 1024
+    image_download_concurrency: int = 8
+    # Картинки больше этого размера уменьшаются до image_max_side (нужен Pillow; 0 - выключено)
+    image_recompress_bytes: int = 1024 * 1024
+    image_max_side: int = 1280
+    image_workers: int = 1
+
+    # Аватары: источник ('robohash' или 'local'), после avatar_remote_timeout секунд
+    # аватар рисуется локально; готовые PNG кэшируются в памяти и в каталоге
+    avatar_source: str = 'robohash'
+    avatar_remote_timeout: float = 2
+    avatar_workers: int = 1
+    avatar_memory_cache_size: int = 256
+    avatar_cache_dir: str = 'avatars'
+    avatar_disk_cache_size: int = 10000
+
+    # Настройки пула заранее загруженных фото котиков
+    cat_pool_depth: int = 3
+    cat_pool_max_age: float = 3600
+    cat_pool_refill_interval: float = 60
+
+    # Кэш file_id отправленных фото (пустой путь - без сохранения на диск)
+    file_id_cache_size: int = 10000
+    file_id_cache_path: str = 'file_ids.json'
+
+    # Кэш погоды: размер ячейки сетки в градусах и время жизни записи
+    weather_cache_grid: float = 0.05
+    weather_cache_ttl: float = 600
+    weather_cache_size: int = 10000
+
+    # Буфер цитат и запасной корпус на диске
+    quote_buffer_depth: int = 20
+    quote_corpus_size: int = 500
+    quote_corpus_path: str = 'quotes.json'
+    quote_refill_interval: float = 300
+
+    # Рассылки: база подписок (пустой путь - рассылки выключены), время ЧЧ:ММ
+    # в broadcast_timezone (пустое - тема не рассылается), темп и размер пачки
+    broadcast_db_path: str = ''
+    broadcast_timezone: str = 'Europe/Moscow'
+    quote_broadcast_time: str = '09:00'
+    weather_broadcast_time: str = '08:00'
+    broadcast_rate: float = 25
+    broadcast_batch_size: int = 100
+    broadcast_fetch_concurrency: int = 8
+
+    def validate(self):
+        """Проверка обязательных настроек перед запуском бота"""
+        if not self.token:
+            raise ConfigError("Не найден TOKEN в файле .env")
+
+
+def load_settings(env_file: str = '.env') -> Settings:
+    """Чтение настроек из переменных окружения, дополненных файлом env_file"""
+    # Импорт здесь: python-dotenv нужен только один раз за процесс
+    from dotenv import load_dotenv
+    load_dotenv(env_file)
+
+    values = {}
+    for field in fields(Settings):
+        raw = os.getenv(field.name.upper())
+        if raw is None:
+            continue
+        try:
+            values[field.name] = field.type(raw)
+        except ValueError:
+            raise ConfigError(f"Неверное значение {field.name.upper()}={raw!r}") from None
+    return Settings(**values)
+
+
+_settings = None
+
+
+def get_settings() -> Settings:
+    """Настройки процесса; загружаются при первом обращении"""
+    global _settings
+    if _settings is None:
+        _settings = load_settings()
+    return _settings
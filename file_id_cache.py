@@ -0,0 +1,106 @@
+"""LRU-кэш Telegram file_id для повторной отправки фото без загрузки"""
+
+import os
+import json
+import logging
+from collections import OrderedDict
+
+# Создаем логгер для этого модуля
+logger = logging.getLogger(__name__)
+
+
+class FileIdCache:
+    """Соответствие "исходный URL или хэш -> file_id" с вытеснением LRU.
+
+    Если задан path, кэш загружается с диска при старте и сохраняется
+    при остановке бота. Если передан shared, file_id, полученные одним
+    процессом, становятся доступны остальным через lookup/remember.
+    """
+
+    def __init__(self, max_size: int = 10000, path: str = None, shared=None):
+        self.max_size = max_size
+        self.path = path
+        self.shared = shared
+        self._items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: str):
+        file_id = self._items.get(key)
+        if file_id is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return file_id
+
+    def put(self, key: str, file_id: str):
+        self._items[key] = file_id
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def invalidate(self, key: str):
+        if self._items.pop(key, None) is not None:
+            logger.info(f"file_id для {key} удален из кэша")
+
+    async def lookup(self, key: str):
+        """get с обращением к общему кэшу при локальном промахе"""
+        file_id = self.get(key)
+        if file_id is None and self.shared is not None:
+            file_id = await self.shared.get(f'file_id:{key}')
+            if file_id is not None:
+                self.put(key, file_id)
+        return file_id
+
+    async def remember(self, key: str, file_id: str):
+        """put с записью в общий кэш"""
+        self.put(key, file_id)
+        if self.shared is not None:
+            await self.shared.set(f'file_id:{key}', file_id)
+
+    async def forget(self, key: str):
+        """invalidate с удалением из общего кэша"""
+        self.invalidate(key)
+        if self.shared is not None:
+            await self.shared.delete(f'file_id:{key}')
+
+    def load(self):
+        """Загрузка кэша с диска, если файл существует"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                items = json.load(f)
+            self._items = OrderedDict(items[-self.max_size:])
+            logger.info(f"Загружено {len(self._items)} file_id из {self.path}")
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось загрузить кэш file_id: {e}")
+
+    def save(self):
+        """Атомарное сохранение кэша на диск"""
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(list(self._items.items()), f, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+            logger.info(f"Сохранено {len(self._items)} file_id в {self.path}")
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить кэш file_id: {e}")
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            'size': len(self._items),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / requests if requests else 0.0,
+        }
@@ -1,20 +1,73 @@
 """Обработчики команд Telegram бота"""
 
 import random
+import asyncio
 import aiohttp
 import logging
-from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
+from telegram import Update
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes
 
 from utils import (
     get_user_info, get_quote_of_the_day, get_cat_photo_by_breed,
     get_simple_cat_photo, get_breed_name, get_weather,
-    get_main_keyboard, CAT_BREEDS, generate_cat_avatar
+    get_main_keyboard, get_breed_keyboard, get_location_keyboard, BREED_BY_NAME,
+    CAT_BREEDS, get_avatars, cat_pool,
+    file_id_cache, download_image, quote_buffer, settings,
+    format_quote, get_subscriptions, weather_cache
 )
+from routes import (
+    TEXT_ROUTES, route,
+    BUTTON_CAT_PHOTO, BUTTON_AVATAR, BUTTON_QUOTE, BUTTON_MY_ID,
+    BUTTON_WEATHER, BUTTON_LAST_LOCATION_WEATHER, BUTTON_BACK, BUTTON_AVATAR_REROLL
+)
+from metrics import instrumented
 
 # Создаем логгер для этого модуля
 logger = logging.getLogger(__name__)
 
+async def reply_photo_cached(update: Update, cache_key: str, photo, caption: str):
+    """Отправка фото с переиспользованием file_id, ранее выданного Telegram.
+
+    photo - байты или URL изображения, либо корутинная функция без
+    аргументов, которая вернет байты (вызывается, только если file_id
+    нет); None означает, что изображение нужно загрузить по cache_key.
+    """
+    file_id = await file_id_cache.lookup(cache_key)
+    if file_id:
+        try:
+            return await update.message.reply_photo(photo=file_id, caption=caption)
+        except BadRequest as e:
+            logger.warning(f"Telegram отклонил сохраненный file_id для {cache_key}: {e}")
+            await file_id_cache.forget(cache_key)
+
+    if callable(photo):
+        photo = await photo()
+    elif photo is None:
+        photo = await download_image(cache_key)
+        if photo is None:
+            raise aiohttp.ClientError(f"Не удалось загрузить изображение {cache_key}")
+
+    message = await update.message.reply_photo(photo=photo, caption=caption)
+    if message.photo:
+        await file_id_cache.remember(cache_key, message.photo[-1].file_id)
+    return message
+
+async def run_with_status(update: Update, status_text: str, awaitable):
+    """Ожидание результата с временным сообщением о поиске.
+
+    Временное сообщение отправляется, только если результат не готов за
+    settings.status_message_delay секунд. Возвращает результат и отправленное
+    сообщение (или None), которое вызывающий код удаляет сам.
+    """
+    task = asyncio.ensure_future(awaitable)
+    done, _ = await asyncio.wait({task}, timeout=settings.status_message_delay)
+    if task in done:
+        return task.result(), None
+    status_message = await update.message.reply_text(status_text)
+    return await task, status_message
+
+@instrumented
 async def wake_up(update: Update, context: ContextTypes.DEFAULT_TYPE): 
     """Обработка команды /start с обработкой ошибок"""
     try:
@@ -33,51 +86,45 @@ async def wake_up(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=get_main_keyboard()
         )
 
+@instrumented
 async def quote_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка команды /quote"""
     logger.info(f"Пользователь {update.effective_user.id} запросил цитату дня")
     await send_quote_of_the_day(update, context)
 
+@route(BUTTON_QUOTE)
+@instrumented
 async def send_quote_of_the_day(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Отправка цитаты дня пользователю с обработкой ошибок"""
     try:
-        temp_message = await update.message.reply_text("Ищу цитату дня...")
-        quote_data = await get_quote_of_the_day()
-        final_message = f"Цитата дня:\n\n«{quote_data['quote']}»\n— {quote_data['author']}"
-        await temp_message.delete()
+        quote_data, temp_message = await run_with_status(
+            update, "Ищу цитату дня...", get_quote_of_the_day()
+        )
+        context.application.create_task(quote_buffer.refill())
+        final_message = format_quote(quote_data)
+        if temp_message:
+            await temp_message.delete()
         await update.message.reply_text(final_message)
         logger.info(f"Цитата отправлена пользователю {update.effective_user.id}")
     except Exception as e:
         logger.error(f"Ошибка при отправке цитаты: {e}")
         await update.message.reply_text("Не удалось загрузить цитату. Попробуйте позже.")
 
+@route(BUTTON_CAT_PHOTO)
+@instrumented
 async def show_breed_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показ меню выбора породы котика с обработкой ошибок"""
     try:
-        breed_buttons = []
-        breeds_list = list(CAT_BREEDS.items())
-        
-        for i in range(0, len(breeds_list), 2):
-            row = []
-            if i < len(breeds_list):
-                row.append(breeds_list[i][1])
-            if i + 1 < len(breeds_list):
-                row.append(breeds_list[i + 1][1])
-            breed_buttons.append(row)
-        
-        breed_buttons.append(['Назад'])
-        
-        breed_keyboard = ReplyKeyboardMarkup(breed_buttons, resize_keyboard=True)
-        
         await update.message.reply_text(
             "Выберите породу кошки:",
-            reply_markup=breed_keyboard
+            reply_markup=get_breed_keyboard()
         )
         logger.info(f"Пользователь {update.effective_user.id} выбрал меню пород котиков")
     except Exception as e:
         logger.error(f"Ошибка при показе меню выбора породы: {e}")
         await update.message.reply_text("Не удалось показать меню выбора породы")
 
+@instrumented
 async def send_cat_photo(update: Update, context: ContextTypes.DEFAULT_TYPE, breed_id: str = None):
     """Отправка фото котика пользователю с обработкой ошибок"""
     try:
@@ -90,19 +137,36 @@ async def send_cat_photo(update: Update, context: ContextTypes.DEFAULT_TYPE, bre
             breed_id = random.choice(breeds)
         
         logger.info(f"Пользователь {user_id} запросил фото котика породы {breed_id}")
-        searching_message = await update.message.reply_text("Ищем самого милого котика для вас...")
-        cat_photo, actual_breed_id = await get_cat_photo_by_breed(breed_id)
+        pooled_photo = await cat_pool.take(breed_id)
+        
+        if pooled_photo:
+            # Пополняем только после выдачи из пула: при промахе фото уже
+            # загружается ниже, и пополнение загрузило бы ту же породу дважды
+            context.application.create_task(cat_pool.refill(breed_id))
+            searching_message = None
+            cat_photo = pooled_photo
+        else:
+            cat_photo, searching_message = await run_with_status(
+                update, "Ищем самого милого котика для вас...", get_cat_photo_by_breed(breed_id)
+            )
         
         if cat_photo:
-            await searching_message.delete()
+            if searching_message:
+                await searching_message.delete()
+            actual_breed_id = cat_photo['breed']
             breed_name = get_breed_name(actual_breed_id)
-            await update.message.reply_photo(
-                photo=cat_photo,
+            await reply_photo_cached(
+                update,
+                cat_photo['url'],
+                cat_photo['image'],
                 caption=f"Вот специально для тебя, {user_name}! 🐱\nПорода: {breed_name}"
             )
             logger.info(f"Фото котика породы {actual_breed_id} отправлено пользователю {user_id}")
         else:
-            await searching_message.edit_text("Не удалось найти котика. Попробуйте позже!")
+            if searching_message:
+                await searching_message.edit_text("Не удалось найти котика. Попробуйте позже!")
+            else:
+                await update.message.reply_text("Не удалось найти котика. Попробуйте позже!")
             logger.warning(f"Не удалось найти фото котика для пользователя {user_id}")
             
     except aiohttp.ClientError as e:
@@ -112,22 +176,27 @@ async def send_cat_photo(update: Update, context: ContextTypes.DEFAULT_TYPE, bre
         logger.error(f"Ошибка при отправке фото котика: {e}")
         await update.message.reply_text("Произошла ошибка при поиске котика")
 
+@route(BUTTON_AVATAR)
+@instrumented
 async def send_avatar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Отправка сгенерированного аватара-котика с обработкой ошибок"""
+    from avatars import avatar_key
+
     try:
         user = update.effective_user
         user_id = user.id
         user_name = user.first_name or "Пользователь"
-        username = user.username or ""
         
         logger.info(f"Пользователь {user_id} запросил аватар-котика")
         
-        # Генерируем URL для аватара-котика
-        avatar_url = generate_cat_avatar(user_id, username)
+        # Аватар постоянный для пользователя, пока он не попросит другой
+        key = avatar_key(user_id, context.user_data.get('avatar_variant', 0))
         
-        # Отправляем аватар-котика пользователю
-        await update.message.reply_photo(
-            photo=avatar_url,
+        # Повторно отправляем по file_id; PNG рисуется или берется из кэша только при его отсутствии
+        await reply_photo_cached(
+            update,
+            f'avatar:{key}',
+            lambda: get_avatars().get(key),
             caption=f"Ваш уникальный аватар-котик, {user_name}! 🐱\nСгенерирован на основе вашего ID: {user_id}"
         )
         
@@ -139,6 +208,29 @@ async def send_avatar(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Ошибка при отправке аватара-котика: {e}")
         await update.message.reply_text("Не удалось сгенерировать аватар-котика")
 
+@route(BUTTON_AVATAR_REROLL)
+@instrumented
+async def reroll_avatar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Новый вариант аватара-котика вместо постоянного"""
+    context.user_data['avatar_variant'] = context.user_data.get('avatar_variant', 0) + 1
+    await send_avatar(update, context)
+
+@route(BUTTON_BACK)
+@instrumented
+async def go_back(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Возврат в главное меню"""
+    await update.message.reply_text(
+        "Возвращаюсь в главное меню...",
+        reply_markup=get_main_keyboard()
+    )
+
+@route(BUTTON_MY_ID)
+@instrumented
+async def send_user_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отправка пользователю его Telegram ID"""
+    await update.message.reply_text(text=f'Твой ID: {update.effective_user.id}')
+
+@instrumented
 async def say_hi(update: Update, context: ContextTypes.DEFAULT_TYPE): 
     """Обработка всех текстовых сообщений с обработкой ошибок"""
     try:
@@ -148,55 +240,41 @@ async def say_hi(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         logger.info(f"Пользователь {user_id} отправил текст: '{text}'")
         
-        if text == 'Назад':
-            await update.message.reply_text(
-                "Возвращаюсь в главное меню...",
-                reply_markup=get_main_keyboard()
-            )
-            return
-        
-        elif text == 'Сгенерировать аватар-котика':
-            await send_avatar(update, context)
-        elif text == 'Мой ID': 
-            await update.message.reply_text(text=f'Твой ID: {user_info[3]}')  # user_id теперь на 3-й позиции
-        elif text == 'Прогноз погоды': 
-            await request_location(update, context)
-        elif text == 'Цитата дня':
-            await send_quote_of_the_day(update, context)
-        elif text == 'Фото котика':
-            await show_breed_selection(update, context)
-        elif text in CAT_BREEDS.values():
-            breed_id = None
-            for breed_key, breed_name in CAT_BREEDS.items():
-                if breed_name == text:
-                    breed_id = breed_key
-                    break
-            await send_cat_photo(update, context, breed_id if breed_id else None)
+        handler = TEXT_ROUTES.get(text)
+        if handler is not None:
+            await handler(update, context)
+        elif text in BREED_BY_NAME:
+            await send_cat_photo(update, context, BREED_BY_NAME[text])
         else: 
             await update.message.reply_text(text=f'{user_info[1]}, как твои дела?')
     except Exception as e:
         logger.error(f"Ошибка при обработке текстового сообщения: {e}")
         await update.message.reply_text("Произошла ошибка обработки команды")
 
+@route(BUTTON_WEATHER)
+@instrumented
 async def request_location(update: Update, context: ContextTypes.DEFAULT_TYPE): 
     """Запрос местоположения у пользователя с обработкой ошибок"""
     try:
         user_id = update.effective_user.id
         logger.info(f"Пользователь {user_id} запросил прогноз погоды")
         
-        location_keyboard = ReplyKeyboardMarkup( 
-            [[KeyboardButton('Отправить координаты', request_location=True)]], 
-            resize_keyboard=True,
-            one_time_keyboard=True
-        ) 
         await update.message.reply_text(
             text='Пожалуйста, поделитесь своей геолокацией для получения прогноза погоды:',
-            reply_markup=location_keyboard
+            reply_markup=get_location_keyboard()
         )
     except Exception as e:
         logger.error(f"Ошибка при запросе местоположения: {e}")
         await update.message.reply_text("Не удалось запросить местоположение")
 
+async def move_weather_subscription(chat_id: int, latitude: float, longitude: float):
+    """Утренний прогноз подписчика приходит для последней присланной точки"""
+    try:
+        await get_subscriptions().move(chat_id, 'weather', weather_cache.bucket(latitude, longitude))
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении точки прогноза для чата {chat_id}: {e}")
+
+@instrumented
 async def handle_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка полученного местоположения с обработкой ошибок"""
     try:
@@ -216,9 +294,81 @@ async def handle_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         await update.message.reply_text(weather_info, reply_markup=get_main_keyboard())
         logger.info(f"Погода отправлена пользователю {user_id}")
+        if settings.broadcast_db_path:
+            # Запись в базу подписок - уже после ответа, чтобы не задерживать прогноз
+            context.application.create_task(
+                move_weather_subscription(update.effective_chat.id, latitude, longitude)
+            )
     except AttributeError as e:
         logger.error(f"Неверный формат местоположения: {e}")
         await update.message.reply_text("Неверный формат местоположения", reply_markup=get_main_keyboard())
     except Exception as e:
         logger.error(f"Ошибка при обработке местоположения: {e}")
-        await update.message.reply_text("Ошибка обработки местоположения", reply_markup=get_main_keyboard())
\ No newline at end of file
+        await update.message.reply_text("Ошибка обработки местоположения", reply_markup=get_main_keyboard())
+
+@route(BUTTON_LAST_LOCATION_WEATHER)
+@instrumented
+async def send_last_location_weather(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Погода по последнему сохраненному местоположению без повторного запроса геолокации"""
+    try:
+        user_id = update.effective_user.id
+        location = context.user_data.get('location')
+        if not location:
+            logger.info(f"У пользователя {user_id} нет сохраненного местоположения")
+            await request_location(update, context)
+            return
+        
+        latitude, longitude = location
+        logger.info(f"Пользователь {user_id} запросил погоду в последней точке: {latitude}, {longitude}")
+        weather_info = await get_weather(latitude, longitude)
+        
+        await update.message.reply_text(weather_info, reply_markup=get_main_keyboard())
+        logger.info(f"Погода отправлена пользователю {user_id}")
+    except Exception as e:
+        logger.error(f"Ошибка при отправке погоды в последней точке: {e}")
+        await update.message.reply_text("Не удалось получить прогноз погоды", reply_markup=get_main_keyboard())
+
+@instrumented
+async def subscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Подписка на ежедневную цитату и, если известна геолокация, утренний прогноз погоды"""
+    try:
+        chat_id = update.effective_chat.id
+        subscriptions = get_subscriptions()
+        # Без JobQueue рассылки не запланированы: подписка ничего бы не принесла
+        if subscriptions is None or context.job_queue is None:
+            await update.message.reply_text("Рассылки сейчас отключены")
+            return
+
+        await subscriptions.subscribe(chat_id, 'quote')
+        location = context.user_data.get('location')
+        if location:
+            await subscriptions.subscribe(chat_id, 'weather', weather_cache.bucket(*location))
+            await update.message.reply_text(
+                "Вы подписаны на цитату дня и утренний прогноз погоды. Отписаться: /unsubscribe",
+                reply_markup=get_main_keyboard()
+            )
+        else:
+            await update.message.reply_text(
+                "Вы подписаны на цитату дня. Чтобы утром получать прогноз погоды, "
+                "поделитесь геолокацией и повторите /subscribe",
+                reply_markup=get_location_keyboard()
+            )
+        logger.info(f"Пользователь {update.effective_user.id} подписался на рассылки")
+    except Exception as e:
+        logger.error(f"Ошибка при оформлении подписки: {e}")
+        await update.message.reply_text("Не удалось оформить подписку. Попробуйте позже.")
+
+@instrumented
+async def unsubscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отписка от всех рассылок"""
+    try:
+        subscriptions = get_subscriptions()
+        if subscriptions is None:
+            await update.message.reply_text("Рассылки сейчас отключены")
+            return
+        await subscriptions.unsubscribe(update.effective_chat.id)
+        await update.message.reply_text("Вы отписались от рассылок. Подписаться снова: /subscribe")
+        logger.info(f"Пользователь {update.effective_user.id} отписался от рассылок")
+    except Exception as e:
+        logger.error(f"Ошибка при отписке: {e}")
+        await update.message.reply_text("Не удалось отписаться. Попробуйте позже.")
@@ -0,0 +1,67 @@
+"""Общий HTTP-клиент для всех исходящих запросов к внешним API"""
+
+import logging
+import aiohttp
+
+# Создаем логгер для этого модуля
+logger = logging.getLogger(__name__)
+
+
+class HttpClient:
+    """Одна aiohttp-сессия на всё приложение с пулом соединений.
+
+    Сессия создается в post_init приложения и закрывается при остановке,
+    поэтому TCP+TLS рукопожатие через прокси выполняется один раз на
+    соединение, а не на каждый запрос пользователя.
+    """
+
+    def __init__(self, limit: int = 100, limit_per_host: int = 20,
+                 keepalive_timeout: float = 30, dns_cache_ttl: int = 300,
+                 timeout: float = 5, proxy: str = None):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.proxy = proxy
+        self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Текущая сессия; создается лениво, если start() еще не вызывали"""
+        if self._session is None or self._session.closed:
+            self._session = self._create_session()
+        return self._session
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.dns_cache_ttl,
+            use_dns_cache=True,
+        )
+        logger.info(
+            f"Создана HTTP-сессия (limit={self.limit}, "
+            f"limit_per_host={self.limit_per_host}, keepalive={self.keepalive_timeout}s)"
+        )
+        return aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+
+    def get(self, url: str, timeout: float = None, **kwargs):
+        """Аналог session.get с прокси и таймаутом по умолчанию"""
+        kwargs.setdefault('proxy', self.proxy)
+        if timeout is not None:
+            kwargs['timeout'] = aiohttp.ClientTimeout(total=timeout)
+        return self.session.get(url, **kwargs)
+
+    async def start(self):
+        """Открывает сессию (вызывается из post_init приложения)"""
+        if self._session is None or self._session.closed:
+            self._session = self._create_session()
+
+    async def close(self):
+        """Закрывает сессию и все соединения пула"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("HTTP-сессия закрыта")
+        self._session = None
@@ -0,0 +1,124 @@
+"""Загрузка картинок с ограничением размера и памяти, уменьшение больших картинок"""
+
+import asyncio
+import logging
+import importlib.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Создаем логгер для этого модуля
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ImageTooLarge(ValueError):
+    """Картинка больше допустимого размера; загрузка прервана"""
+
+
+def _downscale(data: bytes, max_side: int, quality: int) -> bytes:
+    """Выполняется в отдельном процессе: уменьшение и пережатие в JPEG"""
+    import io
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        image.thumbnail((max_side, max_side))
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=quality, optimize=True)
+    result = output.getvalue()
+    return result if len(result) < len(data) else data
+
+
+class ImagePipeline:
+    """Потоковое чтение ответа с лимитом размера и числа одновременных загрузок.
+
+    Память на загрузки ограничена concurrency * max_bytes: ответ читается
+    частями, и загрузка прерывается, как только превышен max_bytes (или
+    сразу, если об этом говорит Content-Length). Если установлен Pillow и
+    recompress_bytes > 0, картинки больше recompress_bytes уменьшаются до
+    max_side по большей стороне в пуле процессов, не блокируя цикл событий.
+    """
+
+    def __init__(self, max_bytes: int = 10 * 1024 * 1024, concurrency: int = 8,
+                 recompress_bytes: int = 0, max_side: int = 1280,
+                 quality: int = 85, workers: int = 1):
+        self.max_bytes = max_bytes
+        self.recompress_bytes = recompress_bytes
+        self.max_side = max_side
+        self.quality = quality
+        self.workers = workers
+        self._slots = asyncio.Semaphore(concurrency)
+        self._executor = None
+        self.can_downscale = recompress_bytes > 0 and importlib.util.find_spec('PIL') is not None
+        if recompress_bytes > 0 and not self.can_downscale:
+            logger.info("Pillow не установлен, большие картинки отправляются без уменьшения")
+        self.bytes_in_flight = 0
+        self.peak_bytes_in_flight = 0
+        self.too_large = 0
+        self.downscaled = 0
+
+    def slot(self):
+        """Семафор на одну загрузку: async with pipeline.slot(): ..."""
+        return self._slots
+
+    async def read(self, response) -> bytes:
+        """Чтение тела ответа aiohttp частями с проверкой размера"""
+        if response.content_length is not None and response.content_length > self.max_bytes:
+            self.too_large += 1
+            raise ImageTooLarge(f"Картинка {response.content_length} байт больше лимита {self.max_bytes}")
+
+        chunks = []
+        size = 0
+        try:
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                size += len(chunk)
+                self._track(len(chunk))
+                if size > self.max_bytes:
+                    self.too_large += 1
+                    raise ImageTooLarge(f"Картинка больше лимита {self.max_bytes} байт")
+                chunks.append(chunk)
+            return b''.join(chunks)
+        finally:
+            self._track(-size)
+
+    def _track(self, delta: int):
+        self.bytes_in_flight += delta
+        self.peak_bytes_in_flight = max(self.peak_bytes_in_flight, self.bytes_in_flight)
+
+    async def prepare(self, data: bytes) -> bytes:
+        """Уменьшенная копия большой картинки или исходные байты"""
+        if not self.can_downscale or len(data) <= self.recompress_bytes:
+            return data
+        if self._executor is None:
+            # spawn, а не fork: процесс бота уже запустил потоки, и их блокировки
+            # в скопированном fork процессе могут остаться захваченными навсегда
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+            )
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(
+                self._executor, _downscale, data, self.max_side, self.quality
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось уменьшить картинку: {e}")
+            return data
+        if len(result) < len(data):
+            self.downscaled += 1
+            logger.debug(f"Картинка уменьшена с {len(data)} до {len(result)} байт")
+        return result
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            'bytes_in_flight': self.bytes_in_flight,
+            'peak_bytes_in_flight': self.peak_bytes_in_flight,
+            'too_large': self.too_large,
+            'downscaled': self.downscaled,
+        }
@@ -0,0 +1,69 @@
+"""Реестр заранее построенных клавиатур бота"""
+
+import logging
+from telegram import ReplyKeyboardMarkup
+
+# Создаем логгер для этого модуля
+logger = logging.getLogger(__name__)
+
+
+class PrebuiltReplyKeyboardMarkup(ReplyKeyboardMarkup):
+    """Клавиатура, которая преобразуется в словарь для Bot API только один раз.
+
+    Объекты клавиатур в PTB неизменяемы, поэтому результат to_dict()
+    можно переиспользовать во всех ответах.
+    """
+
+    __slots__ = ('_payload',)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._payload = None
+
+    def to_dict(self, recursive: bool = True) -> dict:
+        if not recursive:
+            return super().to_dict(recursive=False)
+        if self._payload is None:
+            self._payload = super().to_dict()
+        return self._payload
+
+
+class KeyboardRegistry:
+    """Клавиатуры по имени, каждая строится один раз при первом обращении.
+
+    Если исходные данные клавиатуры (список пород, подписи кнопок)
+    изменились, ее нужно сбросить через invalidate(): следующий get()
+    построит ее заново.
+    """
+
+    def __init__(self):
+        self._builders = {}
+        self._markups = {}
+
+    def register(self, name: str, builder):
+        self._builders[name] = builder
+        self._markups.pop(name, None)
+
+    def get(self, name: str) -> ReplyKeyboardMarkup:
+        markup = self._markups.get(name)
+        if markup is not None:
+            return markup
+
+        markup = self._builders[name]()
+        # Сериализуем сразу, чтобы первый ответ не платил за это
+        markup.to_dict()
+        self._markups[name] = markup
+        logger.debug(f"Построена клавиатура '{name}'")
+        return markup
+
+    def invalidate(self, name: str = None):
+        """Сброс одной клавиатуры или всех сразу"""
+        if name is None:
+            self._markups.clear()
+        else:
+            self._markups.pop(name, None)
+
+    def warm_up(self):
+        """Построение всех зарегистрированных клавиатур заранее"""
+        for name in self._builders:
+            self.get(name)
@@ -0,0 +1,240 @@
+"""Метрики бота в формате Prometheus и инструментирование обработчиков"""
+
+import io
+import time
+import asyncio
+import logging
+import functools
+import contextvars
+from contextlib import asynccontextmanager
+
+# Создаем логгер для этого модуля
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{value}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        for labels, value in self._values.items():
+            yield f'{self.name}{_format_labels(self.labelnames, labels)} {value}'
+
+
+class Gauge(Counter):
+    def set(self, *labels, value: float):
+        self._values[labels] = value
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def render(self):
+        for line in super().render():
+            yield line.replace(' counter', ' gauge') if line.startswith('# TYPE') else line
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (),
+                 buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # метки -> [счетчики по корзинам, сумма, количество]
+        self._values = {}
+
+    def observe(self, *labels, value: float):
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][i] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def render(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, (counts, total, count) in self._values.items():
+            for bound, bucket_count in zip(self.buckets, counts):
+                bucket_labels = _format_labels(self.labelnames + ('le',), labels + (bound,))
+                yield f'{self.name}_bucket{bucket_labels} {bucket_count}'
+            inf_labels = _format_labels(self.labelnames + ('le',), labels + ('+Inf',))
+            yield f'{self.name}_bucket{inf_labels} {count}'
+            yield f'{self.name}_sum{_format_labels(self.labelnames, labels)} {total}'
+            yield f'{self.name}_count{_format_labels(self.labelnames, labels)} {count}'
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        """collector() -> список кортежей (имя, метки-словарь, значение) для gauge"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                samples = collector()
+            except Exception as e:
+                logger.warning(f"Ошибка сбора метрик: {e}")
+                continue
+            for name, labels, value in samples:
+                lines.append(
+                    f'{name}{_format_labels(tuple(labels), tuple(labels.values()))} {value}'
+                )
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+HANDLER_LATENCY = registry.register(Histogram(
+    'bot_handler_latency_seconds', 'Время работы обработчика', ('handler',)
+))
+HANDLER_ERRORS = registry.register(Counter(
+    'bot_handler_errors_total', 'Необработанные исключения в обработчиках', ('handler',)
+))
+UPDATES_IN_FLIGHT = registry.register(Gauge(
+    'bot_updates_in_flight', 'Обновления, которые обрабатываются прямо сейчас'
+))
+UPSTREAM_LATENCY = registry.register(Histogram(
+    'bot_upstream_latency_seconds', 'Время запроса к внешнему API', ('upstream',)
+))
+UPSTREAM_ERRORS = registry.register(Counter(
+    'bot_upstream_errors_total', 'Ошибки запросов к внешним API', ('upstream', 'kind')
+))
+BROADCAST_MESSAGES = registry.register(Counter(
+    'bot_broadcast_messages_total', 'Сообщения рассылок по результату отправки', ('topic', 'result')
+))
+
+# Внутри обработчика вложенные вызовы других обработчиков не считаются отдельными обновлениями
+_inside_handler = contextvars.ContextVar('inside_handler', default=False)
+
+_slow_update_threshold = 0.0
+_slow_update_hook = None
+
+
+def _log_slow_update(handler_name: str, task: asyncio.Task, elapsed: float):
+    stack = io.StringIO()
+    task.print_stack(file=stack)
+    logger.warning(
+        f"Обработчик {handler_name} работает дольше {elapsed:.2f} с, текущий стек:\n{stack.getvalue()}"
+    )
+
+
+def set_slow_update_hook(threshold: float, hook=_log_slow_update):
+    """Включает снимок стека для обновлений, обрабатываемых дольше threshold секунд.
+
+    hook(handler_name, task, elapsed) вызывается один раз за обновление,
+    пока обработчик еще выполняется; threshold <= 0 отключает проверку.
+    """
+    global _slow_update_threshold, _slow_update_hook
+    _slow_update_threshold = threshold
+    _slow_update_hook = hook if threshold > 0 else None
+
+
+def instrumented(handler):
+    """Декоратор обработчика: задержка, ошибки и число обновлений в работе"""
+    name = handler.__name__
+
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        top_level = not _inside_handler.get()
+        token = _inside_handler.set(True)
+        if top_level:
+            UPDATES_IN_FLIGHT.inc()
+
+        sample = None
+        if _slow_update_hook is not None:
+            task = asyncio.current_task()
+            sample = asyncio.get_running_loop().call_later(
+                _slow_update_threshold, _slow_update_hook, name, task, _slow_update_threshold
+            )
+
+        started = time.perf_counter()
+        try:
+            return await handler(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(name, value=time.perf_counter() - started)
+            if sample is not None:
+                sample.cancel()
+            if top_level:
+                UPDATES_IN_FLIGHT.dec()
+            _inside_handler.reset(token)
+
+    return wrapper
+
+
+@asynccontextmanager
+async def observe_upstream(upstream: str):
+    """Замер запроса к внешнему API: задержка, таймауты и ошибки"""
+    started = time.perf_counter()
+    try:
+        yield
+    except asyncio.TimeoutError:
+        UPSTREAM_ERRORS.inc(upstream, 'timeout')
+        raise
+    except Exception:
+        UPSTREAM_ERRORS.inc(upstream, 'error')
+        raise
+    finally:
+        UPSTREAM_LATENCY.observe(upstream, value=time.perf_counter() - started)
+
+
+class MetricsServer:
+    """HTTP-сервер с единственным адресом /metrics"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 9100):
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def _handle(self, request):
+        from aiohttp import web
+        return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8')
+
+    async def start(self):
+        # Серверная часть aiohttp заметно увеличивает время импорта, а нужна только с /metrics
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Метрики доступны по адресу http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,184 @@
+"""Буфер заранее загруженных цитат с локальным запасным корпусом"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import deque
+
+# Создаем логгер для этого модуля
+logger = logging.getLogger(__name__)
+
+
+class QuoteBuffer:
+    """Кольцевой буфер свежих цитат, пополняемый в фоне.
+
+    Все когда-либо полученные цитаты без повторов хранятся в корпусе
+    ограниченного размера, который сохраняется на диск. Если сеть
+    недоступна, бот по кругу выдает цитаты из корпуса. Если передан
+    shared, свежие цитаты хранятся в общей для всех процессов очереди.
+    """
+
+    def __init__(self, fetch, depth: int = 20, corpus_size: int = 500,
+                 path: str = None, max_duplicates: int = 5, shared=None):
+        # fetch - корутина без аргументов -> {'quote', 'author'} или None
+        self._fetch = fetch
+        self.depth = depth
+        self.corpus_size = corpus_size
+        self.path = path
+        self.max_duplicates = max_duplicates
+        self.shared = shared
+        self._fresh = deque(maxlen=depth)
+        # Последняя прочитанная из общего кэша длина очереди свежих цитат
+        self._shared_depth = 0
+        self._corpus = []
+        self._corpus_pos = 0
+        self._fallback_pos = 0
+        self._seen = set()
+        self._refilling = False
+        self._refill_task = None
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+        self.refill_latency = deque(maxlen=100)
+
+    def _remember(self, quote: dict) -> bool:
+        """Добавляет цитату в корпус; False, если такая уже есть"""
+        text = quote['quote']
+        if text in self._seen:
+            return False
+        self._seen.add(text)
+        if len(self._corpus) < self.corpus_size:
+            self._corpus.append(quote)
+        else:
+            # Корпус заполнен: перезаписываем самую старую цитату
+            self._seen.discard(self._corpus[self._corpus_pos]['quote'])
+            self._corpus[self._corpus_pos] = quote
+            self._corpus_pos = (self._corpus_pos + 1) % self.corpus_size
+        return True
+
+    async def take(self):
+        """Свежая цитата из буфера или None, если буфер пуст"""
+        if self.shared is not None:
+            quote = await self.shared.pop('quotes:fresh')
+        else:
+            quote = self._fresh.popleft() if self._fresh else None
+        if quote:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return quote
+
+    async def size(self) -> int:
+        if self.shared is not None:
+            self._shared_depth = await self.shared.length('quotes:fresh')
+            return self._shared_depth
+        return len(self._fresh)
+
+    async def _push(self, quote: dict):
+        if self.shared is not None:
+            await self.shared.push('quotes:fresh', quote, maxlen=self.depth)
+        else:
+            self._fresh.append(quote)
+
+    def fallback(self):
+        """Следующая цитата из сохраненного корпуса по кругу"""
+        if not self._corpus:
+            return None
+        self.fallbacks += 1
+        quote = self._corpus[self._fallback_pos % len(self._corpus)]
+        self._fallback_pos = (self._fallback_pos + 1) % len(self._corpus)
+        return quote
+
+    async def get(self):
+        """Цитата из буфера; при промахе - из корпуса, а буфер пополняется в фоне.
+
+        В сеть за цитатой пользователь ждет, только пока корпус пуст.
+        """
+        quote = await self.take()
+        if quote:
+            if self.shared is not None:
+                # Цитату мог загрузить другой процесс: пополняем и свой корпус
+                self._remember(quote)
+            return quote
+        if self._corpus:
+            self._schedule_refill()
+            return self.fallback()
+        quote = await self._fetch()
+        if quote:
+            self._remember(quote)
+            return quote
+        return self.fallback()
+
+    def _schedule_refill(self):
+        if self._refilling or (self._refill_task is not None and not self._refill_task.done()):
+            return
+        # Ссылка на задачу нужна, иначе ее может собрать сборщик мусора
+        self._refill_task = asyncio.ensure_future(self.refill())
+
+    async def refill(self):
+        """Догружает свежие цитаты до заданной глубины буфера"""
+        if self._refilling:
+            return
+        self._refilling = True
+        duplicates = 0
+        try:
+            while duplicates < self.max_duplicates and await self.size() < self.depth:
+                started = time.perf_counter()
+                quote = await self._fetch()
+                self.refill_latency.append(time.perf_counter() - started)
+                if not quote:
+                    break
+                if self._remember(quote):
+                    await self._push(quote)
+                else:
+                    duplicates += 1
+        finally:
+            self._refilling = False
+
+    async def refill_job(self, context):
+        """Колбэк для JobQueue.run_repeating"""
+        await self.refill()
+        self.save()
+
+    def load(self):
+        """Загрузка корпуса с диска, если файл существует"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                items = json.load(f)
+            for text, author in items[-self.corpus_size:]:
+                self._remember({'quote': text, 'author': author})
+            logger.info(f"Загружено {len(self._corpus)} цитат из {self.path}")
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось загрузить корпус цитат: {e}")
+
+    def save(self):
+        """Атомарное сохранение корпуса на диск"""
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        try:
+            # Порядок от старых к новым, чтобы при загрузке сохранить очередность вытеснения
+            ordered = self._corpus[self._corpus_pos:] + self._corpus[:self._corpus_pos]
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump([[q['quote'], q['author']] for q in ordered], f,
+                          ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить корпус цитат: {e}")
+
+    def stats(self) -> dict:
+        """Счетчики буфера; с общим кэшем глубина - последнее прочитанное size() значение"""
+        latency_ms = [value * 1000 for value in self.refill_latency]
+        return {
+            'depth': self._shared_depth if self.shared is not None else len(self._fresh),
+            'corpus': len(self._corpus),
+            'hits': self.hits,
+            'misses': self.misses,
+            'fallbacks': self.fallbacks,
+            'refill_ms_last': latency_ms[-1] if latency_ms else 0.0,
+            'refill_ms_avg': sum(latency_ms) / len(latency_ms) if latency_ms else 0.0,
+        }
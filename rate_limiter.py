@@ -0,0 +1,155 @@
+"""Ограничение частоты исходящих запросов к Telegram Bot API"""
+
+import time
+import asyncio
+import logging
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+# Создаем логгер для этого модуля
+logger = logging.getLogger(__name__)
+
+# Методы, загружающие файлы: пропускаем их после текстовых ответов
+HEAVY_ENDPOINTS = frozenset({
+    'sendPhoto', 'sendMediaGroup', 'sendDocument', 'sendVideo',
+    'sendAnimation', 'sendAudio', 'sendVoice', 'sendSticker',
+})
+
+# rate_limit_args массовых рассылок: такие запросы пропускают вперед ответы пользователям
+BULK = 'bulk'
+
+
+class TokenBucket:
+    """Классическое ведро токенов: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+    def try_acquire(self) -> float:
+        """Забирает токен и возвращает 0, а если токена нет - время до его появления"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        while True:
+            delay = self.try_acquire()
+            if not delay:
+                return
+            await asyncio.sleep(delay)
+
+
+class SendScheduler(BaseRateLimiter):
+    """Планировщик исходящих запросов с общим, чатовым и групповым лимитами.
+
+    Текстовые ответы получают приоритет перед загрузкой фото и рассылками
+    (rate_limit_args=BULK), а при RetryAfter все запросы приостанавливаются
+    на указанное Telegram время.
+    """
+
+    def __init__(self, overall_rate: float = 30, chat_rate: float = 1, chat_burst: float = 3,
+                 group_rate: float = 20 / 60, group_burst: float = 5,
+                 max_retries: int = 2, max_buckets: int = 10000):
+        self._overall = TokenBucket(overall_rate, overall_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+        self.max_buckets = max_buckets
+        self._buckets = {}
+        self._text_waiting = 0
+        self._text_idle = asyncio.Event()
+        self._text_idle.set()
+        self._retry_after_event = asyncio.Event()
+        self._retry_after_event.set()
+        self.throttled = 0
+        self.retries = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _get_bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= self.max_buckets:
+                self._prune()
+            # Отрицательные id и @username - группы и каналы
+            if isinstance(chat_id, str) or chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def _prune(self):
+        # Полные ведра ничем не отличаются от новых, их можно удалить
+        idle = [chat_id for chat_id, bucket in self._buckets.items() if bucket.is_full()]
+        for chat_id in idle:
+            del self._buckets[chat_id]
+
+    async def _acquire_overall(self, heavy: bool):
+        if heavy:
+            while True:
+                # Проверка перед каждой попыткой: текст, пришедший, пока фото
+                # ждало токен, все равно получает его первым
+                await self._text_idle.wait()
+                delay = self._overall.try_acquire()
+                if not delay:
+                    return
+                await asyncio.sleep(delay)
+
+        self._text_waiting += 1
+        self._text_idle.clear()
+        try:
+            await self._overall.acquire()
+        finally:
+            self._text_waiting -= 1
+            if self._text_waiting == 0:
+                self._text_idle.set()
+
+    async def _acquire(self, endpoint: str, chat_id, bulk: bool = False):
+        started = time.monotonic()
+        await self._retry_after_event.wait()
+        if chat_id is not None:
+            await self._get_bucket(chat_id).acquire()
+        await self._acquire_overall(bulk or endpoint in HEAVY_ENDPOINTS)
+        if time.monotonic() - started > 0.01:
+            self.throttled += 1
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        bulk = rate_limit_args == BULK
+        max_retries = self.max_retries if rate_limit_args is None or bulk else rate_limit_args
+        chat_id = data.get('chat_id')
+        if isinstance(chat_id, str) and chat_id.lstrip('-').isdigit():
+            chat_id = int(chat_id)
+
+        for attempt in range(max_retries + 1):
+            await self._acquire(endpoint, chat_id, bulk)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == max_retries:
+                    raise
+                self.retries += 1
+                logger.warning(f"Telegram ограничил частоту запросов ({endpoint}), ждем {e.retry_after} с")
+                self._retry_after_event.clear()
+                await asyncio.sleep(e.retry_after + 0.1)
+                self._retry_after_event.set()
@@ -0,0 +1,202 @@
+"""Защита от деградации внешних API: предохранители, адаптивные таймауты, дублирующие запросы"""
+
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+
+import aiohttp
+
+from metrics import observe_upstream, UPSTREAM_ERRORS
+from weather_cache import percentile
+
+# Создаем логгер для этого модуля
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(aiohttp.ClientError):
+    """Предохранитель разомкнут: запрос к API не выполнялся.
+
+    Наследуется от aiohttp.ClientError, поэтому существующие обработчики
+    сетевых ошибок переходят к запасному варианту без изменений.
+    """
+
+
+class CircuitBreaker:
+    """Предохранитель: после failure_threshold ошибок подряд запросы не выполняются.
+
+    Через reset_timeout секунд пропускается один пробный запрос
+    (полуоткрытое состояние): успех замыкает цепь, ошибка снова
+    размыкает ее на reset_timeout.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    @property
+    def available(self) -> bool:
+        """Можно ли сейчас обращаться к API (без изменения состояния)"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            return time.monotonic() - self.opened_at >= self.reset_timeout
+        return not self._probe_in_flight
+
+    def allow(self) -> bool:
+        """Разрешение на запрос; в полуоткрытом состоянии - только одному"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info(f"API {self.name} снова доступно, предохранитель замкнут")
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_cancelled(self):
+        """Запрос прерван не по вине API: состояние не меняется"""
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(
+                    f"API {self.name} недоступно ({self.failures} ошибок подряд), "
+                    f"запросы приостановлены на {self.reset_timeout:.0f} с"
+                )
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class UpstreamCall:
+    """Один запрос через Upstream.request; fail() отмечает неуспешный ответ"""
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.failed = False
+
+    def fail(self):
+        self.failed = True
+
+
+class Upstream:
+    """Внешнее API с предохранителем и таймаутом по наблюдаемой задержке.
+
+    Таймаут запроса - p99 успешных ответов, умноженный на multiplier,
+    в пределах [min_timeout, max_timeout]. Пока ответов меньше
+    min_samples, используется max_timeout.
+    """
+
+    def __init__(self, name: str, max_timeout: float, min_timeout: float = 1.0,
+                 multiplier: float = 3.0, failure_threshold: int = 5,
+                 reset_timeout: float = 30, window: int = 200, min_samples: int = 20):
+        self.name = name
+        self.max_timeout = max_timeout
+        self.min_timeout = min(min_timeout, max_timeout)
+        self.multiplier = multiplier
+        self.min_samples = min_samples
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self._latency = deque(maxlen=window)
+
+    @property
+    def available(self) -> bool:
+        return self.breaker.available
+
+    def latency(self, q: float) -> float:
+        """Перцентиль q задержки успешных ответов, 0.0 пока их нет"""
+        return percentile(self._latency, q)
+
+    def timeout(self) -> float:
+        if len(self._latency) < self.min_samples:
+            return self.max_timeout
+        adaptive = self.latency(99) * self.multiplier
+        return max(self.min_timeout, min(self.max_timeout, adaptive))
+
+    @asynccontextmanager
+    async def request(self):
+        """Контекст запроса: CircuitOpenError при разомкнутом предохранителе,
+        учет ошибок, таймаутов и задержки (в том числе в метриках)"""
+        if not self.breaker.allow():
+            UPSTREAM_ERRORS.inc(self.name, 'circuit_open')
+            raise CircuitOpenError(f"API {self.name} временно недоступно")
+        call = UpstreamCall(self.timeout())
+        started = time.perf_counter()
+        try:
+            async with observe_upstream(self.name):
+                yield call
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            # Отмена или ошибка в коде бота не говорит о состоянии API
+            self.breaker.record_cancelled()
+            raise
+        if call.failed:
+            self.breaker.record_failure()
+        else:
+            self._latency.append(time.perf_counter() - started)
+            self.breaker.record_success()
+
+    def stats(self) -> dict:
+        return {
+            'state': self.breaker.state,
+            'failures': self.breaker.failures,
+            'timeout': self.timeout(),
+            'p50_ms': self.latency(50) * 1000,
+            'p95_ms': self.latency(95) * 1000,
+        }
+
+
+async def hedged(attempt, delay: float, attempts: int = 2):
+    """Дублирующий запрос: если attempt() не ответил за delay секунд,
+    запускается еще одна попытка, и берется первый успешный результат.
+
+    attempt - функция без аргументов, возвращающая корутину; результат
+    None считается неуспешным. Дубль запускается только из-за медленного
+    ответа, а не после ошибки. Оставшиеся попытки отменяются. Если все
+    попытки неуспешны, пробрасывается последняя ошибка или возвращается None.
+    """
+    pending = {asyncio.ensure_future(attempt())}
+    started = 1
+    error = None
+    try:
+        while pending:
+            timeout = delay if started < attempts else None
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                elif task.result() is not None:
+                    return task.result()
+            # Нет ответа за delay - запускаем следующую попытку
+            if started < attempts and not done:
+                pending.add(asyncio.ensure_future(attempt()))
+                started += 1
+    finally:
+        for task in pending:
+            task.cancel()
+    if error is not None:
+        raise error
+    return None
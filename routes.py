@@ -0,0 +1,46 @@
+"""Таблица маршрутов для текстовых кнопок бота"""
+
+# Подписи кнопок главного меню
+BUTTON_CAT_PHOTO = 'Фото котика'
+BUTTON_AVATAR = 'Сгенерировать аватар-котика'
+BUTTON_AVATAR_REROLL = 'Другой аватар-котик'
+BUTTON_QUOTE = 'Цитата дня'
+BUTTON_MY_ID = 'Мой ID'
+BUTTON_WEATHER = 'Прогноз погоды'
+BUTTON_LAST_LOCATION_WEATHER = 'Погода в последней точке'
+BUTTON_BACK = 'Назад'
+BUTTON_SEND_LOCATION = 'Отправить координаты'
+
+# Раскладка главного меню, общая для клавиатуры и таблицы маршрутов
+MAIN_MENU_ROWS = (
+    (BUTTON_CAT_PHOTO, BUTTON_AVATAR),
+    (BUTTON_QUOTE, BUTTON_MY_ID),
+    (BUTTON_WEATHER, BUTTON_LAST_LOCATION_WEATHER),
+    (BUTTON_AVATAR_REROLL,),
+)
+
+# Подпись кнопки -> обработчик (update, context); заполняется декоратором route
+TEXT_ROUTES = {}
+
+
+def route(label: str):
+    """Регистрирует обработчик текстовой кнопки с подписью label"""
+    def decorator(handler):
+        if label in TEXT_ROUTES:
+            raise ValueError(f"Подпись '{label}' уже занята обработчиком {TEXT_ROUTES[label].__name__}")
+        TEXT_ROUTES[label] = handler
+        return handler
+    return decorator
+
+
+def build_breed_index(breeds: dict) -> dict:
+    """Обратный индекс "название породы -> id породы" для выбора по кнопке"""
+    return {name: breed_id for breed_id, name in breeds.items()}
+
+
+def build_breed_menu_rows(breeds: dict, per_row: int = 2) -> tuple:
+    """Раскладка меню пород по per_row кнопок в ряд с кнопкой "Назад" в конце"""
+    names = list(breeds.values())
+    rows = [tuple(names[i:i + per_row]) for i in range(0, len(names), per_row)]
+    rows.append((BUTTON_BACK,))
+    return tuple(rows)
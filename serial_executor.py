@@ -0,0 +1,23 @@
+"""Выполнение блокирующих вызовов (SQLite) в отдельном потоке"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SerialExecutor:
+    """Один поток на владельца: вызовы выполняются по очереди и не блокируют цикл событий.
+
+    Соединение SQLite, которым пользуется только этот поток, не требует
+    дополнительных блокировок.
+    """
+
+    def __init__(self, name: str):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def shutdown(self):
+        """Дожидается уже переданных вызовов и останавливает поток"""
+        self._executor.shutdown(wait=True)
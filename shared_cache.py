@@ -0,0 +1,230 @@
+"""Общий для нескольких процессов слой кэшей"""
+
+import time
+import pickle
+import sqlite3
+import logging
+from collections import deque
+from serial_executor import SerialExecutor
+
+# Создаем логгер для этого модуля
+logger = logging.getLogger(__name__)
+
+
+class MemorySharedCache:
+    """Локальная замена общего кэша в пределах одного процесса.
+
+    Реализует тот же интерфейс, что и SQLiteSharedCache: значения по ключу
+    с временем жизни и ограниченные очереди (push/pop).
+    """
+
+    def __init__(self, max_entries: int = 100000, prune_interval: float = 60):
+        self.max_entries = max_entries
+        self.prune_interval = prune_interval
+        self._values = {}
+        self._queues = {}
+        self._pruned_at = time.monotonic()
+
+    def _prune(self) -> int:
+        now = time.time()
+        expired = [key for key, (expires_at, _) in self._values.items()
+                   if expires_at is not None and expires_at <= now]
+        for key in expired:
+            del self._values[key]
+        # Словарь хранит ключи в порядке записи: в начале - дольше всех не обновлявшиеся
+        overflow = max(0, len(self._values) - self.max_entries)
+        for key in list(self._values)[:overflow]:
+            del self._values[key]
+        self._pruned_at = time.monotonic()
+        return len(expired) + overflow
+
+    async def get(self, key: str):
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.time():
+            del self._values[key]
+            return None
+        return value
+
+    async def set(self, key: str, value, ttl: float = None):
+        self._values.pop(key, None)
+        self._values[key] = (time.time() + ttl if ttl else None, value)
+        if time.monotonic() - self._pruned_at >= self.prune_interval:
+            self._prune()
+
+    async def delete(self, key: str):
+        self._values.pop(key, None)
+
+    async def push(self, name: str, value, maxlen: int = None):
+        queue = self._queues.setdefault(name, deque())
+        queue.append(value)
+        while maxlen is not None and len(queue) > maxlen:
+            queue.popleft()
+
+    async def pop(self, name: str):
+        queue = self._queues.get(name)
+        return queue.popleft() if queue else None
+
+    async def length(self, name: str) -> int:
+        return len(self._queues.get(name, ()))
+
+    async def prune(self) -> int:
+        """Удаляет истекшие значения и самые старые сверх max_entries; возвращает число удаленных"""
+        return self._prune()
+
+    async def close(self):
+        pass
+
+
+class SQLiteSharedCache:
+    """Общий кэш в файле SQLite (WAL), доступный всем процессам на машине.
+
+    Не реже раза в prune_interval секунд запись значения удаляет истекшие
+    строки и, если их больше max_entries, те, что дольше всех не
+    обновлялись (например, file_id, которые записываются без срока жизни).
+    """
+
+    def __init__(self, path: str, max_entries: int = 100000, prune_interval: float = 60):
+        self.path = path
+        self.max_entries = max_entries
+        self.prune_interval = prune_interval
+        self._executor = SerialExecutor('shared-cache')
+        self._connection = None
+        self._pruned_at = time.monotonic()
+
+    def _connect(self):
+        if self._connection is None:
+            # isolation_level=None: транзакциями управляем явно
+            self._connection = sqlite3.connect(
+                self.path, timeout=5, isolation_level=None, check_same_thread=False
+            )
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS kv '
+                '(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)'
+            )
+            self._connection.execute('CREATE INDEX IF NOT EXISTS kv_expires ON kv (expires_at)')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS queue '
+                '(id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, value BLOB NOT NULL)'
+            )
+            self._connection.execute('CREATE INDEX IF NOT EXISTS queue_name ON queue (name, id)')
+        return self._connection
+
+    def _get(self, key: str):
+        row = self._connect().execute(
+            'SELECT value, expires_at FROM kv WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None
+        return pickle.loads(row[0])
+
+    def _set(self, key: str, value, ttl: float):
+        self._connect().execute(
+            'INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)',
+            (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), time.time() + ttl if ttl else None),
+        )
+        if time.monotonic() - self._pruned_at >= self.prune_interval:
+            self._prune()
+
+    def _prune(self) -> int:
+        connection = self._connect()
+        expired = connection.execute('DELETE FROM kv WHERE expires_at <= ?', (time.time(),)).rowcount
+        # INSERT OR REPLACE выдает строке новый rowid, поэтому меньшие rowid - давно не обновлявшиеся
+        overflow = connection.execute(
+            'DELETE FROM kv WHERE rowid IN (SELECT rowid FROM kv ORDER BY rowid '
+            'LIMIT max(0, (SELECT COUNT(*) FROM kv) - ?))',
+            (self.max_entries,),
+        ).rowcount
+        self._pruned_at = time.monotonic()
+        if expired or overflow:
+            logger.info(f"Общий кэш: удалено истекших {expired}, сверх лимита {overflow}")
+        return expired + overflow
+
+    def _delete(self, key: str):
+        self._connect().execute('DELETE FROM kv WHERE key = ?', (key,))
+
+    def _push(self, name: str, value, maxlen: int):
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute(
+                'INSERT INTO queue (name, value) VALUES (?, ?)',
+                (name, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)),
+            )
+            if maxlen is not None:
+                connection.execute(
+                    'DELETE FROM queue WHERE name = ? AND id NOT IN '
+                    '(SELECT id FROM queue WHERE name = ? ORDER BY id DESC LIMIT ?)',
+                    (name, name, maxlen),
+                )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def _pop(self, name: str):
+        connection = self._connect()
+        # BEGIN IMMEDIATE не дает двум процессам забрать один и тот же элемент
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                'SELECT id, value FROM queue WHERE name = ? ORDER BY id LIMIT 1', (name,)
+            ).fetchone()
+            if row is not None:
+                connection.execute('DELETE FROM queue WHERE id = ?', (row[0],))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return pickle.loads(row[1]) if row else None
+
+    def _length(self, name: str) -> int:
+        return self._connect().execute(
+            'SELECT COUNT(*) FROM queue WHERE name = ?', (name,)
+        ).fetchone()[0]
+
+    def _close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    async def get(self, key: str):
+        return await self._executor.run(self._get, key)
+
+    async def set(self, key: str, value, ttl: float = None):
+        await self._executor.run(self._set, key, value, ttl)
+
+    async def delete(self, key: str):
+        await self._executor.run(self._delete, key)
+
+    async def push(self, name: str, value, maxlen: int = None):
+        await self._executor.run(self._push, name, value, maxlen)
+
+    async def pop(self, name: str):
+        return await self._executor.run(self._pop, name)
+
+    async def length(self, name: str) -> int:
+        return await self._executor.run(self._length, name)
+
+    async def prune(self) -> int:
+        """Удаляет истекшие значения и самые старые сверх max_entries; возвращает число удаленных"""
+        return await self._executor.run(self._prune)
+
+    async def close(self):
+        await self._executor.run(self._close)
+        self._executor.shutdown()
+
+
+def create_shared_cache(url: str, max_entries: int = 100000, prune_interval: float = 60):
+    """Общий кэш по адресу: 'memory://', 'sqlite:///путь' или '' (без общего кэша)"""
+    if not url:
+        return None
+    if url == 'memory://':
+        return MemorySharedCache(max_entries, prune_interval)
+    if url.startswith('sqlite:///'):
+        return SQLiteSharedCache(url[len('sqlite:///'):], max_entries, prune_interval)
+    raise ValueError(f"Неизвестный адрес общего кэша: {url}")
@@ -0,0 +1,166 @@
+"""Хранение user_data в SQLite с пакетной записью и ленивой загрузкой"""
+
+import pickle
+import sqlite3
+import asyncio
+import logging
+from telegram.ext import BasePersistence, PersistenceInput
+from serial_executor import SerialExecutor
+
+# Создаем логгер для этого модуля
+logger = logging.getLogger(__name__)
+
+
+class SQLitePersistence(BasePersistence):
+    """Хранит только user_data, по строке на пользователя, в режиме WAL.
+
+    Данные пользователя читаются из базы при первом его обновлении после
+    запуска, а не все сразу. Изменения, которые Application передает раз
+    в update_interval секунд, записываются одной транзакцией. Все
+    обращения к базе выполняются в отдельном потоке, чтобы не блокировать
+    цикл событий.
+    """
+
+    def __init__(self, path: str, update_interval: float = 30):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = path
+        self._executor = SerialExecutor('sqlite-persistence')
+        self._connection = None
+        self._loaded = set()
+        # user_id -> задача загрузки, которую ждут и последующие обновления пользователя
+        self._loading = {}
+        self._pending = {}
+        self._write_task = None
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS user_data (user_id INTEGER PRIMARY KEY, data BLOB NOT NULL)'
+            )
+            self._connection.commit()
+        return self._connection
+
+    def _load_user(self, user_id: int):
+        row = self._connect().execute(
+            'SELECT data FROM user_data WHERE user_id = ?', (user_id,)
+        ).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def _write(self, updates: dict, deletes: list):
+        connection = self._connect()
+        with connection:
+            if updates:
+                connection.executemany(
+                    'INSERT OR REPLACE INTO user_data (user_id, data) VALUES (?, ?)',
+                    ((user_id, pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+                     for user_id, data in updates.items()),
+                )
+            if deletes:
+                connection.executemany(
+                    'DELETE FROM user_data WHERE user_id = ?', ((user_id,) for user_id in deletes)
+                )
+
+    async def _write_pending(self):
+        # Даем Application передать все изменения текущего интервала
+        await asyncio.sleep(0)
+        pending, self._pending = self._pending, {}
+        updates = {user_id: data for user_id, data in pending.items() if data is not None}
+        deletes = [user_id for user_id, data in pending.items() if data is None]
+        try:
+            await self._executor.run(self._write, updates, deletes)
+            logger.debug(f"Сохранены данные {len(updates)} пользователей, удалены {len(deletes)}")
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка записи данных пользователей в SQLite: {e}")
+            # Возвращаем несохраненное, не затирая более свежие изменения
+            for user_id, data in pending.items():
+                self._pending.setdefault(user_id, data)
+        finally:
+            self._write_task = None
+
+    def _schedule_write(self):
+        if self._write_task is None:
+            self._write_task = asyncio.create_task(self._write_pending())
+
+    async def get_user_data(self) -> dict:
+        # Данные загружаются лениво в refresh_user_data
+        await self._executor.run(self._connect)
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        if user_id in self._loaded:
+            return
+        load = self._loading.get(user_id)
+        if load is None:
+            load = asyncio.ensure_future(self._executor.run(self._load_user, user_id))
+            self._loading[user_id] = load
+            try:
+                stored = await asyncio.shield(load)
+                self._loaded.add(user_id)
+            finally:
+                del self._loading[user_id]
+        else:
+            # Загрузка уже идет для предыдущего обновления: без ожидания
+            # обработчик увидел бы пустой user_data
+            stored = await asyncio.shield(load)
+        if stored:
+            # Значения, уже измененные после запуска, важнее сохраненных
+            for key, value in stored.items():
+                user_data.setdefault(key, value)
+
+    async def update_user_data(self, user_id: int, data: dict):
+        self._pending[user_id] = data
+        self._schedule_write()
+
+    async def drop_user_data(self, user_id: int):
+        self._pending[user_id] = None
+        self._loaded.discard(user_id)
+        self._schedule_write()
+
+    async def flush(self):
+        if self._write_task is not None:
+            await self._write_task
+        if self._pending:
+            await self._write_pending()
+        if self._connection is not None:
+            await self._executor.run(self._connection.close)
+            self._connection = None
+        self._executor.shutdown()
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_conversation(self, name: str, key, new_state):
+        pass
+
+    async def update_chat_data(self, chat_id: int, data: dict):
+        pass
+
+    async def update_bot_data(self, data: dict):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict):
+        pass
@@ -0,0 +1,39 @@
+"""Общие настройки тестов: бот работает против имитаций из benchmarks/fake_services.py"""
+
+import os
+import tempfile
+
+# Настройки читаются один раз за процесс, поэтому задаются до импорта модулей бота.
+# Все, что бот пишет на диск, уходит во временный каталог.
+_workdir = tempfile.mkdtemp(prefix='bot-tests-')
+os.environ.update({
+    'TOKEN': '123456:TEST',
+    'TOKEN_WEATHER': 'test',
+    'PROXY_URL': '',
+    'PERSISTENCE_PATH': '',
+    'FILE_ID_CACHE_PATH': '',
+    'QUOTE_CORPUS_PATH': '',
+    'BROADCAST_DB_PATH': os.path.join(_workdir, 'broadcasts.sqlite3'),
+    'AVATAR_CACHE_DIR': os.path.join(_workdir, 'avatars'),
+    'SHARED_CACHE_URL': '',
+    'METRICS_PORT': '0',
+    'WORKERS': '0',
+})
+
+import dataclasses
+
+import pytest
+
+import config
+
+
+@pytest.fixture
+def use_settings(monkeypatch):
+    """Подмена настроек процесса на время теста: use_settings(поле=значение, ...)"""
+
+    def use(**changes):
+        settings = dataclasses.replace(config.get_settings(), **changes)
+        monkeypatch.setattr(config, '_settings', settings)
+        return settings
+
+    return use
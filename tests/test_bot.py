@@ -0,0 +1,183 @@
+import json
+import asyncio
+from contextlib import asynccontextmanager
+
+import aiohttp
+import pytest
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, TypeHandler
+
+import bot
+from benchmarks.fake_services import FakeBotApi, UpstreamProfile, serving
+from benchmarks.load_test import HOST, free_port, make_message
+
+
+def make_updates(count: int) -> list:
+    return [make_message(update_id, 1000 + update_id, 'wake_up', []) for update_id in range(1, count + 1)]
+
+
+@asynccontextmanager
+async def running(application):
+    """Запущенное приложение; остановка и при упавшей проверке, иначе цикл событий не завершится"""
+    async with application:
+        await application.start()
+        try:
+            yield application
+        finally:
+            if application.updater is not None and application.updater.running:
+                await application.updater.stop()
+            await application.stop()
+
+
+async def wait_for(condition, timeout: float = 5):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("условие не выполнилось")
+        await asyncio.sleep(0.01)
+
+
+def test_webhook_rejects_requests_without_secret_token(use_settings):
+    """Запросы без секретного токена или с чужим отклоняются, с верным - обрабатываются"""
+    bot_api = FakeBotApi([], UpstreamProfile(0))
+
+    async def main():
+        async with serving(bot_api.build_app(), HOST) as api_url:
+            settings = use_settings(
+                telegram_api_url=api_url, webhook_url='https://bot.example', webhook_listen=HOST,
+                webhook_port=free_port(), webhook_secret='',
+            )
+            options = bot.webhook_options(settings)
+            application = bot.build_application()
+            async with running(application):
+                await application.updater.start_webhook(**options)
+                url = f'http://{HOST}:{settings.webhook_port}/{settings.webhook_path}'
+                body = json.dumps(make_updates(1)[0])
+                headers = {'Content-Type': 'application/json'}
+                statuses = []
+                async with aiohttp.ClientSession() as session:
+                    for secret in (None, 'wrong-secret', options['secret_token']):
+                        extra = {} if secret is None else {'X-Telegram-Bot-Api-Secret-Token': secret}
+                        async with session.post(url, data=body, headers={**headers, **extra}) as response:
+                            statuses.append(response.status)
+                await wait_for(lambda: bot_api.calls.get('sendMessage', 0) >= 1)
+        return options, statuses
+
+    options, statuses = asyncio.run(main())
+    # Секрет не задан - сгенерирован случайный
+    assert len(options['secret_token']) >= 32
+    assert statuses == [403, 403, 200]
+    assert bot_api.calls['setWebhook'] == 1
+    assert bot_api.calls['sendMessage'] == 1
+
+
+@pytest.mark.parametrize('concurrency', [1, 2])
+def test_full_queue_pauses_polling_and_is_reported(use_settings, concurrency):
+    """Заполненная очередь приостанавливает прием обновлений, ее глубина видна в /metrics"""
+    updates = make_updates(20)
+    bot_api = FakeBotApi(updates, UpstreamProfile(0))
+
+    async def main():
+        async with serving(bot_api.build_app(), HOST) as api_url:
+            settings = use_settings(
+                telegram_api_url=api_url, update_queue_size=3, metrics_host=HOST, metrics_port=free_port(),
+                max_concurrent_updates=concurrency, max_pending_updates=concurrency,
+            )
+            application = bot.build_application()
+            release = asyncio.Event()
+            processed = []
+
+            async def hold(update, context):
+                await release.wait()
+                processed.append(update.update_id)
+                raise ApplicationHandlerStop
+
+            application.add_handler(TypeHandler(Update, hold), group=-1)
+            async with running(application):
+                await bot.start_metrics(application)
+                try:
+                    await application.updater.start_polling(poll_interval=0, timeout=1)
+                    await wait_for(lambda: bot.get_queue_depth(application) == 3)
+                    await asyncio.sleep(0.2)
+                    depth = bot.get_queue_depth(application)
+                    polls = bot_api.calls.get('getUpdates', 0)
+                    async with aiohttp.ClientSession() as session:
+                        url = f'http://{HOST}:{settings.metrics_port}/metrics'
+                        async with session.get(url) as response:
+                            metrics = await response.text()
+                finally:
+                    release.set()
+                    await application.bot_data['metrics_server'].stop()
+                await wait_for(lambda: len(processed) == len(updates))
+        return depth, polls, metrics, processed
+
+    depth, polls, metrics, processed = asyncio.run(main())
+    # Очередь заполнена, остальные обновления ждут у Telegram: новых getUpdates нет
+    assert depth == 3
+    assert polls == 1
+    assert 'bot_update_queue_depth 3\n' in metrics
+    if concurrency > 1:
+        assert f'bot_update_tasks_pending {concurrency}\n' in metrics
+    assert sorted(processed) == [update['update_id'] for update in updates]
+
+
+def test_run_bot_without_token_exits_with_error(use_settings):
+    use_settings(token='')
+    with pytest.raises(SystemExit) as exc_info:
+        bot.run_bot()
+    assert exc_info.value.code == 1
+
+
+def test_cache_metrics_export_weather_savings_and_latency(monkeypatch):
+    import utils
+    from weather_cache import WeatherCache
+
+    async def fetch_weather(lat, lon):
+        await asyncio.sleep(0.01)
+        return {'name': 'Москва'}
+
+    async def main():
+        cache = WeatherCache(fetch_weather)
+        # Два одновременных запроса объединяются, третий попадает в кэш
+        await asyncio.gather(cache.get(55.75, 37.61), cache.get(55.75, 37.62))
+        await cache.get(55.75, 37.61)
+        return cache
+
+    monkeypatch.setattr(utils, 'weather_cache', asyncio.run(main()))
+    samples = {(name, tuple(labels.items())): value for name, labels, value in bot.collect_cache_metrics()}
+    assert samples[('bot_weather_api_calls', ())] == 1
+    assert samples[('bot_weather_api_calls_saved', ())] == 2
+    assert samples[('bot_weather_coalesced', ())] == 1
+    assert samples[('bot_weather_latency_ms', (('stage', 'upstream'), ('quantile', '0.5')))] >= 10
+    assert ('bot_weather_latency_ms', (('stage', 'lookup'), ('quantile', '0.99'))) in samples
+
+
+def test_cache_metrics_export_quote_refill_latency(monkeypatch):
+    import utils
+    from quote_buffer import QuoteBuffer
+
+    counter = iter(range(100))
+
+    async def fetch_quote():
+        await asyncio.sleep(0.01)
+        return {'quote': f'Цитата {next(counter)}', 'author': 'Автор'}
+
+    buffer = QuoteBuffer(fetch_quote, depth=2)
+    asyncio.run(buffer.refill())
+    monkeypatch.setattr(utils, 'quote_buffer', buffer)
+    samples = {(name, tuple(labels.items())): value for name, labels, value in bot.collect_cache_metrics()}
+    assert samples[('bot_quote_buffer_depth', ())] == 2
+    assert samples[('bot_quote_refill_ms', (('stat', 'last'),))] >= 10
+    assert samples[('bot_quote_refill_ms', (('stat', 'avg'),))] >= 10
+
+
+def test_cache_metrics_do_not_create_lazy_components(monkeypatch):
+    """Сбор метрик до первого аватара или картинки не создает их пулы"""
+    import utils
+
+    monkeypatch.setattr(utils, '_avatars', None)
+    monkeypatch.setattr(utils, '_images', None)
+    samples = {(name, tuple(labels.items())): value for name, labels, value in bot.collect_cache_metrics()}
+    assert utils._avatars is None and utils._images is None
+    assert samples[('bot_cache_hits', (('cache', 'avatar'),))] == 0
+    assert samples[('bot_image_bytes_in_flight', ())] == 0
@@ -0,0 +1,145 @@
+import asyncio
+from types import SimpleNamespace
+
+from telegram.error import Forbidden
+
+from broadcasts import Broadcaster, SubscriptionStore
+
+
+class RecordingBot:
+    """Бот без сети: запоминает, кому ушли сообщения"""
+
+    rate_limiter = None
+
+    def __init__(self, blocked=()):
+        self.sent = []
+        self.blocked = set(blocked)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id in self.blocked:
+            raise Forbidden("Forbidden: bot was blocked by the user")
+        self.sent.append((chat_id, text))
+
+
+async def render_quote():
+    return 'Цитата дня'
+
+
+def make_broadcaster(tmp_path, batch_size=2):
+    broadcaster = Broadcaster(SubscriptionStore(str(tmp_path / 'broadcasts.sqlite3')), rate=0,
+                              batch_size=batch_size)
+    broadcaster.register('quote', render_quote)
+    return broadcaster
+
+
+def test_broadcast_includes_negative_chat_ids(tmp_path):
+    """Группы и каналы с отрицательными chat_id получают рассылку наравне с личными чатами"""
+    chat_ids = [-1001234567890, -100500, 123, 456, 2 ** 40]
+
+    async def main():
+        broadcaster = make_broadcaster(tmp_path)
+        try:
+            for chat_id in chat_ids:
+                await broadcaster.store.subscribe(chat_id, 'quote')
+            bot = RecordingBot()
+            counts = await broadcaster.run(bot, 'quote', 'quote:test')
+            return counts, bot.sent
+        finally:
+            await broadcaster.close()
+
+    counts, sent = asyncio.run(main())
+    assert counts['sent'] == len(chat_ids)
+    assert [chat_id for chat_id, _ in sent] == sorted(chat_ids)
+
+
+def test_resumed_broadcast_continues_after_cursor(tmp_path):
+    """Продолженная рассылка не отправляет повторно чатам до сохраненного курсора"""
+    chat_ids = [-300, -200, -100, 100, 200]
+
+    async def main():
+        broadcaster = make_broadcaster(tmp_path)
+        try:
+            for chat_id in chat_ids:
+                await broadcaster.store.subscribe(chat_id, 'quote')
+            # Прерванная рассылка: первая пачка из двух чатов уже отправлена
+            await broadcaster.store.start_run('quote:test', 'quote', {'': 'Цитата дня'})
+            counts = {'sent': 2, 'failed': 0, 'blocked': 0, 'skipped': 0}
+            await broadcaster.store.checkpoint('quote:test', -200, counts, [], 'quote')
+            bot = RecordingBot(blocked={100})
+            counts = await broadcaster.run(bot, 'quote', 'quote:test')
+            topics = await broadcaster.store.topics(100)
+            return counts, bot.sent, topics
+        finally:
+            await broadcaster.close()
+
+    counts, sent, topics = asyncio.run(main())
+    assert [chat_id for chat_id, _ in sent] == [-100, 200]
+    assert counts == {'sent': 4, 'failed': 0, 'blocked': 1, 'skipped': 0}
+    # Заблокировавший бота чат отписан
+    assert topics == []
+
+
+class RecordingMessage:
+    def __init__(self):
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+
+def make_command(chat_id, job_queue):
+    message = RecordingMessage()
+    update = SimpleNamespace(
+        message=message, effective_chat=SimpleNamespace(id=chat_id), effective_user=SimpleNamespace(id=chat_id)
+    )
+    context = SimpleNamespace(job_queue=job_queue, user_data={})
+    return update, context, message
+
+
+def test_subscribe_without_job_queue_reports_disabled():
+    """Без JobQueue рассылки не запланированы, и /subscribe не обещает их"""
+    from handlers import subscribe_command
+    from utils import get_subscriptions
+
+    update, context, message = make_command(-100777, job_queue=None)
+    asyncio.run(subscribe_command(update, context))
+    assert message.replies == ["Рассылки сейчас отключены"]
+    assert asyncio.run(get_subscriptions().topics(-100777)) == []
+
+
+def test_subscribe_with_job_queue():
+    from handlers import subscribe_command
+    from utils import get_subscriptions
+
+    update, context, message = make_command(-100778, job_queue=object())
+    asyncio.run(subscribe_command(update, context))
+    assert message.replies[0].startswith("Вы подписаны на цитату дня")
+    assert asyncio.run(get_subscriptions().topics(-100778)) == ['quote']
+
+
+def test_location_reply_is_not_delayed_by_subscription_update(monkeypatch):
+    """Точка прогноза в базе подписок обновляется фоновой задачей после ответа с погодой"""
+    import handlers
+    from utils import get_subscriptions, weather_cache
+
+    async def get_weather(lat, lon):
+        return 'Ясно'
+
+    monkeypatch.setattr(handlers, 'get_weather', get_weather)
+    scheduled = []
+    update, context, message = make_command(-100779, job_queue=object())
+    message.location = SimpleNamespace(latitude=59.93, longitude=30.31)
+    context.application = SimpleNamespace(create_task=scheduled.append)
+
+    async def main():
+        subscriptions = get_subscriptions()
+        await subscriptions.subscribe(-100779, 'weather', weather_cache.bucket(55.75, 37.61))
+        await handlers.handle_location(update, context)
+        replies = list(message.replies)
+        await asyncio.gather(*scheduled)
+        return replies, await subscriptions.areas('weather')
+
+    replies, areas = asyncio.run(main())
+    assert replies == ['Ясно']
+    assert len(scheduled) == 1
+    assert weather_cache.bucket(59.93, 30.31) in [tuple(area) for area in areas]
@@ -0,0 +1,34 @@
+import utils
+
+
+def test_breed_index_rebuilt_with_breed_keyboard(monkeypatch):
+    """После изменения списка пород refresh_menus перестраивает кнопки и индекс вместе"""
+    assert 'Абиссинская' not in utils.BREED_BY_NAME
+
+    monkeypatch.setitem(utils.CAT_BREEDS, 'abys', 'Абиссинская')
+    utils.refresh_menus()
+    try:
+        buttons = [button.text for row in utils.get_breed_keyboard().keyboard for button in row]
+        assert 'Абиссинская' in buttons
+        assert utils.BREED_BY_NAME['Абиссинская'] == 'abys'
+    finally:
+        monkeypatch.undo()
+        utils.refresh_menus()
+    assert 'Абиссинская' not in utils.BREED_BY_NAME
+
+
+def test_main_keyboard_is_built_once_and_follows_labels(monkeypatch):
+    import routes
+
+    markup = utils.get_main_keyboard()
+    assert utils.get_main_keyboard() is markup
+
+    monkeypatch.setattr(routes, 'MAIN_MENU_ROWS', routes.MAIN_MENU_ROWS + (('Помощь',),))
+    # Без явного сброса клавиатура не перестраивается на каждый ответ
+    assert utils.get_main_keyboard() is markup
+    utils.refresh_menus()
+    try:
+        assert utils.get_main_keyboard().keyboard[-1][0].text == 'Помощь'
+    finally:
+        monkeypatch.undo()
+        utils.refresh_menus()
@@ -0,0 +1,130 @@
+import asyncio
+from types import SimpleNamespace
+
+from cat_pool import CatPhotoPool
+from quote_buffer import QuoteBuffer
+from shared_cache import MemorySharedCache
+
+
+async def fetch_photo(breed_id):
+    return {'image': b'jpeg', 'breed': breed_id, 'url': f'https://cats.example/{breed_id}.jpg'}
+
+
+def test_shared_pool_sizes_come_from_shared_queue():
+    """В режиме общего кэша размеры пулов в stats() - длины общих очередей, а не пустых локальных"""
+
+    async def main():
+        shared = MemorySharedCache()
+        # Два процесса-обработчика с общим кэшем: пополняет первый, метрики отдают оба
+        filler = CatPhotoPool(fetch_photo, ['beng', 'siam'], depth=3, shared=shared)
+        reader = CatPhotoPool(fetch_photo, ['beng', 'siam'], depth=3, shared=shared)
+        await filler.refill_all()
+        await reader.take('beng')
+        await reader.refresh_sizes()
+        return filler.stats()['sizes'], reader.stats()['sizes']
+
+    filler_sizes, reader_sizes = asyncio.run(main())
+    assert filler_sizes == {'beng': 3, 'siam': 3}
+    assert reader_sizes == {'beng': 2, 'siam': 3}
+
+
+def test_shared_quote_depth_comes_from_shared_queue():
+    counter = iter(range(100))
+
+    async def fetch_quote():
+        return {'quote': f'Цитата {next(counter)}', 'author': 'Автор'}
+
+    async def main():
+        shared = MemorySharedCache()
+        filler = QuoteBuffer(fetch_quote, depth=5, shared=shared)
+        reader = QuoteBuffer(fetch_quote, depth=5, shared=shared)
+        await filler.refill()
+        await reader.take()
+        await reader.size()
+        return filler.stats()['depth'], reader.stats()['depth']
+
+    assert asyncio.run(main()) == (5, 4)
+
+
+def test_quote_miss_served_from_corpus_while_refilling():
+    """При промахе пользователь получает цитату из корпуса, а сеть опрашивается в фоне"""
+    released = asyncio.Event()
+    calls = []
+
+    async def slow_fetch():
+        calls.append(1)
+        await released.wait()
+        return {'quote': f'Свежая {len(calls)}', 'author': 'Автор'}
+
+    async def main():
+        buffer = QuoteBuffer(slow_fetch, depth=2)
+        buffer._remember({'quote': 'Из корпуса', 'author': 'Автор'})
+        first = await asyncio.wait_for(buffer.get(), 1)
+        second = await asyncio.wait_for(buffer.get(), 1)
+        await asyncio.sleep(0)
+        # Второй промах не запускает еще одно пополнение
+        started = len(calls)
+        released.set()
+        await buffer._refill_task
+        return first, second, started, await buffer.size()
+
+    first, second, started, depth = asyncio.run(main())
+    assert first == second == {'quote': 'Из корпуса', 'author': 'Автор'}
+    assert started == 1
+    assert depth == 2
+
+
+def test_shared_quotes_are_remembered_in_corpus():
+    counter = iter(range(100))
+
+    async def fetch_quote():
+        return {'quote': f'Цитата {next(counter)}', 'author': 'Автор'}
+
+    async def main():
+        shared = MemorySharedCache()
+        filler = QuoteBuffer(fetch_quote, depth=3, shared=shared)
+        reader = QuoteBuffer(fetch_quote, depth=3, shared=shared)
+        await filler.refill()
+        quote = await reader.get()
+        return quote, reader.stats()['corpus']
+
+    quote, corpus = asyncio.run(main())
+    assert quote == {'quote': 'Цитата 0', 'author': 'Автор'}
+    assert corpus == 1
+
+
+def test_cat_photo_refills_pool_only_after_hit(monkeypatch):
+    """При промахе фото загружается в обработчике, и пополнение пула не дублирует загрузку"""
+    import handlers
+
+    scheduled = []
+    sent = []
+
+    async def fetch_inline(breed_id):
+        return await fetch_photo(breed_id)
+
+    async def reply_photo_cached(update, cache_key, photo, caption):
+        sent.append(cache_key)
+
+    def create_task(coroutine):
+        scheduled.append(coroutine.__qualname__)
+        coroutine.close()
+
+    async def main():
+        pool = CatPhotoPool(fetch_photo, ['beng'], depth=1)
+        monkeypatch.setattr(handlers, 'cat_pool', pool)
+        monkeypatch.setattr(handlers, 'get_cat_photo_by_breed', fetch_inline)
+        monkeypatch.setattr(handlers, 'reply_photo_cached', reply_photo_cached)
+        update = SimpleNamespace(effective_user=SimpleNamespace(id=1, first_name='Кот'))
+        context = SimpleNamespace(application=SimpleNamespace(create_task=create_task))
+
+        await handlers.send_cat_photo(update, context, 'beng')
+        miss_scheduled = list(scheduled)
+        await pool.refill('beng')
+        await handlers.send_cat_photo(update, context, 'beng')
+        return miss_scheduled
+
+    miss_scheduled = asyncio.run(main())
+    assert miss_scheduled == []
+    assert scheduled == ['CatPhotoPool.refill']
+    assert len(sent) == 2
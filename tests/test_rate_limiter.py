@@ -0,0 +1,120 @@
+import time
+import asyncio
+
+import pytest
+from telegram.error import RetryAfter
+from telegram.ext import ExtBot
+
+from benchmarks.fake_services import FakeBotApi, UpstreamProfile, serving
+from benchmarks.load_test import HOST
+from rate_limiter import SendScheduler
+
+
+async def with_bot(bot_api: FakeBotApi, rate_limiter, scenario):
+    """Запуск scenario(bot) с ботом, отправляющим сообщения в имитацию Bot API"""
+    async with serving(bot_api.build_app(), HOST) as api_url:
+        bot = ExtBot('123456:TEST', base_url=f'{api_url}/bot', rate_limiter=rate_limiter)
+        async with bot:
+            return await scenario(bot)
+
+
+async def timed(coroutine, started: float) -> float:
+    await coroutine
+    return time.monotonic() - started
+
+
+def test_flood_without_scheduler_gets_429():
+    """Имитация отвечает 429, если отправлять быстрее лимита Telegram"""
+    bot_api = FakeBotApi([], UpstreamProfile(0), overall_limit=10)
+
+    async def scenario(bot):
+        return await asyncio.gather(
+            *(bot.send_message(chat_id=chat_id, text='привет') for chat_id in range(1, 21)),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(with_bot(bot_api, None, scenario))
+    rejected = [result for result in results if isinstance(result, RetryAfter)]
+    assert len(rejected) == bot_api.flood_rejected == 10
+
+
+def test_overall_limit():
+    """Сообщения разным чатам идут не быстрее общего лимита, и Telegram их не отклоняет"""
+    # Ведро начинается полным, поэтому за первую секунду уходит до двух лимитов
+    bot_api = FakeBotApi([], UpstreamProfile(0), overall_limit=40)
+    scheduler = SendScheduler(overall_rate=20, chat_rate=100, chat_burst=100)
+
+    async def scenario(bot):
+        started = time.monotonic()
+        await asyncio.gather(*(bot.send_message(chat_id=chat_id, text='привет') for chat_id in range(1, 41)))
+        return time.monotonic() - started
+
+    elapsed = asyncio.run(with_bot(bot_api, scheduler, scenario))
+    # 20 сообщений сразу, остальные 20 - по 20 в секунду
+    assert elapsed >= 0.9
+    assert bot_api.flood_rejected == 0
+    assert bot_api.calls['sendMessage'] == 40
+
+
+def test_chat_limit_does_not_delay_other_chats():
+    bot_api = FakeBotApi([], UpstreamProfile(0), chat_limit=6)
+    scheduler = SendScheduler(overall_rate=100, chat_rate=5, chat_burst=1)
+
+    async def scenario(bot):
+        started = time.monotonic()
+        busy = [timed(bot.send_message(chat_id=1, text=f'сообщение {i}'), started) for i in range(6)]
+        other = timed(bot.send_message(chat_id=2, text='привет'), started)
+        return await asyncio.gather(asyncio.gather(*busy), other)
+
+    busy, other = asyncio.run(with_bot(bot_api, scheduler, scenario))
+    # Шесть сообщений одному чату при 5 в секунду и запасе в одно - не меньше секунды
+    assert max(busy) >= 0.9
+    assert other < 0.3
+    assert bot_api.flood_rejected == 0
+
+
+def test_retry_after_pauses_all_requests():
+    """После 429 запрос повторяется через retry_after, а остальные ждут вместе с ним"""
+    bot_api = FakeBotApi([], UpstreamProfile(0), retry_after=1)
+    bot_api.reject_next = 1
+    scheduler = SendScheduler(overall_rate=100, chat_rate=100, chat_burst=100)
+
+    async def scenario(bot):
+        started = time.monotonic()
+        first = asyncio.ensure_future(timed(bot.send_message(chat_id=1, text='первое'), started))
+        await asyncio.sleep(0.2)
+        second = await timed(bot.send_message(chat_id=2, text='второе'), started)
+        return await first, second
+
+    first, second = asyncio.run(with_bot(bot_api, scheduler, scenario))
+    assert first >= 1.0
+    assert second >= 1.0
+    assert scheduler.retries == 1
+    assert bot_api.flood_rejected == 1
+    assert bot_api.calls['sendMessage'] == 3
+
+
+@pytest.mark.parametrize('photos_first', [True, False])
+def test_text_goes_ahead_of_photos(photos_first):
+    """Когда общий лимит исчерпан, ждущие текстовые ответы уходят раньше фото"""
+    bot_api = FakeBotApi([], UpstreamProfile(0))
+    scheduler = SendScheduler(overall_rate=10, chat_rate=100, chat_burst=100)
+    order = []
+
+    async def send(kind, coroutine):
+        await coroutine
+        order.append(kind)
+
+    async def scenario(bot):
+        # Исчерпываем общий лимит
+        await asyncio.gather(*(bot.send_message(chat_id=100 + i, text='разогрев') for i in range(10)))
+        photos = [send('photo', bot.send_photo(chat_id=i, photo=b'\x89PNG')) for i in range(1, 4)]
+        texts = [send('text', bot.send_message(chat_id=i, text='ответ')) for i in range(4, 7)]
+        first, second = (photos, texts) if photos_first else (texts, photos)
+        tasks = [asyncio.ensure_future(coroutine) for coroutine in first]
+        await asyncio.sleep(0.01)
+        tasks += [asyncio.ensure_future(coroutine) for coroutine in second]
+        await asyncio.gather(*tasks)
+
+    asyncio.run(with_bot(bot_api, scheduler, scenario))
+    assert order == ['text'] * 3 + ['photo'] * 3
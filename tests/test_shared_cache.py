@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from shared_cache import MemorySharedCache, SQLiteSharedCache
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def make_cache(request, tmp_path):
+    def make(**kwargs):
+        if request.param == 'memory':
+            return MemorySharedCache(**kwargs)
+        return SQLiteSharedCache(str(tmp_path / 'shared.sqlite3'), **kwargs)
+    return make
+
+
+def test_prune_removes_expired_values(make_cache):
+    async def main():
+        cache = make_cache(prune_interval=3600)
+        try:
+            await cache.set('weather:1', {'temp': 1}, ttl=0.05)
+            await cache.set('file_id:a', 'AgAD')
+            await asyncio.sleep(0.1)
+            removed = await cache.prune()
+            return removed, await cache.get('weather:1'), await cache.get('file_id:a')
+        finally:
+            await cache.close()
+
+    removed, weather, file_id = asyncio.run(main())
+    assert removed == 1
+    assert weather is None
+    assert file_id == 'AgAD'
+
+
+def test_size_cap_evicts_least_recently_written(make_cache):
+    """file_id записываются без срока жизни, их число ограничено max_entries"""
+
+    async def main():
+        # prune_interval=0: очистка при каждой записи
+        cache = make_cache(max_entries=3, prune_interval=0)
+        try:
+            for key in 'abcd':
+                await cache.set(f'file_id:{key}', key)
+            # Перезапись освежает значение: следующим вытесняется c, а не b
+            await cache.set('file_id:b', 'b2')
+            await cache.set('file_id:e', 'e')
+            return [await cache.get(f'file_id:{key}') for key in 'abcde']
+        finally:
+            await cache.close()
+
+    assert asyncio.run(main()) == [None, 'b2', None, 'd', 'e']
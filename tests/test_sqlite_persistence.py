@@ -0,0 +1,44 @@
+import time
+import asyncio
+
+from sqlite_persistence import SQLitePersistence
+
+
+def test_concurrent_updates_wait_for_one_user_data_load(tmp_path):
+    """Второе обновление пользователя, пришедшее во время загрузки, видит загруженные данные"""
+    path = str(tmp_path / 'bot_data.sqlite3')
+
+    async def save():
+        persistence = SQLitePersistence(path)
+        await persistence.get_user_data()
+        await persistence.update_user_data(42, {'location': (55.75, 37.61)})
+        await persistence.flush()
+
+    async def load_twice():
+        persistence = SQLitePersistence(path)
+        await persistence.get_user_data()
+        load_user = persistence._load_user
+        loads = []
+
+        def slow_load_user(user_id):
+            loads.append(user_id)
+            time.sleep(0.05)
+            return load_user(user_id)
+
+        persistence._load_user = slow_load_user
+        # Application передает один и тот же словарь user_data
+        user_data = {}
+        seen = []
+
+        async def handle():
+            await persistence.refresh_user_data(42, user_data)
+            seen.append(dict(user_data))
+
+        await asyncio.gather(handle(), handle())
+        await persistence.flush()
+        return loads, seen
+
+    asyncio.run(save())
+    loads, seen = asyncio.run(load_twice())
+    assert loads == [42]
+    assert seen == [{'location': (55.75, 37.61)}] * 2
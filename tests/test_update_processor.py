@@ -0,0 +1,79 @@
+import asyncio
+
+from telegram.ext import ApplicationBuilder, TypeHandler
+
+from benchmarks.fake_services import FakeBotApi, UpstreamProfile, serving
+from update_processor import KeyedUpdateProcessor
+
+
+class FakeUpdate:
+    """Обновление с чатом, как его видит KeyedUpdateProcessor"""
+
+    def __init__(self, chat_id):
+        self.effective_chat = type('Chat', (), {'id': chat_id})()
+
+
+def test_admission_keeps_excess_updates_in_queue():
+    """Сверх max_pending_updates обновления остаются в очереди, а не копятся задачами"""
+
+    async def main():
+        async with serving(FakeBotApi([], UpstreamProfile(0)).build_app(), '127.0.0.1') as api_url:
+            return await run(api_url)
+
+    async def run(api_url):
+        processor = KeyedUpdateProcessor(2, max_pending_updates=4)
+        application = (
+            ApplicationBuilder().token('123456:TEST').base_url(f'{api_url}/bot').updater(None)
+            .concurrent_updates(processor).update_queue(processor.create_queue(10))
+            .build()
+        )
+        release = asyncio.Event()
+        done = []
+
+        async def slow(update, context):
+            await release.wait()
+            done.append(update.effective_chat.id)
+
+        application.add_handler(TypeHandler(FakeUpdate, slow))
+        async with application:
+            await application.start()
+            for chat_id in range(14):
+                await application.update_queue.put(FakeUpdate(chat_id))
+            await asyncio.sleep(0.1)
+            # Обновления разных чатов: 2 выполняются, всего принято 4, остальные ждут в очереди
+            in_flight, pending, depth = processor.in_flight, processor.pending, application.update_queue.qsize()
+            # Очередь заполнена: следующее обновление ждет места
+            with_room = asyncio.ensure_future(application.update_queue.put(FakeUpdate(14)))
+            await asyncio.sleep(0.05)
+            blocked = not with_room.done()
+            release.set()
+            await with_room
+            await application.update_queue.join()
+            await application.stop()
+        return in_flight, pending, depth, blocked, sorted(done), processor.pending
+
+    in_flight, pending, depth, blocked, done, pending_after = asyncio.run(main())
+    assert (in_flight, pending, depth) == (2, 4, 10)
+    assert blocked
+    assert done == list(range(15))
+    assert pending_after == 0
+
+
+def test_updates_of_one_chat_keep_order():
+    async def main():
+        processor = KeyedUpdateProcessor(4)
+        order = []
+
+        async def handle(chat_id, index):
+            await asyncio.sleep(0.01 * (5 - index))
+            order.append((chat_id, index))
+
+        await asyncio.gather(*(
+            processor.process_update(FakeUpdate(chat_id), handle(chat_id, index))
+            for index in range(5) for chat_id in (1, 2)
+        ))
+        return order
+
+    order = asyncio.run(main())
+    for chat_id in (1, 2):
+        assert [index for key, index in order if key == chat_id] == list(range(5))
@@ -0,0 +1,36 @@
+import queue
+import asyncio
+from types import SimpleNamespace
+
+import workers
+from benchmarks.fake_services import FakeBotApi, UpstreamProfile, serving
+from benchmarks.load_test import HOST
+
+
+def make_update(update_id, chat_id, user_id):
+    return SimpleNamespace(
+        update_id=update_id, effective_chat=SimpleNamespace(id=chat_id), effective_user=SimpleNamespace(id=user_id)
+    )
+
+
+def test_updates_of_one_user_go_to_one_worker():
+    """user_data хранится по пользователю: его сообщения из разных групп обрабатывает один процесс"""
+    indexes = {workers.get_worker_index(make_update(n, chat_id, 7), 4) for n, chat_id in enumerate((-100, -201, 7))}
+    assert indexes == {7 % 4}
+    # Разные пользователи одной группы могут попасть в разные процессы
+    assert workers.get_worker_index(make_update(1, -100, 8), 4) == 8 % 4
+
+
+def test_worker_stops_when_ingestion_process_died(use_settings, monkeypatch):
+    """Без None в очереди процесс-обработчик не зависает, если принимающего процесса больше нет"""
+    bot_api = FakeBotApi([], UpstreamProfile(0))
+    monkeypatch.setattr(workers, 'PARENT_CHECK_INTERVAL', 0.05)
+    monkeypatch.setattr(workers.multiprocessing, 'parent_process', lambda: SimpleNamespace(is_alive=lambda: False))
+
+    async def main():
+        async with serving(bot_api.build_app(), HOST) as api_url:
+            use_settings(telegram_api_url=api_url)
+            # Номер 1: фоновое пополнение пулов запускает только первый процесс
+            await asyncio.wait_for(workers._worker_loop(1, queue.Queue()), timeout=10)
+
+    asyncio.run(main())
@@ -0,0 +1,126 @@
+"""Параллельная обработка обновлений с сохранением порядка внутри чата"""
+
+import asyncio
+import logging
+from telegram.ext import BaseUpdateProcessor
+
+# Создаем логгер для этого модуля
+logger = logging.getLogger(__name__)
+
+
+def get_update_key(update: object):
+    """Ключ упорядочивания: id чата, а если его нет - id пользователя"""
+    chat = getattr(update, 'effective_chat', None)
+    if chat is not None:
+        return chat.id
+    user = getattr(update, 'effective_user', None)
+    if user is not None:
+        return user.id
+    return None
+
+
+class AdmissionQueue(asyncio.Queue):
+    """Очередь входящих обновлений, которая отдает обновление, только когда
+    у KeyedUpdateProcessor есть свободное место.
+
+    Application создает задачу на каждое полученное из очереди обновление,
+    поэтому без этой проверки очередь сразу опустошается, а задачи копятся
+    без ограничений. Здесь обновление остается в очереди, пока принятых и
+    не завершенных меньше max_pending_updates, и при ее заполнении прием
+    новых обновлений приостанавливается.
+    """
+
+    def __init__(self, processor: 'KeyedUpdateProcessor', maxsize: int = 0):
+        super().__init__(maxsize)
+        self._processor = processor
+
+    async def get(self):
+        await self._processor.admit()
+        try:
+            update = await super().get()
+        except BaseException:
+            self._processor.release()
+            raise
+        if type(update) is object:
+            # Сигнал остановки Application - голый object(), он не обрабатывается
+            self._processor.release()
+        return update
+
+
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    """Обрабатывает до max_concurrent_updates обновлений одновременно.
+
+    Обновления одного чата выполняются строго по очереди. Ожидающие своей
+    очереди обновления не занимают слоты обработки, поэтому поток сообщений
+    от одного пользователя не блокирует остальных. Общее число принятых,
+    но еще не завершенных обновлений ограничено max_pending_updates, если
+    очередь приложения создана через create_queue().
+    """
+
+    def __init__(self, max_concurrent_updates: int, max_pending_updates: int = None):
+        if max_concurrent_updates < 1:
+            raise ValueError("max_concurrent_updates должен быть положительным числом")
+        max_pending_updates = max_pending_updates or max_concurrent_updates * 8
+        super().__init__(max_pending_updates)
+        self.concurrency = max_concurrent_updates
+        self.max_pending = max_pending_updates
+        self._running = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._admission = asyncio.Semaphore(max_pending_updates)
+        # ключ -> [блокировка, число обновлений, ожидающих или удерживающих ее]
+        self._locks = {}
+        self.in_flight = 0
+        # Принятые из очереди и еще не завершенные обновления
+        self.pending = 0
+
+    def create_queue(self, maxsize: int = 0) -> AdmissionQueue:
+        """Очередь обновлений для Application, ограничивающая прием этим обработчиком"""
+        return AdmissionQueue(self, maxsize)
+
+    async def admit(self):
+        """Ожидание места для следующего обновления из очереди"""
+        await self._admission.acquire()
+        self.pending += 1
+
+    def release(self):
+        # Без AdmissionQueue обновления не проходят admit, и освобождать нечего
+        if self.pending > 0:
+            self.pending -= 1
+            self._admission.release()
+
+    async def process_update(self, update: object, coroutine):
+        try:
+            await super().process_update(update, coroutine)
+        finally:
+            self.release()
+
+    async def do_process_update(self, update: object, coroutine):
+        key = get_update_key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._run(coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    async def _run(self, coroutine):
+        async with self._running:
+            self.in_flight += 1
+            try:
+                await coroutine
+            finally:
+                self.in_flight -= 1
+
+    async def initialize(self):
+        logger.info(f"Параллельная обработка обновлений: до {self.concurrency} одновременно")
+
+    async def shutdown(self):
+        pass
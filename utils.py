@@ -1,24 +1,24 @@
-import os
 import asyncio
 import random
-import hashlib
 import aiohttp
 import logging
-from dotenv import load_dotenv
 
-logger = logging.getLogger(__name__)
-
-load_dotenv()
+from config import get_settings
+from http_client import HttpClient
+from cat_pool import CatPhotoPool
+from file_id_cache import FileIdCache
+from weather_cache import WeatherCache
+from quote_buffer import QuoteBuffer
+from telegram import KeyboardButton
+from keyboards import KeyboardRegistry, PrebuiltReplyKeyboardMarkup
+from metrics import UPSTREAM_ERRORS
+import routes
+from routes import BUTTON_SEND_LOCATION, build_breed_menu_rows, build_breed_index
 
-TOKEN = os.getenv('TOKEN')
-TOKEN_WEATHER = os.getenv('TOKEN_WEATHER')
-
-PROXY_URL = "http://proxy.server:3128"
-USE_PROXY = True
+logger = logging.getLogger(__name__)
 
-if not TOKEN:
-    logger.error("Не найден TOKEN в файле .env")
-    exit(1)
+# Настройки читаются один раз за процесс (см. config.py)
+settings = get_settings()
 
 CAT_BREEDS = {
     'beng': 'Бенгальская',
@@ -32,29 +32,126 @@ CAT_BREEDS = {
     'random': 'Случайная порода'
 }
 
-async def get_quote_of_the_day():
-    url = 'https://api.forismatic.com/api/1.0/'
+# Общий кэш нужен только нескольким процессам-обработчикам
+if settings.shared_cache_url:
+    from shared_cache import create_shared_cache
+    shared_cache = create_shared_cache(
+        settings.shared_cache_url,
+        max_entries=settings.shared_cache_max_entries,
+        prune_interval=settings.shared_cache_prune_interval,
+    )
+else:
+    shared_cache = None
+
+http = HttpClient(
+    limit=settings.http_pool_limit,
+    limit_per_host=settings.http_pool_limit_per_host,
+    keepalive_timeout=settings.http_keepalive_timeout,
+    dns_cache_ttl=settings.http_dns_cache_ttl,
+    timeout=settings.api_timeout,
+    proxy=settings.proxy_url or None,
+)
+
+# Компоненты ниже создаются (и их модули импортируются) при первом обращении,
+# чтобы не замедлять запуск процесса до первого обновления
+_upstreams = None
+_images = None
+_avatars = None
+_broadcaster = None
+
+def get_upstreams() -> dict:
+    """Предохранители и адаптивные таймауты внешних API по имени"""
+    global _upstreams
+    if _upstreams is None:
+        from resilience import Upstream
+
+        def make_upstream(name: str, max_timeout: float) -> Upstream:
+            return Upstream(
+                name,
+                max_timeout=max_timeout,
+                min_timeout=settings.upstream_min_timeout,
+                multiplier=settings.upstream_timeout_multiplier,
+                failure_threshold=settings.circuit_failure_threshold,
+                reset_timeout=settings.circuit_reset_timeout,
+            )
+
+        _upstreams = {
+            'forismatic': make_upstream('forismatic', settings.api_timeout),
+            'thecatapi': make_upstream('thecatapi', settings.api_timeout),
+            'thecatapi_image': make_upstream('thecatapi_image', settings.image_timeout),
+            'openweathermap': make_upstream('openweathermap', settings.weather_timeout),
+            'robohash': make_upstream('robohash', settings.avatar_remote_timeout),
+        }
+    return _upstreams
+
+def get_images():
+    """Ограничение загрузок картинок и их уменьшение в пуле процессов"""
+    global _images
+    if _images is None:
+        from image_pipeline import ImagePipeline
+        _images = ImagePipeline(
+            max_bytes=settings.image_max_bytes,
+            concurrency=settings.image_download_concurrency,
+            recompress_bytes=settings.image_recompress_bytes,
+            max_side=settings.image_max_side,
+            workers=settings.image_workers,
+        )
+    return _images
+
+file_id_cache = FileIdCache(
+    max_size=settings.file_id_cache_size,
+    path=settings.file_id_cache_path or None,
+    shared=shared_cache,
+)
+
+async def fetch_quote():
+    """Запрос случайной цитаты у Forismatic; None при любой ошибке"""
+    from resilience import CircuitOpenError
+
+    url = settings.quote_api_url
     params = {'method': 'getQuote', 'format': 'json', 'lang': 'ru'}
 
     try:
-        async with aiohttp.ClientSession() as session:
-            proxy = PROXY_URL if USE_PROXY else None
-            async with session.get(url, params=params, proxy=proxy, timeout=aiohttp.ClientTimeout(total=5)) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    quote = data.get('quoteText', 'Цитата не найдена.').strip()
-                    author = data.get('quoteAuthor', 'Неизвестный автор').strip()
-                    logger.info("Цитата успешно получена")
-                    return {"quote": quote, "author": author}
+        async with get_upstreams()['forismatic'].request() as call, \
+                http.get(url, params=params, timeout=call.timeout) as response:
+            if response.status != 200:
+                UPSTREAM_ERRORS.inc('forismatic', 'status')
+                if response.status >= 500:
+                    call.fail()
+                logger.warning(f"Ошибка API цитат, статус: {response.status}")
+                return None
+            # Forismatic иногда отдает JSON с неверным Content-Type
+            data = await response.json(content_type=None)
+            quote = data.get('quoteText', 'Цитата не найдена.').strip()
+            author = data.get('quoteAuthor', 'Неизвестный автор').strip()
+            logger.info("Цитата успешно получена")
+            return {"quote": quote, "author": author}
+    except CircuitOpenError:
+        logger.debug("API цитат временно недоступно, цитата будет взята из корпуса")
     except aiohttp.ClientError as e:
         logger.warning(f"Ошибка сети при получении цитаты: {e}")
-        return {"quote": "Не удалось загрузить цитату (проблемы с сетью).", "author": "API"}
     except asyncio.TimeoutError:
         logger.warning("Таймаут при получении цитаты")
-        return {"quote": "Не удалось загрузить цитату (таймаут).", "author": "API"}
     except Exception as e:
         logger.error(f"Неизвестная ошибка при получении цитаты: {e}")
-        return {"quote": "Не удалось загрузить цитату.", "author": "API"}
+    return None
+
+quote_buffer = QuoteBuffer(
+    fetch_quote,
+    depth=settings.quote_buffer_depth,
+    corpus_size=settings.quote_corpus_size,
+    path=settings.quote_corpus_path or None,
+    shared=shared_cache,
+)
+
+async def get_quote_of_the_day():
+    quote = await quote_buffer.get()
+    if quote:
+        return quote
+    return {"quote": "Не удалось загрузить цитату.", "author": "API"}
+
+def format_quote(quote: dict) -> str:
+    return f"Цитата дня:\n\n«{quote['quote']}»\n— {quote['author']}"
 
 def get_user_info(update):
     try:
@@ -73,108 +170,230 @@ def get_user_info(update):
         logger.error(f"Ошибка при получении информации о пользователе: {e}")
         return None, "Пользователь", "Пользователь", 0
 
-def generate_cat_avatar(user_id: int, username: str = "") -> str:
-    try:
-        user_data = f"{username}{user_id}{random.randint(1000, 9999)}"
-        hash_object = hashlib.md5(user_data.encode())
-        hash_str = hash_object.hexdigest()[:10]
-
-        bg_options = ['bg1', 'bg2', 'transparent']
-        selected_bg = random.choice(bg_options)
+def get_robohash_url(key: str) -> str:
+    """Адрес аватара-котика Robohash; фон выбирается по ключу, чтобы адрес был постоянным"""
+    bg_options = ['bg1', 'bg2', 'transparent']
+    selected_bg = bg_options[int(key, 16) % len(bg_options)]
+    return f'{settings.robohash_url}/{key}.png?set=set4&bgset={selected_bg}&size=400x400'
 
-        avatar_url = f'https://robohash.org/{hash_str}.png?set=set4&bgset={selected_bg}&size=400x400'
+async def fetch_robohash_avatar(key: str):
+    """PNG аватара с Robohash; None при неуспешном статусе"""
+    images = get_images()
+    async with images.slot(), get_upstreams()['robohash'].request() as call, \
+            http.get(get_robohash_url(key), timeout=call.timeout) as response:
+        if response.status != 200:
+            UPSTREAM_ERRORS.inc('robohash', 'status')
+            if response.status >= 500:
+                call.fail()
+            return None
+        return await images.read(response)
 
-        logger.debug(f"Сгенерирован аватар-котик для пользователя {user_id}")
-        return avatar_url
-    except Exception as e:
-        logger.error(f"Ошибка при генерации аватара-котика: {e}")
-        return "https://robohash.org/error.png?set=set4&bgset=bg1&size=400x400"
+def get_avatars():
+    """Аватары-котики: кэш PNG, Robohash и локальная отрисовка"""
+    global _avatars
+    if _avatars is None:
+        from avatars import AvatarCache, AvatarEngine
+        _avatars = AvatarEngine(
+            AvatarCache(
+                memory_size=settings.avatar_memory_cache_size,
+                path=settings.avatar_cache_dir or None,
+                disk_size=settings.avatar_disk_cache_size,
+            ),
+            fetch_remote=fetch_robohash_avatar if settings.avatar_source == 'robohash' else None,
+            remote_timeout=settings.avatar_remote_timeout,
+            workers=settings.avatar_workers,
+        )
+    return _avatars
 
 def get_breed_name(breed_id):
     return CAT_BREEDS.get(breed_id, 'Неизвестная порода')
 
-async def get_cat_photo_by_breed(breed_id: str):
+def pick_random_breed():
+    breeds = [b for b in CAT_BREEDS.keys() if b != 'random']
+    return random.choice(breeds)
+
+async def fetch_cat_photo(breed_id: str = None):
+    """Один поиск в TheCatAPI и загрузка найденного изображения.
+
+    Возвращает словарь с байтами изображения, породой и исходным URL
+    или None. Если для URL уже известен file_id, изображение не
+    загружается и 'image' равно None. Сетевые ошибки пробрасываются
+    вызывающему коду.
+    """
+    url = f"{settings.cat_api_url}/images/search"
+    params = {'breed_ids': breed_id} if breed_id else None
+
+    async with get_upstreams()['thecatapi'].request() as call, \
+            http.get(url, params=params, timeout=call.timeout) as response:
+        if response.status != 200:
+            UPSTREAM_ERRORS.inc('thecatapi', 'status')
+            if response.status >= 500:
+                call.fail()
+            return None
+        data = await response.json()
+    if not data:
+        return None
+
+    cat_image_url = data[0]['url']
+    if cat_image_url in file_id_cache:
+        image_data = None
+    else:
+        image_data = await download_image(cat_image_url)
+        if image_data is None:
+            return None
+
+    return {'image': image_data, 'breed': breed_id or 'random', 'url': cat_image_url}
+
+async def _download_image_once(url: str):
+    images = get_images()
+    # Семафор снаружи: таймаут запроса отсчитывается после получения слота
+    async with images.slot(), get_upstreams()['thecatapi_image'].request() as call, \
+            http.get(url, timeout=call.timeout) as img_response:
+        if img_response.status != 200:
+            UPSTREAM_ERRORS.inc('thecatapi_image', 'status')
+            if img_response.status >= 500:
+                call.fail()
+            return None
+        return await images.read(img_response)
+
+async def download_image(url: str):
+    """Загрузка изображения; None при неуспешном статусе или слишком большой картинке.
+
+    Тело читается частями с лимитом IMAGE_MAX_BYTES, большие картинки
+    уменьшаются (если установлен Pillow). Если загрузка не уложилась в
+    обычную задержку, параллельно запускается повторная, и используется
+    первый полученный ответ.
+    """
+    from resilience import hedged
+    from image_pipeline import ImageTooLarge
+
+    upstream = get_upstreams()['thecatapi_image']
+    delay = settings.image_hedge_delay or upstream.latency(95)
     try:
-        if breed_id == 'random':
-            breeds = [b for b in CAT_BREEDS.keys() if b != 'random']
-            selected_breed = random.choice(breeds)
+        if not delay:
+            # Задержка еще не измерена - без дублирования
+            data = await _download_image_once(url)
         else:
-            selected_breed = breed_id
+            data = await hedged(lambda: _download_image_once(url), delay=delay)
+    except ImageTooLarge as e:
+        logger.warning(f"Пропускаю картинку {url}: {e}")
+        return None
+    if data is None:
+        return None
+    return await get_images().prepare(data)
+
+async def fetch_cat_photo_for_pool(breed_id: str):
+    """Загрузка фото для пула: 'random' превращается в случайную породу"""
+    selected_breed = pick_random_breed() if breed_id == 'random' else breed_id
+    return await fetch_cat_photo(selected_breed)
 
-        url = f"https://api.thecatapi.com/v1/images/search?breed_ids={selected_breed}"
+async def get_cat_photo_by_breed(breed_id: str):
+    """Фото котика породы с запасными вариантами; словарь как у fetch_cat_photo или None.
+
+    Если для породы ничего не нашлось, делается общий запрос. Если API
+    недоступно (ошибка сети, таймаут, разомкнутый предохранитель), к нему
+    не обращаемся повторно, а сразу берем готовое фото любой породы из пула.
+    """
+    if not get_upstreams()['thecatapi'].available:
+        logger.debug("TheCatAPI временно недоступно, фото берется из пула")
+        return await cat_pool.take_any()
+    try:
+        selected_breed = pick_random_breed() if breed_id == 'random' else breed_id
         logger.debug(f"Запрос фото котика породы: {selected_breed}")
 
-        async with aiohttp.ClientSession() as session:
-            proxy = PROXY_URL if USE_PROXY else None
-            async with session.get(url, proxy=proxy, timeout=aiohttp.ClientTimeout(total=5)) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if data and len(data) > 0:
-                        cat_image_url = data[0]['url']
-                        async with session.get(cat_image_url, proxy=proxy, timeout=aiohttp.ClientTimeout(total=10)) as img_response:
-                            if img_response.status == 200:
-                                image_data = await img_response.read()
-                                logger.info(f"Успешно получено фото котика породы {selected_breed}")
-                                return image_data, selected_breed
+        photo = await fetch_cat_photo(selected_breed)
+        if photo:
+            logger.info(f"Успешно получено фото котика породы {selected_breed}")
+            return photo
 
         logger.warning(f"Не удалось получить фото породы {selected_breed}, пробую общий запрос")
         return await get_simple_cat_photo()
 
     except aiohttp.ClientError as e:
         logger.warning(f"Ошибка сети при получении фото котика: {e}")
-        return await get_simple_cat_photo()
+        return await cat_pool.take_any()
+    except asyncio.TimeoutError:
+        logger.warning("Таймаут при получении фото котика")
+        return await cat_pool.take_any()
     except Exception as e:
         logger.error(f"Неизвестная ошибка при получении фото котика: {e}")
         return await get_simple_cat_photo()
 
 async def get_simple_cat_photo():
     try:
-        url = "https://api.thecatapi.com/v1/images/search"
-        async with aiohttp.ClientSession() as session:
-            proxy = PROXY_URL if USE_PROXY else None
-            async with session.get(url, proxy=proxy, timeout=aiohttp.ClientTimeout(total=5)) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    cat_image_url = data[0]['url']
-                    async with session.get(cat_image_url, proxy=proxy, timeout=aiohttp.ClientTimeout(total=10)) as img_response:
-                        if img_response.status == 200:
-                            image_data = await img_response.read()
-                            logger.info("Успешно получено случайное фото котика")
-                            return image_data, "random"
+        photo = await fetch_cat_photo()
+        if photo:
+            logger.info("Успешно получено случайное фото котика")
+        return photo
     except aiohttp.ClientError as e:
         logger.warning(f"Ошибка сети при получении случайного фото котика: {e}")
-        return None, "unknown"
+        return None
     except Exception as e:
         logger.error(f"Неизвестная ошибка при получении случайного фото котика: {e}")
-        return None, "unknown"
+        return None
+
+cat_pool = CatPhotoPool(
+    fetch_cat_photo_for_pool,
+    CAT_BREEDS,
+    depth=settings.cat_pool_depth,
+    max_age=settings.cat_pool_max_age,
+    shared=shared_cache,
+)
+
+async def fetch_weather_data(lat: float, lon: float):
+    """Запрос к OpenWeatherMap; None при неуспешном статусе ответа"""
+    url = f'{settings.weather_api_url}?APPID={settings.token_weather}&lang=ru&units=metric&lat={lat}&lon={lon}'
+
+    logger.debug(f"Запрос погоды для координат: {lat}, {lon}")
+    async with get_upstreams()['openweathermap'].request() as call, \
+            http.get(url, timeout=call.timeout) as resp:
+        if resp.status != 200:
+            UPSTREAM_ERRORS.inc('openweathermap', 'status')
+            if resp.status >= 500:
+                call.fail()
+            logger.warning(f"Ошибка API погоды, статус: {resp.status}")
+            return None
+        data = await resp.json()
+        logger.info(f"Успешно получена погода для {data.get('name', 'неизвестного места')}")
+        return data
+
+weather_cache = WeatherCache(
+    fetch_weather_data,
+    grid=settings.weather_cache_grid,
+    ttl=settings.weather_cache_ttl,
+    max_entries=settings.weather_cache_size,
+    shared=shared_cache,
+)
 
 async def get_weather(lat: float, lon: float) -> str:
-    if not TOKEN_WEATHER:
+    if not settings.token_weather:
         logger.warning("Токен для погодного API не настроен")
         return "Токен для погодного API не настроен"
 
-    url = f'https://api.openweathermap.org/data/2.5/weather?APPID={TOKEN_WEATHER}&lang=ru&units=metric&lat={lat}&lon={lon}'
-
     try:
-        logger.debug(f"Запрос погоды для координат: {lat}, {lon}")
-        async with aiohttp.ClientSession() as session:
-            proxy = PROXY_URL if USE_PROXY else None
-            async with session.get(url, proxy=proxy, timeout=aiohttp.ClientTimeout(total=10)) as resp:
-                if resp.status != 200:
-                    logger.warning(f"Ошибка API погоды, статус: {resp.status}")
-                    return 'Ошибка при получении данных о погоде'
-                data = await resp.json()
-                logger.info(f"Успешно получена погода для {data.get('name', 'неизвестного места')}")
+        data = await weather_cache.get(lat, lon)
+        if data is None:
+            return 'Ошибка при получении данных о погоде'
     except aiohttp.ClientError as e:
         logger.warning(f"Ошибка сети при получении погоды: {e}")
-        return 'Ошибка подключения к серверу погоды'
+        return format_stale_weather(lat, lon) or 'Ошибка подключения к серверу погоды'
     except asyncio.TimeoutError:
         logger.warning("Таймаут при получении погоды")
-        return 'Сервер погоды не отвежает'
+        return format_stale_weather(lat, lon) or 'Сервер погоды не отвежает'
     except Exception as e:
         logger.error(f"Неизвестная ошибка при получении погоды: {e}")
         return 'Неизвестная ошибка при получении погоды'
 
+    return format_weather(data)
+
+def format_stale_weather(lat: float, lon: float):
+    """Устаревший прогноз из кэша, пока сервер погоды недоступен; None, если его нет"""
+    data = weather_cache.stale(lat, lon)
+    if data is None:
+        return None
+    return f"{format_weather(data)}\n(сервер погоды недоступен, показан последний известный прогноз)"
+
+def format_weather(data: dict) -> str:
     try:
         city = data.get('name', 'Неизвестное место')
         weather = data['weather'][0]['description']
@@ -207,15 +426,92 @@ async def get_weather(lat: float, lon: float) -> str:
         logger.error(f"Ошибка обработки данных о погоде: {e}")
         return 'Ошибка обработки данных о погоде'
 
+async def render_quote_broadcast():
+    """Текст рассылки цитаты дня; одна цитата на всех подписчиков"""
+    quote = await quote_buffer.get()
+    return format_quote(quote) if quote else None
+
+async def render_weather_broadcast(lat: float, lon: float):
+    """Текст утреннего прогноза для ячейки сетки; None, если погоды нет"""
+    if not settings.token_weather:
+        return None
+    data = await weather_cache.get(lat, lon)
+    if data is None:
+        return None
+    return f"Доброе утро! {format_weather(data)}"
+
+def get_broadcaster():
+    """Рассыльщик с базой подписок; None, если путь к базе не задан и рассылки выключены"""
+    global _broadcaster
+    if _broadcaster is None and settings.broadcast_db_path:
+        from broadcasts import SubscriptionStore, Broadcaster
+        _broadcaster = Broadcaster(
+            SubscriptionStore(settings.broadcast_db_path),
+            rate=settings.broadcast_rate,
+            batch_size=settings.broadcast_batch_size,
+            fetch_concurrency=settings.broadcast_fetch_concurrency,
+            timezone=settings.broadcast_timezone,
+        )
+        _broadcaster.register('quote', render_quote_broadcast)
+        _broadcaster.register('weather', render_weather_broadcast, per_area=True)
+    return _broadcaster
+
+def get_subscriptions():
+    """Хранилище подписок или None, если рассылки выключены"""
+    broadcaster = get_broadcaster()
+    return broadcaster.store if broadcaster is not None else None
+
+async def close_components():
+    """Остановка созданных по требованию компонентов; несозданные так и не загружаются"""
+    if _broadcaster is not None:
+        # Прерванная рассылка сохранила ход и продолжится при следующем запуске
+        await _broadcaster.close()
+    if _images is not None:
+        _images.close()
+    if _avatars is not None:
+        _avatars.close()
+
+# Обратный индекс пород строится один раз; при изменении CAT_BREEDS
+# его вместе с клавиатурой перестраивает refresh_menus()
+BREED_BY_NAME = build_breed_index(CAT_BREEDS)
+
+keyboards = KeyboardRegistry()
+keyboards.register(
+    'main',
+    # Через модуль: refresh_menus() подхватит и замененную раскладку
+    lambda: PrebuiltReplyKeyboardMarkup(routes.MAIN_MENU_ROWS, resize_keyboard=True),
+)
+keyboards.register(
+    'breeds',
+    lambda: PrebuiltReplyKeyboardMarkup(build_breed_menu_rows(CAT_BREEDS), resize_keyboard=True),
+)
+keyboards.register(
+    'location',
+    lambda: PrebuiltReplyKeyboardMarkup(
+        [[KeyboardButton(BUTTON_SEND_LOCATION, request_location=True)]],
+        resize_keyboard=True,
+        one_time_keyboard=True,
+    ),
+)
+
 def get_main_keyboard():
-    try:
-        from telegram import ReplyKeyboardMarkup
-        return ReplyKeyboardMarkup([
-            ['Фото котика', 'Сгенерировать аватар-котика'],
-            ['Цитата дня', 'Мой ID'],
-            ['Прогноз погоды']
-        ], resize_keyboard=True)
-    except Exception as e:
-        logger.error(f"Ошибка при создании клавиатуры: {e}")
-        from telegram import ReplyKeyboardMarkup
-        return ReplyKeyboardMarkup([['Фото котика'], ['Прогноз погоды']], resize_keyboard=True)
\ No newline at end of file
+    return keyboards.get('main')
+
+def get_breed_keyboard():
+    return keyboards.get('breeds')
+
+def get_location_keyboard():
+    return keyboards.get('location')
+
+def refresh_menus():
+    """Перестройка индекса пород и всех клавиатур после изменения CAT_BREEDS
+    или подписей кнопок (routes.MAIN_MENU_ROWS).
+
+    Индекс обновляется на месте, поэтому BREED_BY_NAME, импортированный
+    другими модулями, остается актуальным. Клавиатуры строятся заново
+    и сериализуются сразу, чтобы ответ не платил за это.
+    """
+    BREED_BY_NAME.clear()
+    BREED_BY_NAME.update(build_breed_index(CAT_BREEDS))
+    keyboards.invalidate()
+    keyboards.warm_up()
@@ -0,0 +1,133 @@
+"""Кэш погоды по ячейкам координатной сетки с объединением запросов"""
+
+import time
+import asyncio
+import logging
+from collections import deque
+
+# Создаем логгер для этого модуля
+logger = logging.getLogger(__name__)
+
+
+def percentile(values, q: float) -> float:
+    """Перцентиль q (0..100) по списку значений, 0.0 для пустого списка"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class WeatherCache:
+    """TTL-кэш ответов погодного API, ключ - координаты, округленные до сетки.
+
+    Одновременные промахи по одной ячейке объединяются в один запрос:
+    остальные вызовы ждут уже выполняющуюся задачу. Если передан shared,
+    перед запросом к API проверяется общий для всех процессов кэш.
+    """
+
+    def __init__(self, fetch, grid: float = 0.05, ttl: float = 600,
+                 max_entries: int = 10000, latency_window: int = 1000, shared=None):
+        # fetch - корутина (lat, lon) -> данные или None при ошибке API
+        self._fetch = fetch
+        self.grid = grid
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.shared = shared
+        self._items = {}
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.shared_hits = 0
+        self.stale_hits = 0
+        self._lookup_latency = deque(maxlen=latency_window)
+        self._upstream_latency = deque(maxlen=latency_window)
+
+    def bucket(self, lat: float, lon: float) -> tuple:
+        """Центр ячейки сетки, в которую попадают координаты"""
+        return (
+            round(round(lat / self.grid) * self.grid, 6),
+            round(round(lon / self.grid) * self.grid, 6),
+        )
+
+    async def get(self, lat: float, lon: float):
+        started = time.perf_counter()
+        key = self.bucket(lat, lon)
+        try:
+            entry = self._items.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+
+            task = self._inflight.get(key)
+            if task is not None:
+                self.coalesced += 1
+            else:
+                self.misses += 1
+                task = asyncio.ensure_future(self._fetch_and_store(key))
+                self._inflight[key] = task
+                task.add_done_callback(lambda _, key=key: self._inflight.pop(key, None))
+            return await asyncio.shield(task)
+        finally:
+            self._lookup_latency.append(time.perf_counter() - started)
+
+    def stale(self, lat: float, lon: float):
+        """Последние данные ячейки, даже с истекшим TTL; None, если их нет"""
+        entry = self._items.get(self.bucket(lat, lon))
+        if entry is None:
+            return None
+        self.stale_hits += 1
+        return entry[1]
+
+    async def _fetch_and_store(self, key: tuple):
+        shared_key = f'weather:{key[0]}:{key[1]}'
+        if self.shared is not None:
+            data = await self.shared.get(shared_key)
+            if data is not None:
+                self.shared_hits += 1
+                self._store(key, data)
+                return data
+
+        started = time.perf_counter()
+        try:
+            data = await self._fetch(*key)
+        finally:
+            self._upstream_latency.append(time.perf_counter() - started)
+        if data is not None:
+            self._store(key, data)
+            if self.shared is not None:
+                await self.shared.set(shared_key, data, ttl=self.ttl)
+        return data
+
+    def _store(self, key: tuple, data):
+        if len(self._items) >= self.max_entries:
+            self._prune()
+        self._items[key] = (time.monotonic() + self.ttl, data)
+
+    def _prune(self):
+        now = time.monotonic()
+        expired = [key for key, (expires_at, _) in self._items.items() if expires_at <= now]
+        for key in expired:
+            del self._items[key]
+        # Если всё еще переполнено, удаляем самые старые записи
+        while len(self._items) >= self.max_entries:
+            del self._items[next(iter(self._items))]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        lookup_ms = [value * 1000 for value in self._lookup_latency]
+        upstream_ms = [value * 1000 for value in self._upstream_latency]
+        return {
+            'size': len(self._items),
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'shared_hits': self.shared_hits,
+            'stale_hits': self.stale_hits,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'api_calls': self.misses - self.shared_hits,
+            'api_calls_saved': self.hits + self.coalesced + self.shared_hits,
+            'lookup_ms': {q: percentile(lookup_ms, q) for q in (50, 95, 99)},
+            'upstream_ms': {q: percentile(upstream_ms, q) for q in (50, 95, 99)},
+        }
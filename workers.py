@@ -0,0 +1,135 @@
+"""Режим нескольких процессов: один принимает обновления, остальные их обрабатывают"""
+
+import os
+import queue
+import signal
+import asyncio
+import logging
+import multiprocessing
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+
+from config import get_settings
+from update_processor import get_update_key
+
+# Создаем логгер для этого модуля
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHARED_CACHE_URL = 'sqlite:///shared_cache.sqlite3'
+
+# Как часто процесс-обработчик без обновлений проверяет, жив ли принимающий процесс
+PARENT_CHECK_INTERVAL = 1.0
+
+
+def get_worker_index(update: Update, workers: int) -> int:
+    """Номер процесса для обновления: все обновления одного пользователя попадают в один процесс.
+
+    user_data хранится по пользователю, поэтому в группах делить по чату
+    нельзя: строку одного пользователя держали бы и перезаписывали бы
+    два процесса. В личном чате id чата и пользователя совпадают.
+    """
+    user = getattr(update, 'effective_user', None)
+    key = user.id if user is not None else get_update_key(update)
+    if key is None:
+        key = update.update_id
+    return key % workers
+
+
+def _worker_main(index: int, updates):
+    # Остановкой управляет принимающий процесс через пустое сообщение в очереди
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_worker_loop(index, updates))
+
+
+async def _worker_loop(index: int, updates):
+    from bot import build_application
+
+    application = build_application(with_updater=False)
+    application.bot_data['worker_index'] = index
+    loop = asyncio.get_running_loop()
+    parent = multiprocessing.parent_process()
+
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        logger.info(f"Процесс-обработчик {index} запущен")
+
+        while True:
+            try:
+                data = await loop.run_in_executor(None, updates.get, True, PARENT_CHECK_INTERVAL)
+            except queue.Empty:
+                # Принимающий процесс мог завершиться аварийно, не отправив None
+                if parent is not None and not parent.is_alive():
+                    logger.warning(f"Принимающий процесс завершился, процесс-обработчик {index} останавливается")
+                    break
+                continue
+            if data is None:
+                break
+            await application.update_queue.put(Update.de_json(data, application.bot))
+
+        await application.stop()
+    finally:
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        logger.info(f"Процесс-обработчик {index} остановлен")
+
+
+def build_ingestion_application(worker_queues: list) -> Application:
+    """Приложение, которое только принимает обновления и раздает их процессам"""
+
+    async def fan_out(update: Update, context):
+        worker_queue = worker_queues[get_worker_index(update, len(worker_queues))]
+        data = update.to_dict()
+        try:
+            worker_queue.put_nowait(data)
+        except queue.Full:
+            # Процесс не успевает: ждем, не нарушая порядок обновлений
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, worker_queue.put, data)
+
+    from bot import create_builder
+
+    # Обработчики и внешние клиенты этому процессу не нужны и не импортируются
+    application = create_builder(get_settings()).build()
+    application.add_handler(TypeHandler(Update, fan_out))
+    return application
+
+
+def run_workers(count: int):
+    """Запуск count процессов-обработчиков и принимающего процесса"""
+    from bot import run_webhook
+
+    settings = get_settings()
+    # Настройки передаются дочерним процессам через окружение
+    if not os.getenv('SHARED_CACHE_URL'):
+        os.environ['SHARED_CACHE_URL'] = DEFAULT_SHARED_CACHE_URL
+    # Лимит Telegram общий на бота, поэтому делим его между процессами
+    os.environ['RATE_LIMIT_OVERALL'] = str(settings.rate_limit_overall / count)
+
+    context = multiprocessing.get_context('spawn')
+    worker_queues = [context.Queue(maxsize=settings.update_queue_size) for _ in range(count)]
+    processes = [
+        context.Process(target=_worker_main, args=(index, worker_queue), name=f'bot-worker-{index}')
+        for index, worker_queue in enumerate(worker_queues)
+    ]
+    for process in processes:
+        process.start()
+    logger.info(f"Запущено процессов-обработчиков: {count}")
+
+    try:
+        application = build_ingestion_application(worker_queues)
+        if settings.bot_mode == 'webhook':
+            run_webhook(application)
+        else:
+            application.run_polling()
+    finally:
+        for worker_queue in worker_queues:
+            worker_queue.put(None)
+        for process in processes:
+            process.join(timeout=30)
+            if process.is_alive():
+                logger.warning(f"Процесс {process.name} не завершился вовремя, останавливаем")
+                process.terminate()